@@ -12,5 +12,12 @@ import os
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'toll_system.settings')
+# Serve the hot endpoints with the native async views (see settings.ASYNC_VIEWS)
+os.environ.setdefault('ASYNC_VIEWS', 'True')
 
 application = get_asgi_application()
+
+# Preload the scan caches before this worker takes requests (settings.FIREBASE_WARMUP)
+from tollsystem_api.startup import warm_up  # noqa: E402
+
+warm_up()
@@ -15,8 +15,6 @@ import os
 
 from decouple import config
 import json
-import firebase_admin
-from firebase_admin import credentials
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -37,11 +35,158 @@ FIREBASE_CONFIG = {
 # Firebase Database URL
 FIREBASE_DATABASE_URL = config('FIREBASE_DATABASE_URL', default='https://toll-system-9b01a-default-rtdb.firebaseio.com/')
 
+# Service account key file. The Firebase app is initialized lazily, by the first
+# storage call in each process (a forked worker initializes its own); without the
+# file, FIREBASE_CONFIG is used if FIREBASE_PRIVATE_KEY is set.
+SERVICE_ACCOUNT_KEY_PATH = BASE_DIR / 'toll_system' / 'serviceAccountKey.json'  # adjust if you placed it elsewhere
+FIREBASE_CREDENTIALS_PATH = config('FIREBASE_CREDENTIALS_PATH', default=str(SERVICE_ACCOUNT_KEY_PATH))
+
+# Warm-up (wsgi.py, asgi.py, websocket_scanner): before serving, load the vehicle
+# index, pricing table and toll plazas, waiting up to FIREBASE_WARMUP_TIMEOUT
+# seconds for the change stream's initial snapshots
+FIREBASE_WARMUP = config('FIREBASE_WARMUP', default=True, cast=bool)
+FIREBASE_WARMUP_TIMEOUT = config('FIREBASE_WARMUP_TIMEOUT', default=30, cast=float)
+
 # Use environment variables or fallback to defaults
 SECRET_KEY = config('SECRET_KEY', default='django-insecure-your-secret-key-here')
 DEBUG = config('DEBUG', default=True, cast=bool)
 SCANNER_TOKEN = config('SCANNER_TOKEN', default='esp32-scanner-secret-token-2024')
 
+# Storage backend used by the API views: the Firebase Realtime Database service,
+# or 'tollsystem_api.orm_storage.OrmStorage' to use the Django database below
+STORAGE_BACKEND = config('STORAGE_BACKEND', default='tollsystem_api.firebase_service.FirebaseService')
+
+# Write-behind journal for transaction/payment records (Firebase backend): records
+# are acknowledged once committed to this local SQLite file and flushed to
+# Firebase in batched multi-path updates by a background thread
+WRITE_BEHIND_ENABLED = config('WRITE_BEHIND_ENABLED', default=True, cast=bool)
+WRITE_BEHIND_JOURNAL = config('WRITE_BEHIND_JOURNAL', default=str(BASE_DIR / 'write_behind.sqlite3'))
+WRITE_BEHIND_BATCH_SIZE = config('WRITE_BEHIND_BATCH_SIZE', default=200, cast=int)
+WRITE_BEHIND_FLUSH_INTERVAL = config('WRITE_BEHIND_FLUSH_INTERVAL', default=0.5, cast=float)
+# Failures after which a batch is halved on every retry; a record still failing
+# on its own is moved to the journal's dead table (see toll_write_behind_records)
+WRITE_BEHIND_MAX_ATTEMPTS = config('WRITE_BEHIND_MAX_ATTEMPTS', default=8, cast=int)
+
+# Read-through snapshot cache in FirebaseService: seconds a downloaded subtree is
+# served before it is re-read. This service's own writes update it immediately.
+FIREBASE_CACHE_DEFAULT_TTL = config('FIREBASE_CACHE_DEFAULT_TTL', default=30, cast=float)
+FIREBASE_CACHE_TTLS = {
+    'owners': config('FIREBASE_CACHE_TTL_OWNERS', default=60, cast=float),
+    'vehicles': config('FIREBASE_CACHE_TTL_VEHICLES', default=30, cast=float),
+    'tollPlazas': config('FIREBASE_CACHE_TTL_TOLL_PLAZAS', default=300, cast=float),
+    'pricingRules': config('FIREBASE_CACHE_TTL_PRICING_RULES', default=300, cast=float),
+    # Read for scanner liveness (see SCANNER_OFFLINE_AFTER), so kept well below it
+    'hardwareEndpoints': config('FIREBASE_CACHE_TTL_HARDWARE_ENDPOINTS', default=5, cast=float),
+}
+
+# Realtime change stream: each process listens to vehicles, owners, pricingRules
+# and tollPlazas and applies changes to its caches as they happen, so those
+# subtrees are served without expiring. Stream lag is measured by writing a probe
+# under streamProbes/ every CHANGE_STREAM_PROBE_INTERVAL seconds (0 disables it);
+# a process removes its probe on shutdown and prunes any not refreshed for a minute.
+CHANGE_STREAM_ENABLED = config('CHANGE_STREAM_ENABLED', default=True, cast=bool)
+CHANGE_STREAM_PROBE_INTERVAL = config('CHANGE_STREAM_PROBE_INTERVAL', default=5, cast=float)
+# Seconds the in-memory vehicle index (balances, statuses, tags) is served while
+# no change stream keeps it current (stream disabled or lost) before it is
+# downloaded again
+VEHICLE_INDEX_MAX_AGE = config('VEHICLE_INDEX_MAX_AGE', default=30, cast=float)
+
+# Toll pricing: compiled rules are re-read from pricingRules after this many seconds.
+# Until they have been read once, scans fail (503) and the read is retried after
+# PRICING_RETRY_INTERVAL seconds
+PRICING_CACHE_TTL = config('PRICING_CACHE_TTL', default=300, cast=int)
+PRICING_RETRY_INTERVAL = config('PRICING_RETRY_INTERVAL', default=5, cast=float)
+
+# Time-of-day bands referenced by a pricing rule's optional `timeBand` field,
+# as (start_hour, end_hour) ranges in TIME_ZONE. Unlisted hours have no band.
+TOLL_TIME_BANDS = {
+    'peak': [(6, 9), (16, 19)],
+}
+
+# Bulk replay of reader-buffered scans (/api/toll/rfid-scan/bulk/): largest batch
+# accepted per request, and how many vehicles' balance transactions run at once
+BULK_SCAN_MAX_BATCH = config('BULK_SCAN_MAX_BATCH', default=10000, cast=int)
+BULK_SCAN_WORKERS = config('BULK_SCAN_WORKERS', default=16, cast=int)
+
+# Scan deduplication: a repeat read of the same tag at the same plaza/reader within
+# SCAN_DEDUP_WINDOW seconds, or a retry carrying the same Idempotency-Key header /
+# scan_id within SCAN_IDEMPOTENCY_TTL seconds, returns the first scan's result
+# instead of charging again (0 disables either). A duplicate of a scan still being
+# charged waits up to SCAN_DEDUP_WAIT seconds for its result.
+SCAN_DEDUP_WINDOW = config('SCAN_DEDUP_WINDOW', default=10, cast=float)
+SCAN_IDEMPOTENCY_TTL = config('SCAN_IDEMPOTENCY_TTL', default=600, cast=float)
+SCAN_DEDUP_MAX_ENTRIES = config('SCAN_DEDUP_MAX_ENTRIES', default=100000, cast=int)
+SCAN_DEDUP_WAIT = config('SCAN_DEDUP_WAIT', default=10, cast=float)
+
+# Licence plate matching (ANPR reads, /api/vehicle/plate-lookup/): reads up to
+# PLATE_MATCH_MAX_DISTANCE edits from a registered plate are matched, after folding
+# OCR-confusable characters (O/0, I/1, B/8, ...); 0 allows only exact and folded
+# matches. A scan without a known tag is charged by its plate read only when the
+# best match has at least PLATE_MATCH_MIN_CONFIDENCE.
+PLATE_MATCH_MAX_DISTANCE = config('PLATE_MATCH_MAX_DISTANCE', default=2, cast=int)
+PLATE_MATCH_MIN_CONFIDENCE = config('PLATE_MATCH_MIN_CONFIDENCE', default=0.9, cast=float)
+
+# Watchlist alerts (/api/admin/watchlist/alerts/): scans matching a suspended
+# vehicle's tag or plate are kept in memory, the latest WATCHLIST_ALERT_BUFFER of them
+WATCHLIST_ALERT_BUFFER = config('WATCHLIST_ALERT_BUFFER', default=1000, cast=int)
+
+# Balance ledger (manage.py reconcile_ledger): snapshots cover ledger entries at
+# least LEDGER_SNAPSHOT_SETTLE seconds old, so records still queued for write-behind
+# are not skipped by them
+LEDGER_SNAPSHOT_SETTLE = config('LEDGER_SNAPSHOT_SETTLE', default=300, cast=float)
+
+# Archive tier (manage.py archive_records): transactions and payments older than
+# ARCHIVE_RETENTION_DAYS are moved from Firebase into memory-mapped columnar files,
+# one per UTC day, under ARCHIVE_DIR; owner history and exports read both tiers
+ARCHIVE_DIR = config('ARCHIVE_DIR', default=str(BASE_DIR / 'archive'))
+ARCHIVE_RETENTION_DAYS = config('ARCHIVE_RETENTION_DAYS', default=90, cast=int)
+
+# Analytics reports (/api/admin/analytics/<report>/): each UTC day's tolls are
+# summed once and cached, archived days until their file changes, live days for
+# ANALYTICS_CACHE_TTL seconds and today for ANALYTICS_LIVE_TTL; a report covers
+# at most ANALYTICS_MAX_DAYS days, and ANALYTICS_CACHE_DAYS days stay cached
+ANALYTICS_CACHE_TTL = config('ANALYTICS_CACHE_TTL', default=3600, cast=float)
+ANALYTICS_LIVE_TTL = config('ANALYTICS_LIVE_TTL', default=60, cast=float)
+ANALYTICS_MAX_DAYS = config('ANALYTICS_MAX_DAYS', default=366, cast=int)
+ANALYTICS_CACHE_DAYS = config('ANALYTICS_CACHE_DAYS', default=400, cast=int)
+
+# Vehicles with a balance below this count as low-balance on the dashboard
+LOW_BALANCE_THRESHOLD = config('LOW_BALANCE_THRESHOLD', default=10, cast=float)
+
+# Scanner liveness: heartbeats are kept in memory and written to hardwareEndpoints
+# in one batch per interval; a scanner whose last heartbeat (by any worker) is more
+# than SCANNER_OFFLINE_AFTER seconds old is reported offline
+HEARTBEAT_FLUSH_INTERVAL = config('HEARTBEAT_FLUSH_INTERVAL', default=10, cast=float)
+SCANNER_OFFLINE_AFTER = config('SCANNER_OFFLINE_AFTER', default=30, cast=float)
+
+# Metrics served at /metrics: fraction of requests whose latency, payload sizes,
+# storage calls and scan stages are timed. Scan counts and latency by plaza/outcome
+# are always kept.
+METRICS_SAMPLE_RATE = config('METRICS_SAMPLE_RATE', default=1.0, cast=float)
+
+# Outbound HTTP connection pools (tollsystem_api.http_pool), shared by the Firebase
+# REST session and the scanner integration client. Connections are kept alive and
+# reused; the scanner client negotiates HTTP/2 where the server supports it.
+HTTP_POOL_MAXSIZE = config('HTTP_POOL_MAXSIZE', default=32, cast=int)
+HTTP_POOL_CONNECTIONS = config('HTTP_POOL_CONNECTIONS', default=4, cast=int)
+HTTP_POOL_BLOCK = config('HTTP_POOL_BLOCK', default=False, cast=bool)
+HTTP_KEEPALIVE_EXPIRY = config('HTTP_KEEPALIVE_EXPIRY', default=30, cast=float)
+HTTP_CONNECT_TIMEOUT = config('HTTP_CONNECT_TIMEOUT', default=5, cast=float)
+HTTP_READ_TIMEOUT = config('HTTP_READ_TIMEOUT', default=10, cast=float)
+HTTP2_ENABLED = config('HTTP2_ENABLED', default=True, cast=bool)
+FIREBASE_HTTP_TIMEOUT = config('FIREBASE_HTTP_TIMEOUT', default=30, cast=float)
+
+# Async serving (set by asgi.py): the scan, owner and recharge endpoints are
+# routed to native async views. Storage calls with no non-blocking path run on
+# a pool of ASYNC_STORAGE_THREADS; Firebase REST calls share one async client
+# per event loop holding up to HTTP_ASYNC_POOL_MAXSIZE connections.
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+ASYNC_STORAGE_THREADS = config('ASYNC_STORAGE_THREADS', default=32, cast=int)
+HTTP_ASYNC_POOL_MAXSIZE = config('HTTP_ASYNC_POOL_MAXSIZE', default=256, cast=int)
+
+# Base URL the scanner integration posts scans to
+DJANGO_API_URL = config('DJANGO_API_URL', default='http://127.0.0.1:8000/api')
+
 ALLOWED_HOSTS = ['127.0.0.1', 'localhost', '0.0.0.0', 'nomqhelemoyo.pythonanywhere.com']
 
 INSTALLED_APPS = [
@@ -57,6 +202,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'tollsystem_api.middleware.MetricsMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -108,6 +254,10 @@ CORS_ALLOWED_ORIGINS = [
 CORS_ALLOW_CREDENTIALS = True
 CORS_ALLOW_ALL_ORIGINS = True
 
+CORS_EXPOSE_HEADERS = [
+    'x-next-cursor',
+]
+
 CORS_ALLOW_HEADERS = [
     'accept',
     'accept-encoding',
@@ -119,6 +269,7 @@ CORS_ALLOW_HEADERS = [
     'x-csrftoken',
     'x-requested-with',
     'x-scanner-token',
+    'idempotency-key',
 ]
 
 CSRF_TRUSTED_ORIGINS = [
@@ -136,6 +287,12 @@ REST_FRAMEWORK = {
     ],
 }
 
+# List endpoints given ?limit= or ?cursor= return one page per request; the next
+# page's cursor is sent in the X-Next-Cursor response header. Without either they
+# return the whole list, as the frontend expects
+API_PAGE_SIZE = config('API_PAGE_SIZE', default=100, cast=int)
+API_MAX_PAGE_SIZE = config('API_MAX_PAGE_SIZE', default=1000, cast=int)
+
 # Internationalization
 LANGUAGE_CODE = 'en-us'
 TIME_ZONE = 'UTC'
@@ -147,22 +304,3 @@ STATIC_URL = '/static/'
 
 # Default primary key field type
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
-
-SERVICE_ACCOUNT_KEY_PATH = BASE_DIR / 'toll_system' / 'serviceAccountKey.json'  # adjust if you placed it elsewhere
-
-# debug + safe firebase initialization
-print("SERVICE_ACCOUNT_KEY_PATH:", SERVICE_ACCOUNT_KEY_PATH)
-print("SERVICE_ACCOUNT_KEY_PATH.exists():", SERVICE_ACCOUNT_KEY_PATH.exists())
-try:
-    if SERVICE_ACCOUNT_KEY_PATH.exists():
-        cred = credentials.Certificate(str(SERVICE_ACCOUNT_KEY_PATH))
-        # avoid re-initializing if apps already exist
-        if not getattr(firebase_admin, "_apps", None):
-            firebase_admin.initialize_app(cred, {'databaseURL': FIREBASE_DATABASE_URL})
-            print("Firebase initialized from service account")
-        else:
-            print("Firebase already initialized")
-    else:
-        print("Firebase credentials not found or path not set")
-except Exception as e:
-    print("Firebase initialization error:", e)
@@ -18,7 +18,10 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from tollsystem_api import views as api_views
+
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/', include('tollsystem_api.urls')),
+    path('metrics', api_views.metrics, name='metrics'),
 ]
\ No newline at end of file
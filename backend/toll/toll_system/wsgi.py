@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'toll_system.settings')
 
 application = get_wsgi_application()
+
+# Preload the scan caches before this worker takes requests (settings.FIREBASE_WARMUP)
+from tollsystem_api.startup import warm_up  # noqa: E402
+
+warm_up()
@@ -0,0 +1,344 @@
+import os
+import threading
+import time
+from concurrent.futures import Future
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from cachetools import LRUCache
+from django.conf import settings
+
+from .archive import Archive, timestamp_micros
+from .record_keys import parse_timestamp
+from .storage import storage
+from .stats import to_cents
+
+# Traffic and revenue reports over the transaction history. Each UTC day is
+# summed once into per-group keys, toll counts and revenue cents (see
+# summarize) and cached; a report adds up the days it covers with one
+# bincount per group
+REPORTS = ('plaza-hours', 'vehicle-types', 'heatmap', 'top-vehicles')
+GROUPS = ('plazaHour', 'vehicleType', 'heatmap', 'vehicle')
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+
+HOUR_MICROS = 3600 * 10 ** 6
+DAY_MICROS = 24 * HOUR_MICROS
+
+
+class Labels:
+    """Dense integer codes for the values of one dimension (plaza ids, vehicle
+    types, vehicle ids), stable for the life of the process so that cached
+    day summaries can be added up"""
+
+    def __init__(self):
+        self.values = []
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.values)
+
+    def code(self, value):
+        code = self._codes.get(value)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(value)
+                if code is None:
+                    code = self._codes[value] = len(self.values)
+                    self.values.append(value)
+        return code
+
+
+def summarize(stamps, cents, plazas, types, vehicles):
+    """{group: (keys, counts, cents)} of one day's tolls, keys ascending.
+
+    Columns are int64 arrays: microsecond timestamps, amounts in cents and
+    the Labels codes of each toll's plaza, vehicle type and vehicle.
+    """
+    hours = stamps // HOUR_MICROS % 24
+    # 1970-01-01 was a Thursday
+    weekdays = (stamps // DAY_MICROS + 3) % 7
+    summary = {}
+    for group, keys in zip(GROUPS, (plazas * 24 + hours, types, weekdays * 24 + hours, vehicles)):
+        unique, inverse = np.unique(keys, return_inverse=True)
+        summary[group] = (
+            unique,
+            np.bincount(inverse, minlength=len(unique)),
+            np.bincount(inverse, weights=cents, minlength=len(unique)).astype(np.int64),
+        )
+    return summary
+
+
+def combine(summaries, group, size):
+    """(counts, cents) of a group over several day summaries, indexed by key"""
+    parts = [summary[group] for summary in summaries]
+    if not parts:
+        return np.zeros(size, dtype=np.int64), np.zeros(size, dtype=np.int64)
+    keys = np.concatenate([keys for keys, _, _ in parts])
+    counts = np.bincount(keys, weights=np.concatenate([counts for _, counts, _ in parts]), minlength=size)
+    cents = np.bincount(keys, weights=np.concatenate([cents for _, _, cents in parts]), minlength=size)
+    return counts.astype(np.int64), cents.astype(np.int64)
+
+
+def _revenue(cents):
+    return (cents / 100).round(2).tolist()
+
+
+def _day(value):
+    return value.strftime('%Y%m%d')
+
+
+class ReportParams:
+    """`since`, `until` (dates or ISO-8601 timestamps, rounded out to whole UTC
+    days), `limit` and `by` query parameters of a report"""
+
+    def __init__(self, first, last, limit=10, by='count'):
+        self.first = first
+        self.last = last
+        self.limit = limit
+        self.by = by
+
+    @classmethod
+    def from_request(cls, request):
+        until = request.GET.get('until')
+        since = request.GET.get('since')
+        last = parse_timestamp(until) if until else datetime.now(timezone.utc)
+        if last is None:
+            raise ValueError('until must be a date or an ISO-8601 timestamp')
+        first = parse_timestamp(since) if since else last - timedelta(days=29)
+        if first is None:
+            raise ValueError('since must be a date or an ISO-8601 timestamp')
+        first, last = first.date(), last.date()
+        max_days = getattr(settings, 'ANALYTICS_MAX_DAYS', 366)
+        if first > last or (last - first).days >= max_days:
+            raise ValueError(f'since must not be after until, and cover at most {max_days} days')
+        try:
+            limit = int(request.GET.get('limit', 10))
+        except ValueError:
+            raise ValueError('limit must be an integer')
+        if not 1 <= limit <= 1000:
+            raise ValueError('limit must be 1-1000')
+        by = request.GET.get('by', 'count')
+        if by not in ('count', 'revenue'):
+            raise ValueError("by must be 'count' or 'revenue'")
+        return cls(first, last, limit, by)
+
+    def days(self):
+        return [self.first + timedelta(days=offset) for offset in range((self.last - self.first).days + 1)]
+
+
+class TrafficAnalytics:
+    """Reports over archived and live transactions, from cached day summaries.
+
+    An archived day is summed straight from its partition's columns and kept
+    until the partition file is replaced. Live days are read through
+    `records` (storage.iter_records) in one pass over the stale ones and kept
+    `ttl` seconds, today's `live_ttl`, or until that day's partition changes:
+    live records whose id is also archived (an archive run was interrupted
+    between writing and deleting them) are left out. At most `max_days`
+    summaries of each kind are kept.
+
+    Summaries are computed outside the cache lock; a live day is read by one
+    caller at a time while concurrent callers for it wait for the result.
+    """
+
+    def __init__(self, records, archive_dir=None, ttl=3600, live_ttl=60, max_days=400):
+        self._records = records
+        self._archive_dir = archive_dir
+        self._archive = None
+        self._ttl = ttl
+        self._live_ttl = live_ttl
+        self._archived = LRUCache(maxsize=max_days)
+        self._live = LRUCache(maxsize=max_days)
+        self._lock = threading.Lock()
+        self._loading = {}
+        self.plazas = Labels()
+        self.types = Labels()
+        self.vehicles = Labels()
+
+    def _recode(self, partition, field, labels):
+        """Labels codes of a partition's dictionary-encoded field, 'unknown' where missing"""
+        codes = partition.codes(field)
+        if codes is None:
+            return np.full(partition.rows, labels.code('unknown'), dtype=np.int64)
+        lookup = [labels.code(value.decode()) for value in partition.values(field).tolist()]
+        # Missing values are coded -1, which picks the 'unknown' appended last
+        lookup.append(labels.code('unknown'))
+        return np.array(lookup, dtype=np.int64)[codes]
+
+    def _partition_summary(self, partition):
+        return summarize(
+            partition.timestamps,
+            partition.cents,
+            self._recode(partition, 'tollPlazaId', self.plazas),
+            self._recode(partition, 'vehicleType', self.types),
+            self._recode(partition, 'vehicleId', self.vehicles),
+        )
+
+    def _rows_summary(self, rows):
+        """Summary of [(micros, cents, plaza, vehicle type, vehicle id)]"""
+        columns = list(zip(*rows)) or [(), (), (), (), ()]
+        return summarize(
+            np.array(columns[0], dtype=np.int64),
+            np.array(columns[1], dtype=np.int64),
+            np.array([self.plazas.code(plaza) for plaza in columns[2]], dtype=np.int64),
+            np.array([self.types.code(vehicle_type) for vehicle_type in columns[3]], dtype=np.int64),
+            np.array([self.vehicles.code(vehicle_id) for vehicle_id in columns[4]], dtype=np.int64),
+        )
+
+    def _archived_summaries(self, days):
+        """{day: (partition, summary)} of the days in `days` that have a partition"""
+        if not self._archive_dir or not os.path.isdir(os.path.join(self._archive_dir, 'transactions')):
+            return {}
+        if self._archive is None:
+            self._archive = Archive(self._archive_dir)
+        archived = {}
+        for day in days:
+            partition = self._archive.partition('transactions', day)
+            if partition is None:
+                continue
+            with self._lock:
+                cached = self._archived.get(day)
+            if cached is None or cached[0] is not partition:
+                cached = (partition, self._partition_summary(partition))
+                with self._lock:
+                    self._archived[day] = cached
+            archived[day] = cached
+        return archived
+
+    def _read_live(self, days, partitions):
+        """{day: summary} of the live tolls of `days` (ascending), read in one pass,
+        without those whose id is in the day's partition in `partitions`"""
+        rows = {day: [] for day in days}
+        ids = {day: [] for day in days}
+        since = datetime.strptime(days[0], '%Y%m%d').replace(tzinfo=timezone.utc)
+        until = datetime.strptime(days[-1], '%Y%m%d').replace(tzinfo=timezone.utc) + timedelta(days=1)
+        for record in self._records('transactions', since=since, until=until, archived=False):
+            micros = timestamp_micros(record.get('timestamp'))
+            if micros is None:
+                continue
+            day = _day(datetime(1970, 1, 1) + timedelta(microseconds=micros))
+            day_rows = rows.get(day)
+            if day_rows is not None:
+                ids[day].append(str(record.get('id', '')).encode())
+                day_rows.append((
+                    micros,
+                    to_cents(record.get('amount', 0)),
+                    record.get('tollPlazaId') or 'unknown',
+                    record.get('vehicleType') or 'unknown',
+                    record.get('vehicleId') or 'unknown',
+                ))
+        summaries = {}
+        for day, day_rows in rows.items():
+            partition = partitions.get(day)
+            if partition is not None and day_rows:
+                live = np.isin(np.array(ids[day], dtype='S'), partition.ids, invert=True)
+                day_rows = [row for row, keep in zip(day_rows, live.tolist()) if keep]
+            summaries[day] = self._rows_summary(day_rows)
+        return summaries
+
+    def _live_summaries(self, days, partitions):
+        """Summaries of the live tolls of each day; `partitions` is {day: partition}"""
+        now = time.monotonic()
+        today = _day(datetime.now(timezone.utc))
+        summaries, waiting, stale = {}, {}, []
+        with self._lock:
+            for day in days:
+                cached = self._live.get(day)
+                if cached is not None and cached[0] > now and cached[1] is partitions.get(day):
+                    summaries[day] = cached[2]
+                elif day in self._loading:
+                    waiting[day] = self._loading[day]
+                else:
+                    self._loading[day] = Future()
+                    stale.append(day)
+        if stale:
+            try:
+                loaded = self._read_live(stale, partitions)
+            except BaseException as e:
+                with self._lock:
+                    for day in stale:
+                        self._loading.pop(day).set_exception(e)
+                raise
+            with self._lock:
+                for day, summary in loaded.items():
+                    expires_at = now + (self._live_ttl if day >= today else self._ttl)
+                    self._live[day] = (expires_at, partitions.get(day), summary)
+                    self._loading.pop(day).set_result(summary)
+            summaries.update(loaded)
+        for day, future in waiting.items():
+            summaries[day] = future.result()
+        return [summaries[day] for day in days]
+
+    def summaries(self, params):
+        """Summaries of the archived and the live tolls of each day in a report's range"""
+        days = [_day(day) for day in params.days()]
+        archived = self._archived_summaries(days)
+        partitions = {day: partition for day, (partition, _) in archived.items()}
+        return [summary for _, summary in archived.values()] + self._live_summaries(days, partitions)
+
+    def report(self, name, params):
+        summaries = self.summaries(params)
+        report = getattr(self, '_' + name.replace('-', '_'))(summaries, params)
+        report.update({
+            'since': params.first.isoformat(),
+            'until': params.last.isoformat(),
+            'generatedAt': datetime.now().isoformat(),
+        })
+        return report
+
+    def _plaza_hours(self, summaries, params):
+        """Tolls and revenue of each plaza by hour of day (UTC)"""
+        counts, cents = combine(summaries, 'plazaHour', len(self.plazas) * 24)
+        counts, cents = counts.reshape(-1, 24), cents.reshape(-1, 24)
+        plazas = {}
+        for code in np.flatnonzero(counts.sum(axis=1)).tolist():
+            plazas[self.plazas.values[code]] = {'count': counts[code].tolist(), 'revenue': _revenue(cents[code])}
+        return {'plazas': dict(sorted(plazas.items()))}
+
+    def _vehicle_types(self, summaries, params):
+        counts, cents = combine(summaries, 'vehicleType', len(self.types))
+        types = {
+            self.types.values[code]: {'count': int(counts[code]), 'revenue': round(int(cents[code]) / 100, 2)}
+            for code in np.flatnonzero(counts).tolist()
+        }
+        return {'vehicleTypes': dict(sorted(types.items()))}
+
+    def _heatmap(self, summaries, params):
+        """Tolls by weekday and hour of day (UTC), Monday first"""
+        counts, cents = combine(summaries, 'heatmap', 7 * 24)
+        peak = int(np.argmax(counts))
+        return {
+            'weekdays': list(WEEKDAYS),
+            'count': counts.reshape(7, 24).tolist(),
+            'revenue': _revenue(cents.reshape(7, 24)),
+            'peak': {'weekday': WEEKDAYS[peak // 24], 'hour': peak % 24, 'count': int(counts[peak])},
+        }
+
+    def _top_vehicles(self, summaries, params):
+        counts, cents = combine(summaries, 'vehicle', len(self.vehicles))
+        ranked = counts if params.by == 'count' else cents
+        top = np.flatnonzero(counts)
+        if len(top) > params.limit:
+            top = top[np.argpartition(-ranked[top], params.limit - 1)[:params.limit]]
+        top = top[np.lexsort((top, -ranked[top]))]
+        return {
+            'by': params.by,
+            'vehicles': [
+                {
+                    'vehicleId': self.vehicles.values[code],
+                    'count': int(counts[code]),
+                    'revenue': round(int(cents[code]) / 100, 2),
+                }
+                for code in top.tolist()
+            ],
+        }
+
+
+traffic_analytics = TrafficAnalytics(
+    lambda *args, **kwargs: storage.iter_records(*args, **kwargs),
+    archive_dir=getattr(settings, 'ARCHIVE_DIR', None),
+    ttl=getattr(settings, 'ANALYTICS_CACHE_TTL', 3600),
+    live_ttl=getattr(settings, 'ANALYTICS_LIVE_TTL', 60),
+    max_days=getattr(settings, 'ANALYTICS_CACHE_DAYS', 400),
+)
@@ -0,0 +1,310 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+from cachetools import LRUCache
+
+from .record_keys import owner_index_key, parse_timestamp, split_owner_index_key
+from .stats import to_cents
+
+# Records older than the retention window live in one file per collection and
+# UTC day, <root>/<collection>/<YYYYMMDD>.cols: the magic, an 8-byte header
+# length and a JSON header, then fixed-width columns aligned to ALIGNMENT bytes,
+# which readers view in place through a memory map
+PARTITION_SUFFIX = '.cols'
+PARTITION_MAGIC = b'TOLLCOL1'
+ALIGNMENT = 64
+
+# Every partition has these columns: ids as UTF-8 bytes, timestamps as int64
+# microseconds since the epoch and amounts as int64 cents. Other fields are
+# dictionary-encoded ('str', 'json': int32 codes into sorted unique values,
+# -1 where missing) or float64 ('float', NaN where missing)
+FIXED_COLUMNS = ('id', 'timestamp', 'amount')
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def timestamp_micros(value):
+    """Microseconds since the epoch of a timestamp (ISO-8601 string or datetime), or None"""
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return None
+    return (parsed - _EPOCH) // _MICROSECOND
+
+
+def _iso(micros):
+    return (datetime(1970, 1, 1) + timedelta(microseconds=micros)).isoformat() + 'Z'
+
+
+def _day(micros):
+    return (_EPOCH + timedelta(microseconds=micros)).strftime('%Y%m%d')
+
+
+def _field_kind(values):
+    present = [value for value in values if value is not None]
+    if all(isinstance(value, str) for value in present):
+        return 'str'
+    if all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in present):
+        return 'float'
+    return 'json'
+
+
+def _dictionary(strings):
+    """(codes, values) of a string column: values sorted and unique, code -1 where missing"""
+    encoded = [None if string is None else string.encode() for string in strings]
+    values = sorted({value for value in encoded if value is not None})
+    lookup = {value: code for code, value in enumerate(values)}
+    codes = np.fromiter((lookup.get(value, -1) for value in encoded), dtype=np.int32, count=len(encoded))
+    return codes, np.array(values, dtype='S')
+
+
+def _columns(records):
+    """Field kinds and named arrays of [(record_id, data)], ordered by timestamp then id"""
+    rows = sorted(
+        ((timestamp_micros(data.get('timestamp')), record_id, data) for record_id, data in records),
+        key=lambda row: (row[0], row[1]),
+    )
+    arrays = {
+        'id': np.array([record_id.encode() for _, record_id, _ in rows], dtype='S'),
+        'timestamp': np.array([micros for micros, _, _ in rows], dtype=np.int64),
+        'amount': np.array([to_cents(data.get('amount', 0)) for _, _, data in rows], dtype=np.int64),
+    }
+    fields = {}
+    names = sorted({name for _, _, data in rows for name in data if name not in FIXED_COLUMNS})
+    for name in names:
+        values = [data.get(name) for _, _, data in rows]
+        kind = fields[name] = _field_kind(values)
+        if kind == 'float':
+            arrays[name] = np.array([np.nan if value is None else value for value in values], dtype=np.float64)
+            continue
+        if kind == 'json':
+            values = [None if value is None else json.dumps(value) for value in values]
+        arrays[f'{name}.codes'], arrays[f'{name}.values'] = _dictionary(values)
+    return fields, arrays
+
+
+def _padding(size):
+    return b'\0' * (-size % ALIGNMENT)
+
+
+def write_partition(path, records):
+    """Write [(record_id, data)] as a partition file, atomically replacing any at `path`"""
+    fields, arrays = _columns(records)
+    specs, offset = {}, 0
+    for name, array in arrays.items():
+        specs[name] = [array.dtype.str, len(array), offset]
+        offset += array.nbytes + len(_padding(array.nbytes))
+    header = json.dumps({'rows': len(arrays['id']), 'fields': fields, 'arrays': specs}).encode()
+    temporary = f'{path}.{os.getpid()}.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(PARTITION_MAGIC + len(header).to_bytes(8, 'little') + header)
+        f.write(_padding(16 + len(header)))
+        for array in arrays.values():
+            f.write(array.tobytes())
+            f.write(_padding(array.nbytes))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary, path)
+
+
+class ArchivePartition:
+    """One day of a collection, its columns viewed in place over a read-only memory map"""
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        if self._buffer[:8].tobytes() != PARTITION_MAGIC:
+            raise ValueError(f'{path} is not an archive partition')
+        size = int.from_bytes(self._buffer[8:16].tobytes(), 'little')
+        header = json.loads(self._buffer[16:16 + size].tobytes())
+        start = 16 + size + len(_padding(16 + size))
+        self.rows = header['rows']
+        self.fields = header['fields']
+        self._arrays = {}
+        for name, (dtype, length, offset) in header['arrays'].items():
+            dtype = np.dtype(dtype)
+            begin = start + offset
+            self._arrays[name] = self._buffer[begin:begin + dtype.itemsize * length].view(dtype)
+
+    @property
+    def ids(self):
+        return self._arrays['id']
+
+    @property
+    def timestamps(self):
+        return self._arrays['timestamp']
+
+    @property
+    def cents(self):
+        return self._arrays['amount']
+
+    def column(self, field):
+        """The float64 column of a 'float' field, or None"""
+        return self._arrays.get(field) if self.fields.get(field) == 'float' else None
+
+    def codes(self, field):
+        """The int32 codes of a dictionary-encoded field, or None"""
+        return self._arrays.get(f'{field}.codes')
+
+    def values(self, field):
+        """The sorted UTF-8 values the codes of `field` index, or None"""
+        return self._arrays.get(f'{field}.values')
+
+    def code(self, field, value):
+        """The code of `value` in a dictionary-encoded field, or -1 if no row has it"""
+        values = self.values(field)
+        if values is None or not len(values):
+            return -1
+        key = str(value).encode()
+        index = int(np.searchsorted(values, key))
+        return index if index < len(values) and values[index] == key else -1
+
+    def records(self, rows=None):
+        """Records at `rows` (default all), in that order, shaped as stored live with their 'id'"""
+        rows = np.arange(self.rows) if rows is None else np.asarray(rows, dtype=np.int64)
+        records = [
+            {'id': record_id.decode(), 'timestamp': _iso(micros), 'amount': cents / 100}
+            for record_id, micros, cents in zip(
+                self.ids[rows].tolist(), self.timestamps[rows].tolist(), self.cents[rows].tolist()
+            )
+        ]
+        for field, kind in self.fields.items():
+            if kind == 'float':
+                for record, value in zip(records, self._arrays[field][rows].tolist()):
+                    if value == value:  # NaN where missing
+                        record[field] = value
+                continue
+            codes, values = self.codes(field)[rows], self.values(field)
+            values = values[np.maximum(codes, 0)].tolist() if len(values) else []
+            for record, code, value in zip(records, codes.tolist(), values):
+                if code >= 0:
+                    record[field] = json.loads(value) if kind == 'json' else value.decode()
+        return records
+
+
+class Archive:
+    """The archive tier under `root`: partitions are opened on first read and kept
+    open, up to `max_open`, until their file is replaced"""
+
+    def __init__(self, root, max_open=256):
+        self.root = root
+        self._open = LRUCache(maxsize=max_open)
+        self._lock = threading.Lock()
+
+    def _path(self, collection, day):
+        return os.path.join(self.root, collection, day + PARTITION_SUFFIX)
+
+    def days(self, collection):
+        """Archived days of a collection as 'YYYYMMDD', oldest first"""
+        try:
+            names = os.listdir(os.path.join(self.root, collection))
+        except FileNotFoundError:
+            return []
+        return sorted(name[:-len(PARTITION_SUFFIX)] for name in names if name.endswith(PARTITION_SUFFIX))
+
+    def partition(self, collection, day):
+        """The partition of a day, or None if that day has none"""
+        path = self._path(collection, day)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        version = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            cached = self._open.get(path)
+        if cached is not None and cached[0] == version:
+            return cached[1]
+        partition = ArchivePartition(path)
+        with self._lock:
+            self._open[path] = (version, partition)
+        return partition
+
+    def write(self, collection, records):
+        """Add [(record_id, data)] to their days' partitions, replacing records with
+        the same id. Returns the number written; records without a readable
+        timestamp are skipped. Not safe against concurrent writers"""
+        by_day = {}
+        for record_id, data in records:
+            micros = timestamp_micros(data.get('timestamp'))
+            if micros is not None:
+                by_day.setdefault(_day(micros), {})[record_id] = data
+        os.makedirs(os.path.join(self.root, collection), exist_ok=True)
+        for day, rows in by_day.items():
+            existing = self.partition(collection, day)
+            if existing is not None:
+                merged = {record.pop('id'): record for record in existing.records()}
+                merged.update(rows)
+                rows = merged
+            write_partition(self._path(collection, day), list(rows.items()))
+        return sum(len(rows) for rows in by_day.values())
+
+    def _selected(self, collection, since, until):
+        """(day, partition) within [since, until] (microseconds or None), oldest first"""
+        first = _day(since) if since is not None else None
+        last = _day(until) if until is not None else None
+        for day in self.days(collection):
+            if (first is None or day >= first) and (last is None or day <= last):
+                partition = self.partition(collection, day)
+                if partition is not None:
+                    yield day, partition
+
+    def owner_records(self, collection, owner_id, limit=None, after=None, since=None, until=None):
+        """Return (records, next_key) for an owner, newest first, paged like the live
+        owner index: `after` and next_key are owner index keys"""
+        since, until = timestamp_micros(since), timestamp_micros(until)
+        after_micros = after_id = None
+        if after:
+            stamp, after_id = split_owner_index_key(after)
+            after_micros = timestamp_micros(stamp)
+        bounds = [bound for bound in (until, after_micros) if bound is not None]
+        upper = min(bounds) if bounds else None
+        records = []
+        for _, partition in reversed(list(self._selected(collection, since, upper))):
+            code = partition.code('ownerId', owner_id)
+            if code < 0:
+                continue
+            rows = np.flatnonzero(partition.codes('ownerId') == code)
+            stamps = partition.timestamps[rows]
+            keep = np.ones(len(rows), dtype=bool)
+            if since is not None:
+                keep &= stamps >= since
+            if until is not None:
+                keep &= stamps <= until
+            if after_micros is not None:
+                # Index keys order by timestamp, then id
+                keep &= (stamps < after_micros) | (
+                    (stamps == after_micros) & (partition.ids[rows] < after_id.encode())
+                )
+            rows = rows[keep][::-1]
+            if limit:
+                rows = rows[:limit + 1 - len(records)]
+            records.extend(partition.records(rows))
+            if limit and len(records) > limit:
+                break
+        next_key = None
+        if limit and len(records) > limit:
+            records = records[:limit]
+            next_key = owner_index_key(records[-1]['timestamp'], records[-1]['id'])
+        return records, next_key
+
+    def iter_records(self, collection, since=None, until=None, plaza=None, chunk_size=1000):
+        """Yield archived records within [since, until] and charged at `plaza` (see
+        export.record_in_range), with their 'id', oldest day first"""
+        since, until = timestamp_micros(since), timestamp_micros(until)
+        for _, partition in self._selected(collection, since, until):
+            keep = np.ones(partition.rows, dtype=bool)
+            if since is not None:
+                keep &= partition.timestamps >= since
+            if until is not None:
+                keep &= partition.timestamps <= until
+            if plaza is not None:
+                code = partition.code('tollPlazaId', plaza)
+                if code < 0:
+                    continue
+                keep &= partition.codes('tollPlazaId') == code
+            rows = np.flatnonzero(keep)
+            for offset in range(0, len(rows), chunk_size):
+                yield from partition.records(rows[offset:offset + chunk_size])
@@ -0,0 +1,198 @@
+"""Native async versions of the hot endpoints, routed instead of the DRF views
+when ASYNC_VIEWS is set (the ASGI deployment).
+
+DRF's @api_view only runs synchronously, and under ASGI every sync view holds
+a worker thread for as long as its Firebase calls take. These views await
+the async storage methods instead, so a lane request waiting on Firebase
+costs a coroutine rather than a thread. Responses match the DRF views.
+"""
+import asyncio
+import functools
+import json
+import logging
+from datetime import datetime
+
+from django.http import HttpResponseNotAllowed, JsonResponse
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+
+from .export import EXPORT_COLLECTIONS, ExportParams, aiter_chunks, export_chunks, export_response
+from .pagination import PageParams, paginated_response
+from .storage import storage
+from .toll_processing import aprocess_toll_scan, is_valid_scanner_token
+
+logger = logging.getLogger(__name__)
+
+
+def _response(data, status_code=status.HTTP_200_OK):
+    return JsonResponse(data, status=status_code, safe=False, encoder=JSONEncoder)
+
+
+def async_api_view(methods):
+    """Allow only `methods` and, like DRF for unauthenticated clients, skip CSRF checks"""
+
+    def decorator(view):
+        @functools.wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            if request.method not in methods:
+                return HttpResponseNotAllowed(methods)
+            return await view(request, *args, **kwargs)
+
+        wrapper.csrf_exempt = True
+        return wrapper
+
+    return decorator
+
+
+def _request_data(request):
+    if request.content_type == 'application/json':
+        return json.loads(request.body)
+    return request.POST.dict()
+
+
+def _vehicle_list(vehicles):
+    result = []
+    for vehicle_id, vehicle in (vehicles or {}).items():
+        vehicle['id'] = vehicle_id
+        result.append(vehicle)
+    return result
+
+
+@async_api_view(['POST'])
+async def rfid_toll_scan(request):
+    """Process RFID scan from scanner hardware"""
+    try:
+        token = request.headers.get('X-Scanner-Token') or request.META.get('HTTP_X_SCANNER_TOKEN')
+        if not is_valid_scanner_token(token):
+            logger.warning(f"Unauthorized scanner access attempt with token: {token}")
+            return _response({
+                'error': 'Unauthorized - Invalid scanner token',
+                'success': False
+            }, status.HTTP_401_UNAUTHORIZED)
+
+        status_code, payload = await aprocess_toll_scan(
+            _request_data(request), request.headers.get('Idempotency-Key')
+        )
+        return _response(payload, status_code)
+
+    except ValueError as e:
+        logger.error(f"Value error in toll processing: {e}")
+        return _response({'error': f'Invalid data: {str(e)}', 'success': False}, status.HTTP_400_BAD_REQUEST)
+
+    except Exception as e:
+        logger.error(f"Unexpected error in toll processing: {e}")
+        return _response({'error': 'Internal server error', 'success': False},
+                         status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+async def get_owner_details(request, owner_id):
+    """Get owner details with their vehicles"""
+    try:
+        owner, vehicles = await asyncio.gather(
+            storage.aget_owner(owner_id), storage.aget_owner_vehicles(owner_id)
+        )
+        if not owner:
+            return _response({'error': 'Owner not found'}, status.HTTP_404_NOT_FOUND)
+
+        return _response({
+            'id': owner_id,
+            'name': owner.get('name'),
+            'email': owner.get('email'),
+            'vehicles': _vehicle_list(vehicles)
+        })
+    except Exception as e:
+        logger.error(f"Error getting owner details: {e}")
+        return _response({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+async def get_owner_vehicles(request, owner_id):
+    """Get all vehicles for an owner"""
+    try:
+        return _response(_vehicle_list(await storage.aget_owner_vehicles(owner_id)))
+    except Exception as e:
+        logger.error(f"Error getting owner vehicles: {e}")
+        return _response({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+async def _owner_history(request, owner_id, collection, label):
+    try:
+        try:
+            page = PageParams.from_request(request)
+        except ValueError as e:
+            return _response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+        records, next_key = await storage.aget_owner_records(
+            collection, owner_id,
+            limit=page.limit, after=page.after, since=page.since, until=page.until
+        )
+        if records is None:
+            return _response({'error': f'Failed to load {label}'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+        return paginated_response(_response(records), next_key)
+    except Exception as e:
+        logger.error(f"Error getting owner {label}: {e}")
+        return _response({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+async def get_owner_payments(request, owner_id):
+    """Get payment history for an owner"""
+    return await _owner_history(request, owner_id, 'payments', 'payments')
+
+
+@async_api_view(['GET'])
+async def get_owner_tolls(request, owner_id):
+    """Get toll history for an owner"""
+    return await _owner_history(request, owner_id, 'transactions', 'tolls')
+
+
+@async_api_view(['POST'])
+async def recharge_vehicle(request, vehicle_id):
+    """Recharge vehicle balance"""
+    try:
+        data = json.loads(request.body)
+        amount = float(data.get('amount', 0))
+
+        if amount <= 0:
+            return _response({'error': 'Amount must be positive'}, status.HTTP_400_BAD_REQUEST)
+
+        vehicle = await storage.aget_vehicle(vehicle_id)
+        if not vehicle:
+            return _response({'error': 'Vehicle not found'}, status.HTTP_404_NOT_FOUND)
+
+        payment_data = {
+            'vehicleId': vehicle_id,
+            'ownerId': vehicle.get('ownerId'),
+            'amount': amount,
+            'timestamp': datetime.now().isoformat()
+        }
+
+        result = await storage.acredit_balance(vehicle_id, amount, payment_data)
+        if result:
+            previous_balance, new_balance, payment_id = result
+            return _response({
+                'success': True,
+                'new_balance': new_balance,
+                'amount_added': amount
+            })
+        return _response({'error': 'Failed to update balance'}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    except Exception as e:
+        logger.error(f"Error recharging vehicle: {e}")
+        return _response({'error': str(e)}, status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+
+@async_api_view(['GET'])
+async def export_records(request, collection):
+    """Download transactions or payments as NDJSON or CSV (see views.export_records)"""
+    if collection not in EXPORT_COLLECTIONS:
+        return _response({'error': f'Unknown collection {collection}'}, status.HTTP_404_NOT_FOUND)
+    try:
+        params = ExportParams.from_request(request, collection)
+    except ValueError as e:
+        return _response({'error': str(e)}, status.HTTP_400_BAD_REQUEST)
+
+    records = storage.iter_records(collection, since=params.since, until=params.until, plaza=params.plaza)
+    return export_response(aiter_chunks(export_chunks(records, params)), params)
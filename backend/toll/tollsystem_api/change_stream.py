@@ -0,0 +1,318 @@
+import logging
+import os
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+PROBE_ROOT = 'streamProbes'
+
+
+def _split(path):
+    return [part for part in (path or '/').split('/') if part]
+
+
+class FirebaseEventSource:
+    """Realtime Database streaming (`Reference.listen`) as an event source"""
+
+    def listen(self, path, callback):
+        from firebase_admin import db
+        return db.reference(path).listen(
+            lambda event: callback(event.event_type, event.path, event.data)
+        )
+
+    def write(self, path, value):
+        from firebase_admin import db
+        db.reference(path).set(value)
+
+    def read(self, path):
+        from firebase_admin import db
+        return db.reference(path).get()
+
+    def is_alive(self, registration):
+        thread = getattr(registration, '_thread', None)
+        return thread is None or thread.is_alive()
+
+
+class _LocalRegistration:
+    def __init__(self, source, path, callback):
+        self._source = source
+        self.path = path
+        self.callback = callback
+
+    def close(self):
+        self._source._unsubscribe(self)
+
+
+class LocalEventSource:
+    """In-memory stand-in for the Realtime Database stream, for tests and local runs.
+
+    Holds a tree; `put`/`patch`/`write` change it and deliver events to
+    listeners the way Firebase does: a `put` of the full subtree at `/` on
+    subscribe, then events with paths relative to the listened node.
+    """
+
+    def __init__(self, tree=None):
+        self._tree = tree if tree is not None else {}
+        self._lock = threading.RLock()
+        self._registrations = []
+
+    def _node(self, parts):
+        node = self._tree
+        for part in parts:
+            if not isinstance(node, dict):
+                return None
+            node = node.get(part)
+        return node
+
+    def _set(self, parts, value):
+        if not parts:
+            self._tree = value if isinstance(value, dict) else {}
+            return
+        node = self._tree
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                child = node[part] = {}
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+
+    def listen(self, path, callback):
+        with self._lock:
+            registration = _LocalRegistration(self, _split(path), callback)
+            self._registrations.append(registration)
+            callback('put', '/', self._node(registration.path))
+        return registration
+
+    def _unsubscribe(self, registration):
+        with self._lock:
+            if registration in self._registrations:
+                self._registrations.remove(registration)
+
+    def is_alive(self, registration):
+        return registration in self._registrations
+
+    def _dispatch(self, event_type, parts, data):
+        for registration in list(self._registrations):
+            base = registration.path
+            if parts[:len(base)] == base:
+                relative = '/' + '/'.join(parts[len(base):])
+                registration.callback(event_type, relative, data)
+            elif base[:len(parts)] == parts:
+                # A write above the listened node replaces it
+                registration.callback('put', '/', self._node(base))
+
+    def put(self, path, data):
+        parts = _split(path)
+        with self._lock:
+            self._set(parts, data)
+            self._dispatch('put', parts, data)
+
+    def patch(self, path, data):
+        parts = _split(path)
+        with self._lock:
+            for key, value in data.items():
+                self._set(parts + _split(key), value)
+            self._dispatch('patch', parts, data)
+
+    def write(self, path, value):
+        self.put(path, value)
+
+    def read(self, path):
+        with self._lock:
+            node = self._node(_split(path))
+            return dict(node) if isinstance(node, dict) else node
+
+
+class _Subscription:
+    __slots__ = ('path', 'handlers', 'registration', 'ready', 'events', 'last_event_at', 'errors', 'retry_at')
+
+    def __init__(self, path, handlers):
+        self.path = path
+        self.handlers = handlers
+        self.registration = None
+        self.ready = False
+        self.events = 0
+        self.last_event_at = None
+        self.errors = 0
+        self.retry_at = 0
+
+
+class ChangeStream:
+    """Keeps in-process state coherent with changes made by other writers.
+
+    Subscribes to each path in `handlers` ({path: [fn(path, data, event_type)]})
+    and applies every event to the handlers in the order received. The stream
+    is ready once every subscription has delivered its initial snapshot.
+
+    Lag is measured end to end with a probe: every `probe_interval` seconds
+    the current time is written under `streamProbes/<id>`, which is also
+    subscribed, and the delay until the write comes back as an event is the
+    time it takes this process to see a change. The probe is removed by
+    `stop`, and probes left behind by processes that died without stopping
+    are pruned once they are `probe_ttl` seconds old. A supervisor thread
+    resubscribes paths whose listener has died; `on_lost(path)` is called
+    whenever a subscription stops delivering, so callers can fall back to
+    reading until the fresh snapshot arrives.
+    """
+
+    def __init__(self, source, handlers, probe_interval=5, retry_interval=5, on_lost=None, probe_ttl=None):
+        self._source = source
+        self._on_lost = on_lost
+        self._subscriptions = {path: _Subscription(path, list(fns)) for path, fns in handlers.items()}
+        self.probe_interval = probe_interval
+        self.probe_ttl = probe_ttl if probe_ttl is not None else max(60, 12 * probe_interval)
+        self.retry_interval = retry_interval
+        self.ready = threading.Event()
+        self._probe_path = f'{PROBE_ROOT}/{uuid.uuid4().hex}'
+        self._probe = _Subscription(self._probe_path, [self._on_probe])
+        self._lag = None
+        self._stopping = threading.Event()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._worker_pid = None
+
+    def start(self):
+        """Subscribe in a daemon thread (listener threads inherit its daemon flag)"""
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='change-stream', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def stop(self, timeout=5):
+        self._stopping.set()
+        own = self._worker is not None and self._worker_pid == os.getpid()
+        if own and self._worker is not threading.current_thread():
+            # So that it cannot write the probe again after it is removed
+            self._worker.join(timeout)
+        for subscription in self._all():
+            self._close(subscription)
+        self.ready.clear()
+        # A forked child inherits the parent's stream object (and its atexit hook) but not its probe
+        if self.probe_interval and own:
+            try:
+                self._source.write(self._probe_path, None)
+            except Exception as e:
+                logger.warning(f"Could not remove change stream probe: {e}")
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def _all(self):
+        subscriptions = list(self._subscriptions.values())
+        if self.probe_interval:
+            subscriptions.append(self._probe)
+        return subscriptions
+
+    def _close(self, subscription):
+        registration, subscription.registration = subscription.registration, None
+        subscription.ready = False
+        if registration is None:
+            return
+        try:
+            registration.close()
+        except Exception as e:
+            logger.warning(f"Error closing listener on {subscription.path}: {e}")
+        if self._on_lost is not None and subscription is not self._probe:
+            self._on_lost(subscription.path)
+
+    def _subscribe(self, subscription):
+        subscription.ready = False
+        try:
+            subscription.registration = self._source.listen(
+                subscription.path, lambda *event: self._on_event(subscription, *event)
+            )
+        except Exception as e:
+            subscription.errors += 1
+            subscription.retry_at = time.monotonic() + self.retry_interval
+            logger.error(f"Could not subscribe to {subscription.path}: {e}")
+
+    def _on_event(self, subscription, event_type, path, data):
+        subscription.events += 1
+        subscription.last_event_at = time.time()
+        for handler in subscription.handlers:
+            try:
+                handler(path, data, event_type)
+            except Exception as e:
+                subscription.errors += 1
+                logger.error(f"Error applying {event_type} {subscription.path}{path}: {e}")
+        if not subscription.ready and path in ('/', '') and event_type == 'put':
+            subscription.ready = True
+            self._update_ready()
+
+    def _update_ready(self):
+        if all(subscription.ready for subscription in self._subscriptions.values()):
+            self.ready.set()
+        else:
+            self.ready.clear()
+
+    def _on_probe(self, path, data, event_type):
+        if isinstance(data, (int, float)) and path in ('/', ''):
+            self._lag = max(0.0, time.time() - data)
+
+    def _prune_probes(self):
+        """Remove probes their process has not refreshed for `probe_ttl` seconds"""
+        try:
+            probes = self._source.read(PROBE_ROOT) or {}
+        except Exception as e:
+            logger.warning(f"Could not read change stream probes: {e}")
+            return
+        cutoff = time.time() - self.probe_ttl
+        for key, written_at in probes.items():
+            if isinstance(written_at, (int, float)) and written_at >= cutoff:
+                continue
+            try:
+                self._source.write(f'{PROBE_ROOT}/{key}', None)
+            except Exception as e:
+                logger.warning(f"Could not remove stale change stream probe {key}: {e}")
+                return
+
+    def _run(self):
+        for subscription in self._all():
+            self._subscribe(subscription)
+        next_probe = next_prune = 0
+        while not self._stopping.wait(1):
+            now = time.monotonic()
+            for subscription in self._all():
+                if subscription.registration is None or not self._source.is_alive(subscription.registration):
+                    if subscription.registration is not None:
+                        logger.warning(f"Listener on {subscription.path} stopped, resubscribing")
+                        self._close(subscription)
+                        self._update_ready()
+                    if now < subscription.retry_at:
+                        continue
+                    self._subscribe(subscription)
+            if self.probe_interval and now >= next_probe:
+                next_probe = now + self.probe_interval
+                try:
+                    self._source.write(self._probe_path, time.time())
+                except Exception as e:
+                    logger.warning(f"Change stream probe write failed: {e}")
+            if self.probe_interval and now >= next_prune:
+                next_prune = now + self.probe_ttl
+                self._prune_probes()
+
+    def status(self):
+        now = time.time()
+        return {
+            'ready': self.ready.is_set(),
+            'lag_seconds': round(self._lag, 3) if self._lag is not None else None,
+            'subscriptions': {
+                path: {
+                    'ready': subscription.ready,
+                    'events': subscription.events,
+                    'errors': subscription.errors,
+                    'seconds_since_event': (
+                        round(now - subscription.last_event_at, 1) if subscription.last_event_at else None
+                    ),
+                }
+                for path, subscription in self._subscriptions.items()
+            },
+        }
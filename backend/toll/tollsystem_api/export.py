@@ -0,0 +1,167 @@
+import csv
+import json
+import zlib
+
+from asgiref.sync import sync_to_async
+from django.http import StreamingHttpResponse
+
+from .record_keys import parse_timestamp
+
+EXPORT_COLLECTIONS = ('transactions', 'payments')
+
+# CSV columns, in order; NDJSON rows carry every field of the record
+EXPORT_FIELDS = {
+    'transactions': (
+        'id', 'timestamp', 'vehicleId', 'ownerId', 'licensePlate', 'rfid', 'vehicleType',
+        'tollPlazaId', 'checkpoint', 'readerId', 'scanId', 'amount', 'balanceAfter', 'status',
+        'matchedBy', 'plateConfidence',
+    ),
+    'payments': (
+        'id', 'timestamp', 'vehicleId', 'ownerId', 'amount', 'balanceAfter',
+        'paymentMethod', 'referenceNumber',
+    ),
+}
+
+CONTENT_TYPES = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv; charset=utf-8',
+}
+
+# Rows are encoded and sent in blocks of about this many bytes
+CHUNK_BYTES = 64 * 1024
+
+
+def record_in_range(record, since=None, until=None, plaza=None):
+    """Whether a record's timestamp is within [since, until] (aware datetimes) and,
+    if `plaza` is given, it was charged there. Payments have no plaza."""
+    if plaza is not None and record.get('tollPlazaId') != plaza:
+        return False
+    if since is None and until is None:
+        return True
+    stamp = parse_timestamp(record.get('timestamp'))
+    if stamp is None:
+        return False
+    return (since is None or stamp >= since) and (until is None or stamp <= until)
+
+
+class ExportParams:
+    """Query parameters of an export: `since`, `until`, `plaza`, `format` and `gzip`"""
+
+    def __init__(self, collection, since=None, until=None, plaza=None, fmt='ndjson', compress=False):
+        self.collection = collection
+        self.since = since
+        self.until = until
+        self.plaza = plaza
+        self.fmt = fmt
+        self.compress = compress
+
+    @classmethod
+    def from_request(cls, request, collection):
+        since = request.GET.get('since')
+        until = request.GET.get('until')
+        if since and parse_timestamp(since) is None:
+            raise ValueError('since must be an ISO-8601 timestamp')
+        if until and parse_timestamp(until) is None:
+            raise ValueError('until must be an ISO-8601 timestamp')
+        fmt = request.GET.get('format', 'ndjson')
+        if fmt not in CONTENT_TYPES:
+            raise ValueError('format must be ndjson or csv')
+        return cls(
+            collection,
+            since=since or None,
+            until=until or None,
+            plaza=request.GET.get('plaza') or None,
+            fmt=fmt,
+            compress=request.GET.get('gzip', '').lower() in ('1', 'true', 'yes'),
+        )
+
+    @property
+    def filename(self):
+        parts = [self.collection]
+        if self.plaza:
+            parts.append(self.plaza)
+        for value in (self.since, self.until):
+            if value:
+                parts.append(parse_timestamp(value).strftime('%Y%m%dT%H%M%S'))
+        name = '-'.join(parts) + '.' + self.fmt
+        return name + '.gz' if self.compress else name
+
+
+def ndjson_rows(records):
+    for record in records:
+        yield json.dumps(record, separators=(',', ':'), default=str) + '\n'
+
+
+class _Line:
+    """Sink for csv.writer: `writerow` returns the encoded row instead of buffering it"""
+
+    def write(self, value):
+        return value
+
+
+def csv_rows(records, fields):
+    writer = csv.writer(_Line())
+    yield writer.writerow(fields)
+    for record in records:
+        yield writer.writerow(['' if record.get(field) is None else record[field] for field in fields])
+
+
+def _blocks(rows, size=CHUNK_BYTES):
+    block = []
+    length = 0
+    for row in rows:
+        block.append(row)
+        length += len(row)
+        if length >= size:
+            yield ''.join(block).encode()
+            block = []
+            length = 0
+    if block:
+        yield ''.join(block).encode()
+
+
+def gzipped(chunks, level=6):
+    """Gzip a stream of byte chunks incrementally"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def export_chunks(records, params):
+    """Encode an iterable of records as byte chunks in the requested format.
+
+    Pulls records one at a time, so memory is bounded by the storage read
+    chunk and one output block, whatever the number of rows.
+    """
+    if params.fmt == 'csv':
+        rows = csv_rows(records, EXPORT_FIELDS[params.collection])
+    else:
+        rows = ndjson_rows(records)
+    chunks = _blocks(rows)
+    return gzipped(chunks) if params.compress else chunks
+
+
+async def aiter_chunks(chunks):
+    """Serve a blocking chunk iterator to an ASGI response one chunk at a time.
+
+    Django consumes a sync iterator into a list before sending it under
+    ASGI. Each chunk is pulled on the request's sync thread instead, so ORM
+    cursors stay on the thread that opened them.
+    """
+    pull = sync_to_async(next, thread_sensitive=True)
+    while True:
+        chunk = await pull(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def export_response(chunks, params):
+    response = StreamingHttpResponse(chunks, content_type='application/gzip' if params.compress
+                                     else CONTENT_TYPES[params.fmt])
+    response['Content-Disposition'] = f'attachment; filename="{params.filename}"'
+    response['Cache-Control'] = 'no-store'
+    return response
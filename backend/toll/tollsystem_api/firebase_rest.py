@@ -0,0 +1,116 @@
+import asyncio
+import json
+import logging
+import threading
+import time
+
+from firebase_admin import db
+from google.auth.transport.requests import Request
+
+from .http_pool import get_async_http_client
+from .metrics import FIREBASE_REQUEST_SECONDS, FIREBASE_RESPONSE_BYTES
+
+logger = logging.getLogger(__name__)
+
+TRANSACTION_MAX_TRIES = 25
+
+
+class AsyncFirebaseClient:
+    """Non-blocking Realtime Database REST calls for the async views.
+
+    Uses the credential, database URL and query parameters of the
+    firebase_admin client, over the event loop's shared httpx.AsyncClient.
+    Only the operations the async storage paths need are provided: reads,
+    key-ordered range queries, multi-path updates, and compare-and-set
+    transactions (ETag / if-match, retried on conflict like
+    `Reference.transaction`).
+    """
+
+    def __init__(self, credential, base_url, params=None):
+        self._credential = credential
+        self._base_url = base_url.rstrip('/')
+        self._params = dict(params or {})
+        self._refresh_lock = threading.Lock()
+
+    @classmethod
+    def from_app(cls):
+        client = db.reference('/')._client
+        return cls(client.credential, client.base_url, client.params)
+
+    def _refresh_token(self):
+        with self._refresh_lock:
+            if not self._credential.valid:
+                self._credential.refresh(Request())
+            return self._credential.token
+
+    async def _headers(self, extra=None):
+        token = self._credential.token
+        if not self._credential.valid:
+            # google-auth refreshes synchronously; keep it off the event loop
+            token = await asyncio.to_thread(self._refresh_token)
+        headers = {'Authorization': f'Bearer {token}'}
+        headers.update(extra or {})
+        return headers
+
+    def _url(self, path):
+        path = path.strip('/')
+        return f'{self._base_url}/{path}.json' if path else f'{self._base_url}/.json'
+
+    async def _request(self, method, path, headers=None, params=None, **kwargs):
+        query = dict(self._params)
+        query.update(params or {})
+        headers = await self._headers(headers)
+        started = time.perf_counter()
+        response = await get_async_http_client().request(
+            method, self._url(path), headers=headers, params=query, **kwargs
+        )
+        node = path.strip('/').split('/', 1)[0] or '/'
+        FIREBASE_REQUEST_SECONDS.observe(
+            time.perf_counter() - started, method=method, node=node, status=response.status_code
+        )
+        FIREBASE_RESPONSE_BYTES.observe(len(response.content), method=method, node=node)
+        return response
+
+    async def get(self, path):
+        response = await self._request('GET', path)
+        response.raise_for_status()
+        return response.json()
+
+    async def query(self, path, start_at=None, end_at=None, limit_to_first=None, limit_to_last=None):
+        """Children of `path` ordered by key, as a dict in key order"""
+        params = {'orderBy': json.dumps('$key')}
+        if start_at is not None:
+            params['startAt'] = json.dumps(start_at)
+        if end_at is not None:
+            params['endAt'] = json.dumps(end_at)
+        if limit_to_first is not None:
+            params['limitToFirst'] = limit_to_first
+        if limit_to_last is not None:
+            params['limitToLast'] = limit_to_last
+        response = await self._request('GET', path, params=params)
+        response.raise_for_status()
+        result = response.json() or {}
+        return {key: result[key] for key in sorted(result)}
+
+    async def update(self, path, values):
+        response = await self._request('PATCH', path, json=values)
+        response.raise_for_status()
+
+    async def transaction(self, path, transaction_update):
+        """Compare-and-set `transaction_update(current)` onto `path`; returns the new value.
+
+        Exceptions raised by `transaction_update` abort the transaction and
+        propagate, as with `Reference.transaction`.
+        """
+        response = await self._request('GET', path, headers={'X-Firebase-ETag': 'true'})
+        response.raise_for_status()
+        etag, current = response.headers.get('ETag'), response.json()
+        for _ in range(TRANSACTION_MAX_TRIES):
+            new_value = transaction_update(current)
+            response = await self._request('PUT', path, headers={'if-match': etag}, json=new_value)
+            if response.status_code != 412:
+                response.raise_for_status()
+                return new_value
+            # Someone else wrote first; the 412 carries the current value and ETag
+            etag, current = response.headers.get('ETag'), response.json()
+        raise db.TransactionAbortedError('Transaction aborted after failed retries.')
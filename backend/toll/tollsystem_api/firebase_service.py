@@ -1,112 +1,924 @@
 import firebase_admin
 from firebase_admin import credentials, db
 from django.conf import settings
+import atexit
 import logging
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import json
 import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .storage import StorageBackend, InsufficientBalance, run_sync
+from .record_keys import (
+    generate_push_id, owner_index_key, parse_timestamp, push_id_prefix, timestamp_key, safe_key, scan_receipt_key
+)
+from .change_stream import ChangeStream, FirebaseEventSource
+from .export import record_in_range
+from .ledger import ledger_balance, ledger_entry
+from .firebase_rest import AsyncFirebaseClient
+from .http_pool import configure_session
+from .metrics import STORAGE_CALL_SECONDS, firebase_response_hook, record_startup, sampled
+from .snapshot_cache import SnapshotCache
+from .stats import stat_increments, merge_increments
+from .vehicle_index import VehicleIndex
+from .write_queue import WriteBehindQueue
 
 logger = logging.getLogger(__name__)
 
-class FirebaseService:
+# Per-owner copies of transactions/payments live under
+# ownerIndex/<collection>/<ownerId>/<timestamp key>_<record id>
+OWNER_INDEX_ROOT = 'ownerIndex'
+
+# Transactions charged from replayed reader scans are receipted under
+# scanReceipts/<readerId>/s_<scanId> -> transaction id, so replays are idempotent
+SCAN_RECEIPTS_ROOT = 'scanReceipts'
+
+# Dashboard aggregates, stats/<group>/<key>/<field>, bumped with server-side
+# increments in the same multi-path update that writes the records
+STATS_ROOT = 'stats'
+
+# Records are keyed by push ids made when they are written, which is never
+# before the reader or server timestamp they carry unless that clock runs
+# ahead; exports from a date start reading this far before its push-id prefix
+RECORD_CLOCK_SKEW = timedelta(days=1)
+
+# Integer-cent balance ledger, ledger/<vehicleId>/<record id> (see ledger.py),
+# and each vehicle's latest snapshot of it, ledgerSnapshots/<vehicleId>
+LEDGER_ROOT = 'ledger'
+LEDGER_SNAPSHOTS_ROOT = 'ledgerSnapshots'
+
+# Subtrees kept in sync from the realtime stream when CHANGE_STREAM_ENABLED
+STREAMED_PATHS = ('vehicles', 'owners', 'pricingRules', 'tollPlazas')
+
+
+# Process that initialized the default Firebase app
+_app_pid = None
+
+
+def _credential():
+    path = getattr(settings, 'FIREBASE_CREDENTIALS_PATH', None)
+    if path and os.path.exists(path):
+        return credentials.Certificate(path)
+    config = getattr(settings, 'FIREBASE_CONFIG', None) or {}
+    if config.get('private_key'):
+        return credentials.Certificate(config)
+    return None
+
+
+def _initialize_app():
+    """Initialize the default Firebase app for this process; returns success.
+
+    An app inherited from the parent of a forked worker is deleted and
+    initialized again, so workers never share its connections or tokens.
+    """
+    global _app_pid
+    try:
+        app = firebase_admin.get_app()
+    except ValueError:
+        app = None
+    if app is not None:
+        if _app_pid in (None, os.getpid()):
+            _app_pid = os.getpid()
+            logger.info("Firebase already initialized")
+            return True
+        firebase_admin.delete_app(app)
+
+    cred = _credential()
+    if cred is None:
+        logger.error("Firebase credentials not found or path not set")
+        return False
+    firebase_admin.initialize_app(cred, {
+        'databaseURL': settings.FIREBASE_DATABASE_URL,
+        'httpTimeout': getattr(settings, 'FIREBASE_HTTP_TIMEOUT', 30),
+    })
+    _app_pid = os.getpid()
+    logger.info("Firebase initialized from service account")
+    return True
+
+
+def _pricing_changed(path, data, event_type):
+    # Imported here: the pricing module resolves its loader through storage
+    from .pricing import pricing_engine
+    pricing_engine.apply_change(path, data, event_type)
+
+
+class FirebaseService(StorageBackend):
     _instance = None
     _initialized = False
     
     def __new__(cls):
+        if cls._instance is not None and cls._instance._pid != os.getpid():
+            # Built before a fork: its threads did not survive and its connections are the parent's
+            cls._instance = None
         if cls._instance is None:
             cls._instance = super(FirebaseService, cls).__new__(cls)
+            cls._instance._pid = os.getpid()
+            cls._instance.vehicle_index = VehicleIndex(
+                cls._instance._load_vehicles,
+                low_balance_threshold=getattr(settings, 'LOW_BALANCE_THRESHOLD', 10),
+                plate_max_distance=getattr(settings, 'PLATE_MATCH_MAX_DISTANCE', 2),
+                max_age=getattr(settings, 'VEHICLE_INDEX_MAX_AGE', 30),
+            )
+            cls._instance.write_queue = None
+            cls._instance.change_stream = None
+            cls._instance.db = db
+            cls._instance.rest = None
+            cls._instance.archive = None
+            cls._instance.cache = SnapshotCache(
+                ttls=getattr(settings, 'FIREBASE_CACHE_TTLS', None),
+                default_ttl=getattr(settings, 'FIREBASE_CACHE_DEFAULT_TTL', 30),
+            )
         return cls._instance
     
     def __init__(self):
         if not self._initialized:
             try:
-                # Check if Firebase is already initialized (prevent double init)
-                if firebase_admin._apps:
-                    self._initialized = True
-                    self.db = db
-                    logger.info("Firebase already initialized")
-                    return
-                
-                # Use your original file-based approach for localhost
-                if hasattr(settings, 'FIREBASE_CREDENTIALS_PATH') and os.path.exists(settings.FIREBASE_CREDENTIALS_PATH):
-                    cred = credentials.Certificate(settings.FIREBASE_CREDENTIALS_PATH)
-                    firebase_admin.initialize_app(cred, {
-                        'databaseURL': settings.FIREBASE_DATABASE_URL
-                    })
-                    self._initialized = True
-                    self.db = db
-                    logger.info("Firebase initialized with credentials file")
-                
-                else:
-                    logger.error("Firebase credentials not found or path not set")
+                started = time.perf_counter()
+                if not _initialize_app():
                     self._initialized = False
-                    
+                    return
+                self._initialized = True
+                self.db = db
+                self._setup_http_pool()
+                self._setup_write_queue()
+                self._setup_change_stream()
+                record_startup('firebase_init', time.perf_counter() - started)
             except Exception as e:
                 logger.error(f"Firebase initialization error: {e}")
                 self._initialized = False
     
+    def warm_up(self, timeout=30):
+        """Load the vehicle index and toll plazas, from the change stream's snapshots when it runs"""
+        if not self._initialized:
+            return False
+        if self.change_stream is not None and not self.change_stream.wait_ready(timeout):
+            logger.warning(f"Change stream not ready after {timeout}s, reading snapshots directly")
+        return self.vehicle_index.ensure_loaded() and self.get_toll_plazas() is not None
+    
+    def _setup_http_pool(self):
+        """Size the keep-alive pool of the session firebase_admin uses for REST calls"""
+        try:
+            session = db.reference('/')._client.session
+            configure_session(session, 'firebase')
+            # Time every REST round trip and record its payload size
+            hooks = session.hooks.setdefault('response', [])
+            if firebase_response_hook not in hooks:
+                hooks.append(firebase_response_hook)
+        except Exception as e:
+            logger.error(f"Could not configure Firebase connection pool: {e}")
+    
+    def _setup_write_queue(self):
+        """Journal transaction/payment records locally and flush them in the background"""
+        if not getattr(settings, 'WRITE_BEHIND_ENABLED', False):
+            return
+        try:
+            self.write_queue = WriteBehindQueue(
+                settings.WRITE_BEHIND_JOURNAL,
+                self.write_records,
+                batch_size=getattr(settings, 'WRITE_BEHIND_BATCH_SIZE', 200),
+                flush_interval=getattr(settings, 'WRITE_BEHIND_FLUSH_INTERVAL', 0.5),
+                max_attempts=getattr(settings, 'WRITE_BEHIND_MAX_ATTEMPTS', 8),
+            )
+        except Exception as e:
+            logger.error(f"Write-behind queue unavailable, writing records synchronously: {e}")
+            self.write_queue = None
+    
+    def _setup_change_stream(self, source=None):
+        """Follow changes made by other processes to the subtrees this service caches"""
+        if not getattr(settings, 'CHANGE_STREAM_ENABLED', True):
+            return
+        handlers = {path: [self._cache_handler(path)] for path in STREAMED_PATHS}
+        handlers['vehicles'].append(self.vehicle_index.apply_change)
+        handlers['pricingRules'].append(_pricing_changed)
+        self.change_stream = ChangeStream(
+            source or FirebaseEventSource(),
+            handlers,
+            probe_interval=getattr(settings, 'CHANGE_STREAM_PROBE_INTERVAL', 5),
+            on_lost=self._stream_lost,
+        )
+        self.change_stream.start()
+        # Close the listeners and remove this process's lag probe on shutdown
+        atexit.register(self.change_stream.stop)
+    
+    def _stream_lost(self, path):
+        """Serve `path` from reads again until the stream's fresh snapshot arrives"""
+        self.cache.unpin(path)
+        if path == 'vehicles':
+            self.vehicle_index.unpin()
+    
+    def _cache_handler(self, path):
+        return lambda event_path, data, event_type: self.cache.apply_change(path, event_path, data, event_type)
+    
+    def change_stream_status(self):
+        if self.change_stream is None:
+            return None
+        return self.change_stream.status()
+    
+    def _snapshot(self, path):
+        """Read a whole subtree through the snapshot cache"""
+        if not self._initialized:
+            return None
+        # An empty tree is cached as {} so that it is not re-read on every call
+        return self.cache.get(path, lambda: self.db.reference(path).get() or {})
+    
     def get_owners(self):
+        return self._snapshot('owners')
+    
+    def get_vehicles(self):
+        return self._snapshot('vehicles')
+    
+    def _load_vehicles(self):
+        """Vehicles for the index: the streamed snapshot, or a fresh download when
+        the stream is not keeping one current"""
+        if self._initialized and not self.cache.pinned('vehicles'):
+            self.cache.invalidate('vehicles')
+        return self.get_vehicles()
+    
+    def get_pricing_rules(self):
+        return self._snapshot('pricingRules')
+    
+    def get_toll_plazas(self):
+        return self._snapshot('tollPlazas')
+    
+    def cache_stats(self):
+        return self.cache.stats()
+    
+    def get_stats(self, hours=24, days=30):
+        """Read the dashboard aggregates; the hourly/daily series are key-range limited"""
         if not self._initialized:
             return None
         try:
-            ref = db.reference('owners')
-            return ref.get()
+            return {
+                'totals': self.db.reference(f'{STATS_ROOT}/totals').get() or {},
+                'byPlaza': self.db.reference(f'{STATS_ROOT}/byPlaza').get() or {},
+                'byVehicleType': self.db.reference(f'{STATS_ROOT}/byVehicleType').get() or {},
+                'byHour': self.db.reference(f'{STATS_ROOT}/byHour').order_by_key().limit_to_last(hours).get() or {},
+                'byDay': self.db.reference(f'{STATS_ROOT}/byDay').order_by_key().limit_to_last(days).get() or {},
+            }
         except Exception as e:
-            logger.error(f"Error getting owners: {e}")
+            logger.error(f"Error getting stats: {e}")
             return None
     
-    def get_vehicles(self):
+    def get_vehicle_counts(self):
         if not self._initialized:
             return None
+        return self.vehicle_index.counts()
+    
+    def rebuild_stats(self):
+        """Replace `stats` with aggregates recomputed from transactions and payments"""
+        if not self._initialized:
+            return None
+        increments = {}
+        counted = 0
+        for collection in ('transactions', 'payments'):
+            for record in self.iter_records(collection):
+                merge_increments(increments, stat_increments(collection, record))
+                counted += 1
+        tree = {}
+        for (group, key), fields in increments.items():
+            tree.setdefault(group, {})[key] = fields
+        self.db.reference(STATS_ROOT).set(tree)
+        return counted
+    
+    def get_hardware_endpoints(self):
+        return self._snapshot('hardwareEndpoints')
+    
+    def update_hardware_endpoints(self, updates):
+        """Write scanner liveness for many endpoints in one multi-path update"""
+        if not self._initialized:
+            return False
         try:
-            ref = db.reference('vehicles')
-            return ref.get()
+            paths = {}
+            for endpoint_id, fields in updates.items():
+                for field, value in fields.items():
+                    paths[f'hardwareEndpoints/{safe_key(endpoint_id)}/{field}'] = value
+            if paths:
+                self.db.reference('/').update(paths)
+            for endpoint_id, fields in updates.items():
+                self.cache.update_entry('hardwareEndpoints', safe_key(endpoint_id), fields)
+            return True
         except Exception as e:
-            logger.error(f"Error getting vehicles: {e}")
+            logger.error(f"Error updating {len(updates)} hardware endpoints: {e}")
+            return False
+    
+    def _vehicle_changed(self, vehicle_id, fields):
+        """Write-through for this service's own vehicle updates"""
+        self.vehicle_index.update(vehicle_id, fields)
+        self.cache.update_entry('vehicles', vehicle_id, fields)
+    
+    def get_vehicle(self, vehicle_id):
+        """Look up a vehicle by id from the in-memory index"""
+        if not self._initialized:
             return None
+        return self.vehicle_index.get(vehicle_id)
     
-    def get_vehicle_by_rfid(self, rfid):
+    def find_vehicle_by_rfid(self, rfid):
+        """Return (vehicle_id, vehicle) for an RFID tag from the in-memory index"""
         if not self._initialized:
             logger.error("Firebase not initialized")
+            return None, None
+        return self.vehicle_index.get_by_rfid(rfid)
+    
+    def check_watchlist(self, rfid=None, plate=None):
+        """Check a scan's tag and plate read against the in-memory watchlist"""
+        if not self._initialized:
+            return None, None, None
+        return self.vehicle_index.check_watchlist(rfid, plate)
+    
+    def get_watchlist(self):
+        if not self._initialized:
             return None
+        return self.vehicle_index.watchlist()
+    
+    def match_plate(self, plate, limit=5):
+        """Match a licence plate read against the in-memory plate index"""
+        if not self._initialized:
+            logger.error("Firebase not initialized")
+            return []
+        return self.vehicle_index.match_plate(plate, limit)
+    
+    def update_vehicle(self, vehicle_id, fields):
+        if not self._initialized:
+            return False
         try:
-            # Get all vehicles and search for matching RFID
-            vehicles = self.get_vehicles()
-            logger.info(f"Searching for RFID: {rfid}")
-            logger.info(f"Available vehicles: {list(vehicles.keys()) if vehicles else 'None'}")
-            
-            if vehicles:
-                for vehicle_id, vehicle in vehicles.items():
-                    vehicle_rfid = vehicle.get('rfid')
-                    logger.info(f"Vehicle {vehicle_id} has RFID: {vehicle_rfid}")
-                    if vehicle_rfid == rfid:
-                        logger.info(f"Found matching vehicle: {vehicle_id}")
-                        return vehicle
-            
-            logger.error(f"No vehicle found with RFID: {rfid}")
+            ref = self.db.reference(f'vehicles/{vehicle_id}')
+            ref.update(fields)
+            self._vehicle_changed(vehicle_id, fields)
+            return True
+        except Exception as e:
+            logger.error(f"Error updating vehicle {vehicle_id}: {e}")
+            return False
+    
+    def update_vehicle_balance(self, vehicle_id, new_balance):
+        """Set a balance and record the difference in `adjustments`, and so in the ledger"""
+        if not self._initialized:
+            return False
+        new_balance = round(float(new_balance), 2)
+        previous = {}
+        
+        def apply(current):
+            previous['balance'] = float(current or 0)
+            return new_balance
+        
+        try:
+            self.db.reference(f'vehicles/{vehicle_id}/balance').transaction(apply)
+            self._vehicle_changed(vehicle_id, {'balance': new_balance})
+            delta = round(new_balance - previous['balance'], 2)
+            if delta:
+                vehicle = self.get_vehicle(vehicle_id) or {}
+                self._save_record('adjustments', {
+                    'vehicleId': vehicle_id,
+                    'ownerId': vehicle.get('ownerId'),
+                    'amount': delta,
+                    'balanceAfter': new_balance,
+                    'timestamp': datetime.utcnow().isoformat() + 'Z'
+                })
+            return True
+        except Exception as e:
+            logger.error(f"Error setting balance of {vehicle_id}: {e}")
+            return False
+    
+    @staticmethod
+    def _balance_update(delta, min_balance, previous):
+        """Transaction function adding `delta` to a balance; stores the balance it saw in `previous`"""
+        def apply(current):
+            current = float(current or 0)
+            new_balance = round(current + delta, 2)
+            if min_balance is not None and new_balance < min_balance:
+                raise InsufficientBalance(current, -delta)
+            previous['balance'] = current
+            return new_balance
+        return apply
+    
+    def _apply_balance_delta(self, vehicle_id, delta, min_balance=None):
+        """Compare-and-set `delta` onto vehicles/<id>/balance; returns (previous, new)"""
+        previous = {}
+        # Firebase retries the update with the fresh value if another writer got in first
+        new_balance = self.db.reference(f'vehicles/{vehicle_id}/balance').transaction(
+            self._balance_update(delta, min_balance, previous)
+        )
+        self._vehicle_changed(vehicle_id, {'balance': new_balance})
+        return previous['balance'], new_balance
+    
+    def _adjust_balance(self, vehicle_id, delta, collection, record, min_balance=None):
+        if not self._initialized:
             return None
+        timed = sampled()
+        started = time.perf_counter() if timed else None
+        try:
+            previous_balance, new_balance = self._apply_balance_delta(vehicle_id, delta, min_balance)
+        except InsufficientBalance as e:
+            self._vehicle_changed(vehicle_id, {'balance': e.balance})
+            raise
         except Exception as e:
-            logger.error(f"Error getting vehicle by RFID: {e}")
+            logger.error(f"Error adjusting balance of {vehicle_id} by {delta}: {e}")
             return None
+        
+        if timed:
+            STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, method='balance_transaction')
+            started = time.perf_counter()
+        
+        data = dict(record)
+        data['balanceAfter'] = new_balance
+        try:
+            record_id = self._save_record(collection, data)
+            if timed:
+                STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, method='record_write')
+        except Exception as e:
+            logger.error(f"Error recording {collection} entry for {vehicle_id}, reverting balance: {e}")
+            try:
+                self._apply_balance_delta(vehicle_id, -delta)
+            except Exception as revert_error:
+                logger.critical(f"Failed to revert balance of {vehicle_id} by {-delta}: {revert_error}")
+            return None
+        return previous_balance, new_balance, record_id
     
-    def update_vehicle_balance(self, vehicle_id, new_balance):
+    def debit_balance(self, vehicle_id, amount, record):
+        """Atomically debit a toll and record it in `transactions`.
+        
+        Only the vehicle's balance node is read and written, as a
+        compare-and-set transaction, so concurrent scans and recharges cannot
+        lose updates. The transaction record (with `balanceAfter` filled in)
+        and its owner index entry follow in one multi-path update. Returns
+        (previous_balance, new_balance, record_id), or None on storage errors.
+        Raises InsufficientBalance if the balance does not cover `amount`.
+        """
+        return self._adjust_balance(vehicle_id, -amount, 'transactions', record, min_balance=0)
+    
+    def credit_balance(self, vehicle_id, amount, record):
+        """Atomically credit a recharge and record it in `payments`; see debit_balance"""
+        return self._adjust_balance(vehicle_id, amount, 'payments', record)
+    
+    def _apply_balance_debits(self, vehicle_id, amounts):
+        """Compare-and-set a run of debits onto one balance, skipping those it cannot cover"""
+        outcome = {}
+        
+        def apply(current):
+            balance = float(current or 0)
+            results = []
+            for amount in amounts:
+                new_balance = round(balance - amount, 2)
+                if new_balance < 0:
+                    results.append(InsufficientBalance(balance, amount))
+                else:
+                    results.append((balance, new_balance))
+                    balance = new_balance
+            outcome['results'] = results
+            return balance
+        
+        new_balance = self.db.reference(f'vehicles/{vehicle_id}/balance').transaction(apply)
+        self._vehicle_changed(vehicle_id, {'balance': new_balance})
+        return outcome['results']
+    
+    def debit_balances(self, debits):
+        """Apply a batch of toll debits and record them together.
+        
+        Each vehicle gets one balance transaction covering all of its debits,
+        run concurrently across vehicles; every accepted record, its owner
+        index entry and its scan receipt then go out in a single multi-path
+        update. If that update fails the accepted amounts are credited back.
+        """
+        if not self._initialized:
+            return None
+        
+        def apply(item):
+            vehicle_id, charges = item
+            try:
+                return vehicle_id, self._apply_balance_debits(vehicle_id, [amount for amount, _ in charges])
+            except Exception as e:
+                logger.error(f"Error debiting balance of {vehicle_id}: {e}")
+                return vehicle_id, None
+        
+        workers = max(1, min(getattr(settings, 'BULK_SCAN_WORKERS', 16), len(debits)))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            applied = dict(pool.map(apply, debits.items()))
+        
+        outcome = {}
+        records = []
+        debited = {}
+        for vehicle_id, charges in debits.items():
+            results = applied.get(vehicle_id)
+            if results is None:
+                outcome[vehicle_id] = None
+                continue
+            vehicle_results = []
+            for (amount, record), result in zip(charges, results):
+                if isinstance(result, InsufficientBalance):
+                    vehicle_results.append(result)
+                    continue
+                previous_balance, new_balance = result
+                record_id = generate_push_id()
+                data = dict(record)
+                data['balanceAfter'] = new_balance
+                records.append(('transactions', record_id, data))
+                debited[vehicle_id] = debited.get(vehicle_id, 0) + amount
+                vehicle_results.append((previous_balance, new_balance, record_id))
+            outcome[vehicle_id] = vehicle_results
+        
+        try:
+            self.write_records(records)
+        except Exception as e:
+            logger.error(f"Error recording {len(records)} bulk transactions, reverting balances: {e}")
+            for vehicle_id, total in debited.items():
+                try:
+                    self._apply_balance_delta(vehicle_id, round(total, 2))
+                except Exception as revert_error:
+                    logger.critical(f"Failed to revert balance of {vehicle_id} by {total}: {revert_error}")
+            return None
+        return outcome
+    
+    def get_scan_receipts(self, reader_id, scan_ids):
+        """Return {scan_id: record_id} for a reader's scans that were already charged.
+        
+        One key-range read over the reader's receipts; readers number their
+        buffered scans in order, so the range is about the size of the batch.
+        """
+        if not self._initialized:
+            return None
+        keys = {scan_receipt_key(scan_id): scan_id for scan_id in scan_ids}
+        if not keys:
+            return {}
+        try:
+            receipts = self.db.reference(f'{SCAN_RECEIPTS_ROOT}/{safe_key(reader_id)}').order_by_key() \
+                .start_at(min(keys)).end_at(max(keys)).get() or {}
+            return {keys[key]: record_id for key, record_id in receipts.items() if key in keys}
+        except Exception as e:
+            logger.error(f"Error getting scan receipts for reader {reader_id}: {e}")
+            return None
+    
+    def get_owner(self, owner_id):
+        if not self._initialized:
+            return None
+        owners = self.cache.peek('owners')
+        if owners is not None:
+            owner = owners.get(owner_id)
+            return dict(owner) if isinstance(owner, dict) else owner
+        try:
+            ref = self.db.reference(f'owners/{owner_id}')
+            return ref.get()
+        except Exception as e:
+            logger.error(f"Error getting owner {owner_id}: {e}")
+            return None
+    
+    def add_owner(self, data):
+        if not self._initialized:
+            return None
+        try:
+            ref = self.db.reference('owners')
+            owner_id = ref.push(data).key
+            self.cache.set_entry('owners', owner_id, dict(data))
+            return owner_id
+        except Exception as e:
+            logger.error(f"Error adding owner: {e}")
+            return None
+    
+    def get_owner_vehicles(self, owner_id):
+        """Return {vehicle_id: vehicle} for an owner from the in-memory index"""
+        if not self._initialized:
+            return None
+        return self.vehicle_index.get_by_owner(owner_id)
+    
+    def get_owner_records(self, collection, owner_id, limit=None, after=None, since=None, until=None):
+        """Return (records, next_key) for an owner's transactions or payments, newest first.
+        
+        Reads only the owner's index node. `after` is the index key the previous
+        page ended on; it and the `since`/`until` timestamps are pushed down to
+        Firebase as a key range, so a page costs O(limit) regardless of history.
+        Records moved to the archive tier are merged in (see _with_archived).
+        """
+        if not self._initialized:
+            return None, None
+        try:
+            lower, upper, last = self._owner_records_range(limit, after, since, until)
+            query = self.db.reference(f'{OWNER_INDEX_ROOT}/{collection}/{owner_id}').order_by_key()
+            if lower is not None:
+                query = query.start_at(lower)
+            if upper is not None:
+                query = query.end_at(upper)
+            if last:
+                query = query.limit_to_last(last)
+            page = self._owner_records_page(query.get() or {}, limit, after)
+            if self._archive(collection) is None:
+                return page
+            return self._with_archived(collection, owner_id, page, limit, after, since, until)
+        except Exception as e:
+            logger.error(f"Error getting {collection} for owner {owner_id}: {e}")
+            return None, None
+    
+    def _archive(self, collection):
+        """The archive tier if `collection` has archived records, else None (so NumPy is
+        only imported once something has been archived)"""
+        root = getattr(settings, 'ARCHIVE_DIR', None)
+        if not root or not os.path.isdir(os.path.join(root, collection)):
+            return None
+        if self.archive is None:
+            from .archive import Archive
+            self.archive = Archive(root)
+        return self.archive
+    
+    def _with_archived(self, collection, owner_id, page, limit, after, since, until):
+        """Merge a page of the live owner index with the same page of the archive.
+        
+        Both are read below the same `after` key, so the newest `limit` of the
+        two are the page. A record in both tiers, left by an interrupted
+        archive run, is listed once.
+        """
+        live, live_next = page
+        archived, archived_next = self.archive.owner_records(collection, owner_id, limit, after, since, until)
+        records = {owner_index_key(record.get('timestamp'), record.get('id')): record for record in archived}
+        records.update((owner_index_key(record.get('timestamp'), record.get('id')), record) for record in live)
+        keys = sorted(records, reverse=True)
+        next_key = None
+        if limit and len(keys) > limit:
+            keys = keys[:limit]
+            next_key = keys[-1]
+        elif limit and keys and (live_next or archived_next):
+            next_key = keys[-1]
+        return [records[key] for key in keys], next_key
+    
+    def _iter_children(self, path, chunk_size, start=None):
+        """Yield (key, value) for the children of `path` in key order, `chunk_size` per query"""
+        after = None
+        while True:
+            query = self.db.reference(path).order_by_key()
+            if start is not None:
+                query = query.start_at(start)
+            # start_at includes the key the previous chunk ended on
+            limit = chunk_size + 1 if after is not None else chunk_size
+            chunk = query.limit_to_first(limit).get() or {}
+            keys = sorted(key for key in chunk if after is None or key > after)
+            for key in keys:
+                yield key, chunk[key]
+            if len(chunk) < limit or not keys:
+                return
+            start = after = keys[-1]
+    
+    def iter_records(self, collection, since=None, until=None, plaza=None, chunk_size=1000, archived=True):
+        """Read a collection in key order, `chunk_size` records per query.
+        
+        Push keys follow write time, so a `since` bound starts the read at its
+        key prefix (less RECORD_CLOCK_SKEW); `until` and `plaza` are checked per
+        record, as replayed scans are written after later ones. Non-push keys
+        such as the seeded `trans1` sort after push ids and are always read.
+        Archived records come first, oldest day first, unless not `archived`.
+        """
+        if not self._initialized:
+            raise RuntimeError('Firebase is not initialized')
+        since, until = parse_timestamp(since), parse_timestamp(until)
+        archive = self._archive(collection) if archived else None
+        if archive is not None:
+            yield from archive.iter_records(collection, since, until, plaza, chunk_size)
+        start = push_id_prefix(since - RECORD_CLOCK_SKEW) if since else None
+        for key, record in self._iter_children(collection, chunk_size, start):
+            if isinstance(record, dict) and record_in_range(record, since, until, plaza):
+                yield dict(record, id=key)
+    
+    def get_ledger_balance(self, vehicle_id, snapshot=None):
+        """Snapshot plus tail: two reads whose size does not grow with the ledger"""
+        if not self._initialized:
+            return None
+        try:
+            if snapshot is None:
+                snapshot = self.db.reference(f'{LEDGER_SNAPSHOTS_ROOT}/{vehicle_id}').get()
+            query = self.db.reference(f'{LEDGER_ROOT}/{vehicle_id}').order_by_key()
+            if snapshot and snapshot.get('through'):
+                query = query.start_at(snapshot['through'])
+            tail = query.get() or {}
+            through = snapshot.get('through') if snapshot else None
+            return {
+                'cents': ledger_balance(snapshot, tail),
+                'snapshot': snapshot,
+                'tailEntries': sum(1 for key in tail if through is None or key > through),
+            }
+        except Exception as e:
+            logger.error(f"Error getting ledger balance of {vehicle_id}: {e}")
+            return None
+    
+    def iter_ledger(self, chunk_size=500):
+        if not self._initialized:
+            raise RuntimeError('Firebase is not initialized')
+        for vehicle_id, entries in self._iter_children(LEDGER_ROOT, chunk_size):
+            if not isinstance(entries, dict):
+                continue
+            keys = sorted(entries)
+            yield vehicle_id, keys, [int(entries[key].get('cents', 0)) for key in keys]
+    
+    def get_ledger_snapshots(self):
+        if not self._initialized:
+            return None
+        try:
+            return self.db.reference(LEDGER_SNAPSHOTS_ROOT).get() or {}
+        except Exception as e:
+            logger.error(f"Error getting ledger snapshots: {e}")
+            return None
+    
+    def write_ledger_snapshots(self, snapshots):
+        """Write snapshots in multi-path updates of up to 500 vehicles"""
         if not self._initialized:
             return False
         try:
-            ref = db.reference(f'vehicles/{vehicle_id}')
-            ref.update({'balance': new_balance})
+            items = list(snapshots.items())
+            for offset in range(0, len(items), 500):
+                self.db.reference(LEDGER_SNAPSHOTS_ROOT).update(dict(items[offset:offset + 500]))
             return True
         except Exception as e:
-            logger.error(f"Error updating vehicle balance: {e}")
+            logger.error(f"Error writing ledger snapshots: {e}")
             return False
     
+    def append_ledger_entries(self, entries):
+        """Append entries in multi-path updates of up to 500"""
+        if not self._initialized:
+            return False
+        try:
+            for offset in range(0, len(entries), 500):
+                self.db.reference(LEDGER_ROOT).update({
+                    f'{vehicle_id}/{generate_push_id()}': entry for vehicle_id, entry in entries[offset:offset + 500]
+                })
+            return True
+        except Exception as e:
+            logger.error(f"Error appending {len(entries)} ledger entries: {e}")
+            return False
+    
+    def archive_records(self, collection, before, batch_size=100000):
+        """Move records in key order, `batch_size` at a time, to the archive tier.
+        
+        Each batch is written to its day partitions before it is deleted from
+        the live tree and owner index, so an interrupted run leaves records in
+        both tiers until the next run. Push keys follow write time, so reading
+        stops at `before`'s key prefix plus RECORD_CLOCK_SKEW; records with
+        other keys, such as the seeded ones, stay live.
+        """
+        if not self._initialized:
+            return None
+        from .archive import Archive
+        if self.archive is None:
+            self.archive = Archive(settings.ARCHIVE_DIR)
+        before = parse_timestamp(before)
+        end = push_id_prefix(before + RECORD_CLOCK_SKEW)
+        moved = 0
+        batch = []
+        try:
+            for key, record in self._iter_children(collection, 1000):
+                if key > end:
+                    break
+                stamp = parse_timestamp(record.get('timestamp')) if isinstance(record, dict) else None
+                if stamp is not None and stamp < before:
+                    batch.append((key, record))
+                if len(batch) >= batch_size:
+                    moved += self._archive_batch(collection, batch)
+                    batch = []
+            if batch:
+                moved += self._archive_batch(collection, batch)
+            return moved
+        except Exception as e:
+            logger.error(f"Error archiving {collection} after {moved} records: {e}")
+            return None
+    
+    def _archive_batch(self, collection, batch):
+        moved = self.archive.write(collection, batch)
+        updates = {}
+        for record_id, data in batch:
+            updates[f'{collection}/{record_id}'] = None
+            updates.update(dict.fromkeys(self.owner_index_updates(collection, record_id, data)))
+        items = list(updates.items())
+        for offset in range(0, len(items), 1000):
+            self.db.reference('/').update(dict(items[offset:offset + 1000]))
+        return moved
+    
+    @staticmethod
+    def _owner_records_range(limit, after, since, until):
+        """(start_at, end_at, limit_to_last) of the index query for one page"""
+        lower = timestamp_key(since) if since else None
+        # '~' sorts after every push-key character, so this includes all ids at `until`
+        upper = timestamp_key(until) + '~' if until else None
+        if after is not None and (upper is None or after < upper):
+            upper = after
+        # One extra to detect a further page, one more as end_at includes `after`
+        return lower, upper, limit + 2 if limit else None
+    
+    @staticmethod
+    def _owner_records_page(records, limit, after):
+        # Index keys start with a fixed-width timestamp, so key order is time order
+        keys = sorted((key for key in records if after is None or key < after), reverse=True)
+        next_key = None
+        if limit and len(keys) > limit:
+            keys = keys[:limit]
+            next_key = keys[-1]
+        return [records[key] for key in keys], next_key
+    
+    def get_owners_page(self, limit, after=None):
+        """Return (owners, next_key) with owners as [(owner_id, owner)] in key order"""
+        if not self._initialized:
+            return None, None
+        try:
+            query = self.db.reference('owners').order_by_key()
+            if after is not None:
+                query = query.start_at(after)
+            if limit:
+                query = query.limit_to_first(limit + 2)
+            owners = query.get() or {}
+            keys = sorted(key for key in owners if after is None or key > after)
+            next_key = None
+            if limit and len(keys) > limit:
+                keys = keys[:limit]
+                next_key = keys[-1]
+            return [(key, owners[key]) for key in keys], next_key
+        except Exception as e:
+            logger.error(f"Error getting owners page: {e}")
+            return None, None
+    
+    def get_vehicles_page(self, limit, after=None, predicate=None):
+        """Return (vehicles, next_key) with vehicles as [(vehicle_id, vehicle)] in id order"""
+        if not self._initialized:
+            return None, None
+        return self.vehicle_index.page(limit, after=after, predicate=predicate)
+    
+    def owner_index_updates(self, collection, record_id, data):
+        """Multi-path update entries that add a record to its owner's index"""
+        owner_id = data.get('ownerId')
+        if not owner_id:
+            return {}
+        key = owner_index_key(data.get('timestamp'), record_id)
+        indexed = dict(data)
+        indexed['id'] = record_id
+        return {f'{OWNER_INDEX_ROOT}/{collection}/{owner_id}/{key}': indexed}
+    
+    def scan_receipt_updates(self, collection, record_id, data):
+        """Multi-path update entries that receipt a transaction charged from a reader scan"""
+        if collection != 'transactions' or not data.get('scanId'):
+            return {}
+        reader_key = safe_key(data.get('readerId') or 'unknown')
+        return {f"{SCAN_RECEIPTS_ROOT}/{reader_key}/{scan_receipt_key(data['scanId'])}": record_id}
+    
+    def ledger_updates(self, collection, record_id, data):
+        """Multi-path update entries that append a record's amount to its vehicle's ledger"""
+        entry = ledger_entry(collection, data)
+        if entry is None:
+            return {}
+        return {f"{LEDGER_ROOT}/{data['vehicleId']}/{record_id}": entry}
+    
+    def write_record(self, collection, data):
+        """Write a record and its owner index entry in one multi-path update"""
+        record_id = generate_push_id()
+        self.write_records([(collection, record_id, data)])
+        return record_id
+    
+    def stats_updates(self, increments):
+        """Multi-path update entries that add summed increments to the aggregates"""
+        updates = {}
+        for (group, key), fields in increments.items():
+            for field, amount in fields.items():
+                updates[f'{STATS_ROOT}/{group}/{key}/{field}'] = {'.sv': {'increment': amount}}
+        return updates
+    
+    def _record_updates(self, records, counted=()):
+        """Multi-path update writing records with their index entries, receipts, ledger
+        entries and aggregates. Records whose id is in `counted` are left out of the
+        aggregates"""
+        updates = {}
+        increments = {}
+        for collection, record_id, data in records:
+            updates[f'{collection}/{record_id}'] = data
+            updates.update(self.owner_index_updates(collection, record_id, data))
+            updates.update(self.scan_receipt_updates(collection, record_id, data))
+            updates.update(self.ledger_updates(collection, record_id, data))
+            if record_id not in counted:
+                merge_increments(increments, stat_increments(collection, data))
+        updates.update(self.stats_updates(increments))
+        return updates
+    
+    def _written_records(self, records, record_ids):
+        """Ids among `record_ids` whose record is already stored. A record and its
+        aggregate increments land in the same multi-path update, so these have
+        been counted"""
+        written = set()
+        for collection, record_id, _ in records:
+            if record_id in record_ids and self.db.reference(f'{collection}/{record_id}').get() is not None:
+                written.add(record_id)
+        return written
+    
+    def write_records(self, records, replayed=()):
+        """Write [(collection, record_id, data)] in one multi-path update. `replayed`
+        ids may have been written by an earlier attempt; they are only counted in
+        the aggregates if they were not"""
+        counted = self._written_records(records, replayed) if replayed else ()
+        updates = self._record_updates(records, counted)
+        if updates:
+            self.db.reference('/').update(updates)
+    
+    def _save_record(self, collection, data):
+        """Hand a record to the write-behind queue, or write it now if there is none"""
+        if self.write_queue is not None:
+            return self.write_queue.enqueue(collection, data)
+        return self.write_record(collection, data)
+    
     def push_toll_record(self, data):
         if not self._initialized:
             return None
         try:
-            ref = db.reference('transactions')
-            return ref.push(data).key
+            return self._save_record('transactions', data)
         except Exception as e:
             logger.error(f"Firebase push toll record error: {e}")
             return None
@@ -115,10 +927,115 @@ class FirebaseService:
         if not self._initialized:
             return None
         try:
-            ref = db.reference('payments')
-            return ref.push(data).key
+            return self._save_record('payments', data)
         except Exception as e:
             logger.error(f"Firebase push payment record error: {e}")
             return None
-
-firebase_service = FirebaseService()
\ No newline at end of file
+    
+    # Async variants for the async views: lookups answered from the in-memory
+    # index and cache run inline, and Firebase is called over non-blocking REST
+    
+    def _rest_client(self):
+        if self.rest is None:
+            self.rest = AsyncFirebaseClient.from_app()
+        return self.rest
+    
+    async def afind_vehicle_by_rfid(self, rfid):
+        if self._initialized and self.vehicle_index.current:
+            return self.find_vehicle_by_rfid(rfid)
+        return await super().afind_vehicle_by_rfid(rfid)
+    
+    async def acheck_watchlist(self, rfid=None, plate=None):
+        if self._initialized and self.vehicle_index.current:
+            return self.check_watchlist(rfid, plate)
+        return await super().acheck_watchlist(rfid, plate)
+    
+    async def amatch_plate(self, plate, limit=5):
+        if self._initialized and self.vehicle_index.current:
+            return self.match_plate(plate, limit)
+        return await super().amatch_plate(plate, limit)
+    
+    async def aget_vehicle(self, vehicle_id):
+        if self._initialized and self.vehicle_index.current:
+            return self.get_vehicle(vehicle_id)
+        return await super().aget_vehicle(vehicle_id)
+    
+    async def aget_owner_vehicles(self, owner_id):
+        if self._initialized and self.vehicle_index.current:
+            return self.get_owner_vehicles(owner_id)
+        return await super().aget_owner_vehicles(owner_id)
+    
+    async def aget_owner(self, owner_id):
+        if not self._initialized:
+            return None
+        if self.cache.peek('owners') is not None:
+            return self.get_owner(owner_id)
+        try:
+            return await self._rest_client().get(f'owners/{owner_id}')
+        except Exception as e:
+            logger.error(f"Error getting owner {owner_id}: {e}")
+            return None
+    
+    async def aget_owner_records(self, collection, owner_id, limit=None, after=None, since=None, until=None):
+        if not self._initialized:
+            return None, None
+        try:
+            lower, upper, last = self._owner_records_range(limit, after, since, until)
+            records = await self._rest_client().query(
+                f'{OWNER_INDEX_ROOT}/{collection}/{owner_id}', start_at=lower, end_at=upper, limit_to_last=last
+            )
+            page = self._owner_records_page(records, limit, after)
+            if self._archive(collection) is None:
+                return page
+            return await run_sync(self._with_archived, collection, owner_id, page, limit, after, since, until)
+        except Exception as e:
+            logger.error(f"Error getting {collection} for owner {owner_id}: {e}")
+            return None, None
+    
+    async def _aapply_balance_delta(self, vehicle_id, delta, min_balance=None):
+        previous = {}
+        new_balance = await self._rest_client().transaction(
+            f'vehicles/{vehicle_id}/balance', self._balance_update(delta, min_balance, previous)
+        )
+        self._vehicle_changed(vehicle_id, {'balance': new_balance})
+        return previous['balance'], new_balance
+    
+    async def _asave_record(self, collection, data):
+        if self.write_queue is not None:
+            # Local SQLite journal; still a blocking commit, so off the loop
+            return await run_sync(self.write_queue.enqueue, collection, data)
+        record_id = generate_push_id()
+        await self._rest_client().update('/', self._record_updates([(collection, record_id, data)]))
+        return record_id
+    
+    async def _aadjust_balance(self, vehicle_id, delta, collection, record, min_balance=None):
+        """Async counterpart of _adjust_balance"""
+        if not self._initialized:
+            return None
+        try:
+            previous_balance, new_balance = await self._aapply_balance_delta(vehicle_id, delta, min_balance)
+        except InsufficientBalance as e:
+            self._vehicle_changed(vehicle_id, {'balance': e.balance})
+            raise
+        except Exception as e:
+            logger.error(f"Error adjusting balance of {vehicle_id} by {delta}: {e}")
+            return None
+        
+        data = dict(record)
+        data['balanceAfter'] = new_balance
+        try:
+            record_id = await self._asave_record(collection, data)
+        except Exception as e:
+            logger.error(f"Error recording {collection} entry for {vehicle_id}, reverting balance: {e}")
+            try:
+                await self._aapply_balance_delta(vehicle_id, -delta)
+            except Exception as revert_error:
+                logger.critical(f"Failed to revert balance of {vehicle_id} by {-delta}: {revert_error}")
+            return None
+        return previous_balance, new_balance, record_id
+    
+    async def adebit_balance(self, vehicle_id, amount, record):
+        return await self._aadjust_balance(vehicle_id, -amount, 'transactions', record, min_balance=0)
+    
+    async def acredit_balance(self, vehicle_id, amount, record):
+        return await self._aadjust_balance(vehicle_id, amount, 'payments', record)
@@ -0,0 +1,216 @@
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+from .record_keys import parse_timestamp
+from .storage import storage
+
+logger = logging.getLogger(__name__)
+
+# Scan rate is counted in RATE_BUCKETS buckets of RATE_BUCKET_SECONDS each
+RATE_BUCKET_SECONDS = 10
+RATE_BUCKETS = 6
+
+
+class _Scanner:
+    __slots__ = ('last_seen', 'status', 'toll_plaza_id', 'buckets', 'bucket_start', 'dirty')
+
+    def __init__(self):
+        self.last_seen = None
+        self.status = 'online'
+        self.toll_plaza_id = None
+        self.buckets = [0] * RATE_BUCKETS
+        self.bucket_start = 0
+        self.dirty = False
+
+    def _advance(self, now):
+        """Zero the buckets that fell out of the window since the last update"""
+        current = int(now // RATE_BUCKET_SECONDS)
+        elapsed = current - self.bucket_start
+        if elapsed <= 0:
+            return
+        for step in range(1, min(elapsed, RATE_BUCKETS) + 1):
+            self.buckets[(self.bucket_start + step) % RATE_BUCKETS] = 0
+        self.bucket_start = current
+
+    def count_scan(self, now):
+        self._advance(now)
+        self.buckets[self.bucket_start % RATE_BUCKETS] += 1
+
+    def scans_per_minute(self, now):
+        self._advance(now)
+        return sum(self.buckets) * 60 / (RATE_BUCKETS * RATE_BUCKET_SECONDS)
+
+
+def _epoch(timestamp):
+    parsed = parse_timestamp(timestamp)
+    return parsed.timestamp() if parsed else None
+
+
+def _iso(epoch):
+    return datetime.fromtimestamp(epoch, timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+class HeartbeatRegistry:
+    """In-memory liveness of scanners, flushed to `hardwareEndpoints` in batches.
+
+    Heartbeats and scans only touch a small per-scanner entry. A background
+    thread writes the entries that changed since the last flush in one
+    `flush(updates)` call every `flush_interval` seconds, so the write rate
+    depends on the interval rather than on the number of readers.
+
+    Each process only hears from the scanners that talk to it, so nothing is
+    ever written as offline: a scanner is offline when its newest
+    `lastHeartbeat`, stored by any process or seen by this one, is more than
+    `offline_after` seconds old. `fleet_status` works this out when read,
+    from the endpoints returned by `loader` and this process's entries.
+    """
+
+    def __init__(self, flush, loader=None, flush_interval=10, offline_after=30):
+        self._flush = flush
+        self._loader = loader
+        self.flush_interval = flush_interval
+        self.offline_after = offline_after
+        self._scanners = {}
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+
+    def _entry(self, scanner_id):
+        entry = self._scanners.get(scanner_id)
+        if entry is None:
+            entry = self._scanners[scanner_id] = _Scanner()
+        return entry
+
+    def record_heartbeat(self, scanner_id, status='online', toll_plaza_id=None):
+        now = time.time()
+        with self._lock:
+            entry = self._entry(scanner_id)
+            entry.last_seen = now
+            entry.status = status
+            if toll_plaza_id:
+                entry.toll_plaza_id = toll_plaza_id
+            entry.dirty = True
+        self.start()
+
+    def record_scan(self, scanner_id):
+        """Count a scan toward the scanner's rate; a scan also proves it is alive"""
+        now = time.time()
+        with self._lock:
+            entry = self._entry(scanner_id)
+            entry.count_scan(now)
+            # Stored as a heartbeat (once per flush) so other processes see it alive too
+            entry.last_seen = now
+            entry.dirty = True
+        self.start()
+
+    def _status(self, scanner_id, entry, endpoint, now):
+        """A scanner's liveness from the newest of its stored and locally seen heartbeats"""
+        stored_at = _epoch(endpoint.get('lastHeartbeat'))
+        seen_at = entry.last_seen if entry is not None else None
+        # Stored heartbeats reach storage up to a flush interval after they arrived
+        online = (
+            (seen_at is not None and now - seen_at <= self.offline_after)
+            or (stored_at is not None and now - stored_at <= self.offline_after + self.flush_interval)
+        )
+        local = seen_at is not None and (stored_at is None or seen_at >= stored_at)
+        last_at = seen_at if local else stored_at
+        if not online:
+            status = 'offline'
+        elif local:
+            status = entry.status
+        else:
+            status = endpoint.get('status') or 'online'
+        return {
+            'scannerId': scanner_id,
+            'tollPlazaId': (entry.toll_plaza_id if entry is not None else None) or endpoint.get('tollPlazaId'),
+            'status': status,
+            'isOnline': online,
+            'lastHeartbeat': _iso(seen_at) if local else endpoint.get('lastHeartbeat'),
+            'secondsSinceSeen': round(now - last_at, 1) if last_at is not None else None,
+            # Scans are only counted by the process that received them
+            'scansPerMinute': entry.scans_per_minute(now) if entry is not None else 0.0,
+        }
+
+    def fleet_status(self):
+        endpoints = self._loader() if self._loader is not None else None
+        if endpoints is None and self._loader is not None:
+            logger.warning("Hardware endpoints unavailable, fleet status from this process only")
+        endpoints = {
+            scanner_id: endpoint for scanner_id, endpoint in (endpoints or {}).items() if isinstance(endpoint, dict)
+        }
+        now = time.time()
+        with self._lock:
+            scanners = [
+                self._status(scanner_id, self._scanners.get(scanner_id), endpoints.get(scanner_id, {}), now)
+                for scanner_id in set(self._scanners) | set(endpoints)
+            ]
+        online = sum(1 for scanner in scanners if scanner['isOnline'])
+        scanners.sort(key=lambda scanner: scanner['scannerId'])
+        return {
+            'total': len(scanners),
+            'online': online,
+            'offline': len(scanners) - online,
+            'scanners': scanners,
+        }
+
+    def flush_once(self):
+        """Write every entry changed since the last flush; returns the number written"""
+        with self._lock:
+            dirty = {scanner_id: entry for scanner_id, entry in self._scanners.items() if entry.dirty}
+            updates = {}
+            for scanner_id, entry in dirty.items():
+                # Only scanners heard from since the last flush are written, and they are online
+                fields = {'isOnline': True, 'status': entry.status, 'lastHeartbeat': _iso(entry.last_seen)}
+                if entry.toll_plaza_id:
+                    fields['tollPlazaId'] = entry.toll_plaza_id
+                updates[scanner_id] = fields
+                entry.dirty = False
+        if not updates:
+            return 0
+        if not self._flush(updates):
+            with self._lock:
+                for entry in dirty.values():
+                    entry.dirty = True
+            logger.warning(f"Heartbeat flush of {len(updates)} scanners failed, will retry")
+            return 0
+        return len(updates)
+
+    def start(self):
+        """Start the flush worker in this process if it is not running"""
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='heartbeat-flush', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def stop(self, flush=True):
+        self._stopping.set()
+        if self._worker is not None:
+            self._worker.join(self.flush_interval)
+        if flush:
+            self.flush_once()
+
+    def _run(self):
+        while not self._stopping.wait(self.flush_interval):
+            try:
+                self.flush_once()
+            except Exception as e:
+                logger.error(f"Heartbeat flush worker error: {e}")
+
+
+heartbeat_registry = HeartbeatRegistry(
+    lambda updates: storage.update_hardware_endpoints(updates),
+    loader=lambda: storage.get_hardware_endpoints(),
+    flush_interval=getattr(settings, 'HEARTBEAT_FLUSH_INTERVAL', 10),
+    offline_after=getattr(settings, 'SCANNER_OFFLINE_AFTER', 30),
+)
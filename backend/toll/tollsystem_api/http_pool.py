@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import os
+import threading
+import weakref
+
+import httpx
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+_client = None
+_client_pid = None
+_client_lock = threading.Lock()
+_sessions = weakref.WeakValueDictionary()
+# httpx.AsyncClient connections belong to the event loop that opened them
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def _setting(name, default):
+    return getattr(settings, name, default)
+
+
+def timeout():
+    """httpx timeout built from HTTP_CONNECT_TIMEOUT / HTTP_READ_TIMEOUT"""
+    read = _setting('HTTP_READ_TIMEOUT', 10)
+    return httpx.Timeout(read, connect=_setting('HTTP_CONNECT_TIMEOUT', 5))
+
+
+def _limits(max_connections):
+    return httpx.Limits(
+        max_connections=max_connections,
+        max_keepalive_connections=max_connections,
+        keepalive_expiry=_setting('HTTP_KEEPALIVE_EXPIRY', 30),
+    )
+
+
+def _new_client(client_class=httpx.Client, max_connections=None):
+    limits = _limits(max_connections or _setting('HTTP_POOL_MAXSIZE', 32))
+    http2 = _setting('HTTP2_ENABLED', True)
+    try:
+        return client_class(http2=http2, limits=limits, timeout=timeout())
+    except ImportError:
+        # http2=True needs the h2 package
+        logger.warning("h2 not installed, HTTP client falling back to HTTP/1.1")
+        return client_class(limits=limits, timeout=timeout())
+
+
+def get_http_client():
+    """Process-wide httpx client with keep-alive, using HTTP/2 where the server offers it.
+
+    A forked worker gets its own client rather than sharing the parent's sockets.
+    """
+    global _client, _client_pid
+    if _client is None or _client_pid != os.getpid():
+        with _client_lock:
+            if _client is None or _client_pid != os.getpid():
+                _client = _new_client()
+                _client_pid = os.getpid()
+    return _client
+
+
+def get_async_http_client():
+    """httpx.AsyncClient for the running event loop, shared by every coroutine on it.
+
+    Sized by HTTP_ASYNC_POOL_MAXSIZE: an event loop can keep far more
+    requests in flight than a thread pool.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = _new_client(
+            httpx.AsyncClient, _setting('HTTP_ASYNC_POOL_MAXSIZE', 256)
+        )
+    return client
+
+
+def configure_session(session, name):
+    """Mount keep-alive adapters sized from settings on a requests session.
+
+    Used for the session firebase_admin keeps per database client, whose
+    default adapters hold only 10 connections per host and drop the rest once
+    more threads than that talk to Firebase at once.
+    """
+    current = session.get_adapter('https://')
+    retries = getattr(current, 'max_retries', 0)
+    adapter = HTTPAdapter(
+        pool_connections=_setting('HTTP_POOL_CONNECTIONS', 4),
+        pool_maxsize=_setting('HTTP_POOL_MAXSIZE', 32),
+        max_retries=retries,
+        pool_block=_setting('HTTP_POOL_BLOCK', False),
+    )
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    _sessions[name] = session
+    return session
+
+
+def _session_stats(session):
+    adapter = session.get_adapter('https://')
+    pools = []
+    for key in list(adapter.poolmanager.pools.keys()):
+        pool = adapter.poolmanager.pools.get(key)
+        if pool is None:
+            continue
+        pools.append({
+            'host': f"{pool.scheme}://{pool.host}:{pool.port}",
+            'connections_opened': pool.num_connections,
+            'requests': pool.num_requests,
+            # The queue is pre-filled with None placeholders for unopened slots
+            'idle': sum(1 for conn in list(pool.pool.queue) if conn is not None) if pool.pool is not None else 0,
+        })
+    return {'pool_maxsize': adapter._pool_maxsize, 'pools': pools}
+
+
+def _client_stats(client):
+    # httpx does not expose its pool; read httpcore's connection list
+    pool = client._transport._pool
+    connections = list(pool.connections)
+    return {
+        'http2': pool._http2,
+        'max_connections': _setting('HTTP_POOL_MAXSIZE', 32),
+        'connections': len(connections),
+        'idle': sum(1 for connection in connections if connection.is_idle()),
+        'http2_connections': sum(
+            1 for connection in connections
+            if type(getattr(connection, '_connection', None)).__name__ == 'HTTP2Connection'
+        ),
+    }
+
+
+def pool_stats():
+    """Live connection counts for the shared pools"""
+    stats = {'sessions': {}}
+    for name, session in list(_sessions.items()):
+        try:
+            stats['sessions'][name] = _session_stats(session)
+        except Exception as e:
+            logger.error(f"Error reading pool stats for {name}: {e}")
+    client = _client if _client_pid == os.getpid() else None
+    if client is not None:
+        try:
+            stats['http_client'] = _client_stats(client)
+        except Exception as e:
+            logger.error(f"Error reading HTTP client pool stats: {e}")
+    return stats
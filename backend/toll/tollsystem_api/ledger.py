@@ -0,0 +1,49 @@
+from datetime import datetime
+
+from .stats import to_cents
+
+# Every committed record that moves a balance adds one integer-cent entry to
+# its vehicle's append-only ledger, keyed by the record id, so a balance can
+# be recomputed exactly and checked against the stored float
+LEDGER_KINDS = {
+    'transactions': ('toll', -1),
+    'payments': ('recharge', 1),
+    'adjustments': ('adjustment', 1),
+}
+
+
+def ledger_entry(collection, data):
+    """The ledger entry a record adds to its vehicle's ledger, or None"""
+    if collection not in LEDGER_KINDS or not isinstance(data, dict) or not data.get('vehicleId'):
+        return None
+    kind, sign = LEDGER_KINDS[collection]
+    return {
+        'cents': sign * to_cents(data.get('amount', 0)),
+        'kind': kind,
+        'timestamp': data.get('timestamp'),
+    }
+
+
+def ledger_snapshot(cents, through, entries, taken_at=None):
+    """A vehicle's balance in cents as of ledger entry `through`, the last of `entries` summed"""
+    return {
+        'cents': int(cents),
+        'through': through,
+        'entries': int(entries),
+        'takenAt': taken_at or datetime.utcnow().isoformat() + 'Z',
+    }
+
+
+def ledger_balance(snapshot, tail):
+    """Balance in cents from a snapshot (or None) and the `{key: entry}` written after it"""
+    cents = snapshot.get('cents', 0) if snapshot else 0
+    through = snapshot.get('through') if snapshot else None
+    for key, entry in tail.items():
+        if (through is None or key > through) and isinstance(entry, dict):
+            cents += int(entry.get('cents', 0))
+    return cents
+
+
+def opening_entry(cents):
+    """Entry opening a vehicle's ledger at a balance it held before the ledger existed"""
+    return {'cents': int(cents), 'kind': 'opening', 'timestamp': datetime.utcnow().isoformat() + 'Z'}
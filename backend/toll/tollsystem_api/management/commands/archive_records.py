@@ -0,0 +1,36 @@
+from datetime import datetime, timedelta, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tollsystem_api.export import EXPORT_COLLECTIONS
+from tollsystem_api.storage import storage
+
+
+class Command(BaseCommand):
+    help = ('Move transactions and payments older than the retention window into the columnar archive tier. '
+            'Owner history and exports keep reading them from there')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--collection', choices=EXPORT_COLLECTIONS, action='append',
+                            help='Collection to archive (repeatable; default both)')
+        parser.add_argument('--days', type=int, default=getattr(settings, 'ARCHIVE_RETENTION_DAYS', 90),
+                            help='Keep records from this many most recent UTC days live')
+        parser.add_argument('--batch-size', type=int, default=100000,
+                            help='Records written to the archive before they are deleted from the live store')
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError('--days must be at least 1')
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        before = today - timedelta(days=options['days'] - 1)
+        for collection in options['collection'] or EXPORT_COLLECTIONS:
+            try:
+                moved = storage.archive_records(collection, before, batch_size=options['batch_size'])
+            except NotImplementedError:
+                raise CommandError('This storage backend does not archive records')
+            if moved is None:
+                raise CommandError(f'Could not archive {collection}')
+            self.stdout.write(self.style.SUCCESS(
+                f'Archived {moved} {collection} from before {before.date().isoformat()}'
+            ))
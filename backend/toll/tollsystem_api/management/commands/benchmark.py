@@ -0,0 +1,344 @@
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import statistics
+import sys
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+from tollsystem_api.memory_db import MemoryFirebaseService
+from tollsystem_api.pricing import pricing_engine
+from tollsystem_api.scan_dedup import scan_deduplicator
+from tollsystem_api.storage import set_storage
+
+# Reference data as in seed.cjs
+PRICING_RULES = {
+    'rule1': {'vehicleType': 'Motorbike', 'basePrice': 0.00, 'currency': 'USD', 'isActive': True},
+    'rule2': {'vehicleType': 'Small Car', 'basePrice': 5.00, 'currency': 'USD', 'isActive': True},
+    'rule3': {'vehicleType': 'Big Car', 'basePrice': 8.00, 'currency': 'USD', 'isActive': True},
+    'rule4': {'vehicleType': 'Truck', 'basePrice': 10.00, 'currency': 'USD', 'isActive': True},
+    'rule5': {'vehicleType': 'Bus', 'basePrice': 12.00, 'currency': 'USD', 'isActive': True},
+}
+VEHICLE_TYPES = ['Small Car', 'Small Car', 'Small Car', 'Big Car', 'Truck', 'Bus', 'Motorbike']
+PLAZA_COUNT = 8
+READERS_PER_PLAZA = 2
+
+SCENARIOS = ('rfid_scan', 'owner_details', 'owner_vehicles', 'owner_tolls', 'owner_payments', 'recharge')
+
+
+def _plate(n):
+    letters = ''.join(chr(65 + (n // 26 ** i) % 26) for i in range(3))
+    return f'{letters}-{n % 10000:04d}'
+
+
+def generate_tree(owners, vehicles, rng):
+    """Owners, vehicles and reference data shaped like seed.cjs, at any scale"""
+    plazas = {
+        f'plaza{p}': {'name': f'Toll Plaza {p}', 'isActive': True, 'totalLanes': 4}
+        for p in range(1, PLAZA_COUNT + 1)
+    }
+    endpoints = {
+        f'reader{p}_{r}': {'tollPlazaId': f'plaza{p}', 'status': 'offline', 'isOnline': False}
+        for p in range(1, PLAZA_COUNT + 1) for r in range(1, READERS_PER_PLAZA + 1)
+    }
+    owner_tree = {
+        f'owner{o}': {
+            'name': f'Owner {o}',
+            'email': f'owner{o}@example.com',
+            'phone': f'+2637{o % 100000000:08d}',
+            'role': 'owner',
+            'createdAt': '2024-01-15T10:00:00Z',
+        }
+        for o in range(1, owners + 1)
+    }
+    vehicle_tree = {}
+    for v in range(1, vehicles + 1):
+        owner = rng.randint(1, owners)
+        vehicle_tree[f'vehicle{v}'] = {
+            'licensePlate': _plate(v),
+            'rfid': f'{v:08X}',
+            'type': rng.choice(VEHICLE_TYPES),
+            'ownerId': f'owner{owner}',
+            'ownerName': f'Owner {owner}',
+            'balance': float(rng.randint(100, 1000)),
+            'status': 'active' if rng.random() > 0.02 else 'suspended',
+            'createdAt': '2024-01-15T10:30:00Z',
+        }
+    return {
+        'owners': owner_tree,
+        'vehicles': vehicle_tree,
+        'tollPlazas': plazas,
+        'hardwareEndpoints': endpoints,
+        'pricingRules': dict(PRICING_RULES),
+    }
+
+
+def generate_history(service, tree, transactions, rng, batch_size=5000):
+    """Write past tolls (and one recharge per ten tolls) through the service's batch path"""
+    vehicle_ids = list(tree['vehicles'])
+    prices = {rule['vehicleType']: rule['basePrice'] for rule in PRICING_RULES.values()}
+    start = datetime.utcnow() - timedelta(days=90)
+    batch = []
+    for n in range(transactions):
+        vehicle_id = rng.choice(vehicle_ids)
+        vehicle = tree['vehicles'][vehicle_id]
+        when = (start + timedelta(seconds=rng.randint(0, 90 * 86400))).isoformat() + 'Z'
+        plaza = rng.randint(1, PLAZA_COUNT)
+        amount = prices[vehicle['type']]
+        batch.append(('transactions', f'trans{n}', {
+            'vehicleId': vehicle_id,
+            'ownerId': vehicle['ownerId'],
+            'rfid': vehicle['rfid'],
+            'vehicleType': vehicle['type'],
+            'amount': amount,
+            'balanceAfter': vehicle['balance'],
+            'tollPlazaId': f'plaza{plaza}',
+            'readerId': f'reader{plaza}_1',
+            'licensePlate': vehicle['licensePlate'],
+            'timestamp': when,
+            'status': 'completed',
+        }))
+        if n % 10 == 0:
+            batch.append(('payments', f'pay{n}', {
+                'vehicleId': vehicle_id,
+                'ownerId': vehicle['ownerId'],
+                'amount': 20.0,
+                'balanceAfter': vehicle['balance'],
+                'timestamp': when,
+            }))
+        if len(batch) >= batch_size:
+            service.write_records(batch)
+            batch = []
+    if batch:
+        service.write_records(batch)
+
+
+def _rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return None
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def summarize(latencies, statuses, elapsed):
+    ordered = sorted(latencies)
+    as_ms = lambda seconds: round(seconds * 1000, 3) if seconds is not None else None
+    counts = {}
+    for code in statuses:
+        counts[str(code)] = counts.get(str(code), 0) + 1
+    return {
+        'requests': len(ordered),
+        'errors': sum(1 for code in statuses if code >= 500),
+        'statuses': counts,
+        'seconds': round(elapsed, 3),
+        'throughput_rps': round(len(ordered) / elapsed, 1) if elapsed else None,
+        'latency_ms': {
+            'mean': as_ms(statistics.fmean(ordered)) if ordered else None,
+            'p50': as_ms(_percentile(ordered, 0.50)),
+            'p90': as_ms(_percentile(ordered, 0.90)),
+            'p99': as_ms(_percentile(ordered, 0.99)),
+            'max': as_ms(ordered[-1]) if ordered else None,
+        },
+    }
+
+
+class Workload:
+    """Builds one request per call for each scenario, against the seeded ids"""
+
+    def __init__(self, tree, seed):
+        self.vehicles = [
+            (vehicle_id, vehicle['rfid']) for vehicle_id, vehicle in tree['vehicles'].items()
+        ]
+        self.owners = list(tree['owners'])
+        self._local = threading.local()
+        self._seed = seed
+
+    def _rng(self):
+        rng = getattr(self._local, 'rng', None)
+        if rng is None:
+            rng = self._local.rng = random.Random(f'{self._seed}-{threading.get_ident()}')
+        return rng
+
+    def request(self, client, scenario):
+        rng = self._rng()
+        if scenario == 'rfid_scan':
+            vehicle_id, rfid = rng.choice(self.vehicles)
+            plaza = rng.randint(1, PLAZA_COUNT)
+            return client.post('/api/toll/rfid-scan/', json.dumps({
+                'rfid': rfid,
+                'tollPlazaId': f'plaza{plaza}',
+                'scanner_id': f'reader{plaza}_{rng.randint(1, READERS_PER_PLAZA)}',
+            }), content_type='application/json')
+        if scenario == 'recharge':
+            vehicle_id, rfid = rng.choice(self.vehicles)
+            return client.post(f'/api/vehicle/{vehicle_id}/recharge/', json.dumps({'amount': 20}),
+                               content_type='application/json')
+        owner_id = rng.choice(self.owners)
+        if scenario == 'owner_details':
+            return client.get(f'/api/owner/{owner_id}/')
+        if scenario == 'owner_vehicles':
+            return client.get(f'/api/owner/{owner_id}/vehicles/')
+        if scenario == 'owner_tolls':
+            return client.get(f'/api/owner/{owner_id}/tolls/', {'limit': 20})
+        if scenario == 'owner_payments':
+            return client.get(f'/api/owner/{owner_id}/payments/', {'limit': 20})
+        raise ValueError(f'Unknown scenario: {scenario}')
+
+
+def run_scenario(workload, scenario, requests, concurrency, host):
+    """Send `requests` requests from `concurrency` threads; returns the summary"""
+    clients = threading.local()
+    latencies = []
+    statuses = []
+    lock = threading.Lock()
+
+    def one(_):
+        client = getattr(clients, 'client', None)
+        if client is None:
+            client = clients.client = Client(SERVER_NAME=host)
+        started = time.perf_counter()
+        response = workload.request(client, scenario)
+        took = time.perf_counter() - started
+        with lock:
+            latencies.append(took)
+            statuses.append(response.status_code)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='bench') as pool:
+        list(pool.map(one, range(requests)))
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def compare(results, baseline, tolerance):
+    """Scenarios whose p99 or throughput got worse than the baseline by more than `tolerance`"""
+    regressions = []
+    for scenario, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(scenario)
+        if not previous:
+            continue
+        p99, old_p99 = current['latency_ms']['p99'], previous['latency_ms']['p99']
+        if p99 and old_p99 and p99 > old_p99 * (1 + tolerance):
+            regressions.append(f'{scenario}: p99 {old_p99}ms -> {p99}ms')
+        rps, old_rps = current['throughput_rps'], previous['throughput_rps']
+        if rps and old_rps and rps < old_rps * (1 - tolerance):
+            regressions.append(f'{scenario}: throughput {old_rps}/s -> {rps}/s')
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the toll scan, owner and recharge endpoints against an in-memory '
+            'Firebase stand-in and report latency percentiles, throughput and memory as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--owners', type=int, default=2000)
+        parser.add_argument('--vehicles', type=int, default=10000)
+        parser.add_argument('--transactions', type=int, default=10000,
+                            help='Historic tolls to seed (plus one recharge per ten)')
+        parser.add_argument('--requests', type=int, default=2000, help='Requests per scenario')
+        parser.add_argument('--concurrency', type=int, default=8, help='Client threads')
+        parser.add_argument('--warmup', type=int, default=20, help='Unmeasured requests per scenario')
+        parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                            help=f'Comma-separated subset of: {", ".join(SCENARIOS)}')
+        parser.add_argument('--seed', type=int, default=42, help='Random seed for data and workload')
+        parser.add_argument('--trace-memory', action='store_true',
+                            help='Also report peak Python allocations per scenario (slows requests)')
+        parser.add_argument('--log-level', default='ERROR',
+                            help='Level for the app and request loggers during the run')
+        parser.add_argument('--label', default='', help='Free-form label stored with the results')
+        parser.add_argument('--output', help='Write results JSON to this file instead of stdout')
+        parser.add_argument('--baseline', help='Results JSON of an earlier run to compare against')
+        parser.add_argument('--tolerance', type=float, default=0.10,
+                            help='Allowed p99/throughput regression against --baseline (fraction)')
+
+    def handle(self, *args, **options):
+        scenarios = [name.strip() for name in options['scenarios'].split(',') if name.strip()]
+        unknown = [name for name in scenarios if name not in SCENARIOS]
+        if unknown:
+            raise CommandError(f'Unknown scenarios: {", ".join(unknown)}')
+        if options['owners'] < 1 or options['vehicles'] < 1:
+            raise CommandError('--owners and --vehicles must be at least 1')
+        host = settings.ALLOWED_HOSTS[0] if settings.ALLOWED_HOSTS else 'localhost'
+        for name in ('tollsystem_api', 'django.request'):
+            logging.getLogger(name).setLevel(options['log_level'].upper())
+
+        rng = random.Random(options['seed'])
+        started = time.perf_counter()
+        tree = generate_tree(options['owners'], options['vehicles'], rng)
+        service = MemoryFirebaseService(tree)
+        generate_history(service, tree, options['transactions'], rng)
+        set_storage(service)
+        pricing_engine.invalidate()
+        service.vehicle_index.ensure_loaded()
+        # Random scans can repeat a tag at a reader; measure the charging path, not the dedup window
+        scan_deduplicator.window = 0
+        seed_seconds = time.perf_counter() - started
+        self.stderr.write(f'Seeded {options["vehicles"]} vehicles, {options["owners"]} owners and '
+                          f'{options["transactions"]} transactions in {seed_seconds:.1f}s')
+
+        results = {
+            'label': options['label'],
+            'started_at': datetime.utcnow().isoformat() + 'Z',
+            'environment': {
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+            },
+            'parameters': {
+                key: options[key] for key in
+                ('owners', 'vehicles', 'transactions', 'requests', 'concurrency', 'warmup', 'seed')
+            },
+            'seed': {'seconds': round(seed_seconds, 2), 'rss_peak_mb': _rss_mb()},
+            'scenarios': {},
+        }
+
+        workload = Workload(tree, options['seed'])
+        del tree
+        for scenario in scenarios:
+            if options['warmup']:
+                run_scenario(workload, scenario, options['warmup'], 1, host)
+            if options['trace_memory']:
+                tracemalloc.start()
+            summary = run_scenario(workload, scenario, options['requests'], options['concurrency'], host)
+            if options['trace_memory']:
+                current, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                summary['traced_peak_mb'] = round(peak / (1024 * 1024), 2)
+            summary['rss_peak_mb'] = _rss_mb()
+            results['scenarios'][scenario] = summary
+            latency = summary['latency_ms']
+            self.stderr.write(f'{scenario}: {summary["throughput_rps"]} req/s, '
+                              f'p50 {latency["p50"]}ms, p99 {latency["p99"]}ms, {summary["errors"]} errors')
+
+        if options['baseline']:
+            with open(options['baseline']) as handle:
+                baseline = json.load(handle)
+            if baseline.get('parameters') != results['parameters']:
+                self.stderr.write(self.style.WARNING('Baseline was run with different parameters'))
+            results['regressions'] = compare(results, baseline, options['tolerance'])
+
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stderr.write(f'Results written to {options["output"]}')
+        else:
+            self.stdout.write(output)
+
+        if results.get('regressions'):
+            raise CommandError('Regressions against baseline: ' + '; '.join(results['regressions']))
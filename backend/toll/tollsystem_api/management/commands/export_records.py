@@ -0,0 +1,58 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tollsystem_api.export import EXPORT_COLLECTIONS, ExportParams, export_chunks
+from tollsystem_api.record_keys import parse_timestamp
+from tollsystem_api.storage import storage
+
+
+class Command(BaseCommand):
+    help = ('Export transactions or payments as NDJSON or CSV for reconciliation, streamed from '
+            'storage in chunks so memory stays flat however many records there are')
+
+    def add_arguments(self, parser):
+        parser.add_argument('collection', choices=EXPORT_COLLECTIONS)
+        parser.add_argument('--since', help='Earliest record timestamp (ISO-8601, inclusive)')
+        parser.add_argument('--until', help='Latest record timestamp (ISO-8601, inclusive)')
+        parser.add_argument('--plaza', help='Only tolls charged at this plaza')
+        parser.add_argument('--format', choices=('ndjson', 'csv'), default='ndjson')
+        parser.add_argument('--gzip', action='store_true', help='Gzip the output')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Records read per storage query')
+        parser.add_argument('--output', help='Write to this file instead of stdout')
+
+    def handle(self, *args, **options):
+        for name in ('since', 'until'):
+            if options[name] and parse_timestamp(options[name]) is None:
+                raise CommandError(f'--{name} must be an ISO-8601 timestamp')
+        params = ExportParams(
+            options['collection'],
+            since=options['since'],
+            until=options['until'],
+            plaza=options['plaza'],
+            fmt=options['format'],
+            compress=options['gzip'],
+        )
+
+        counted = 0
+
+        def records():
+            nonlocal counted
+            for record in storage.iter_records(params.collection, since=params.since, until=params.until,
+                                               plaza=params.plaza, chunk_size=options['chunk_size']):
+                counted += 1
+                yield record
+
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for chunk in export_chunks(records(), params):
+                out.write(chunk)
+        except Exception as e:
+            raise CommandError(f'Export stopped after {counted} records: {e}')
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
+
+        self.stderr.write(self.style.SUCCESS(f'Exported {counted} {params.collection}'))
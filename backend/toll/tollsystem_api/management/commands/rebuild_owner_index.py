@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tollsystem_api.firebase_service import FirebaseService, OWNER_INDEX_ROOT
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the per-owner transaction/payment index from the full trees'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Index entries written per multi-path update')
+
+    def handle(self, *args, **options):
+        firebase_service = FirebaseService()
+        if not firebase_service._initialized:
+            raise CommandError('Firebase is not initialized')
+        db = firebase_service.db
+
+        batch_size = options['batch_size']
+        for collection in ('transactions', 'payments'):
+            records = db.reference(collection).get() or {}
+            db.reference(f'{OWNER_INDEX_ROOT}/{collection}').delete()
+
+            updates = {}
+            written = 0
+            for record_id, record in records.items():
+                if not isinstance(record, dict):
+                    continue
+                updates.update(firebase_service.owner_index_updates(collection, record_id, record))
+                if len(updates) >= batch_size:
+                    db.reference('/').update(updates)
+                    written += len(updates)
+                    updates = {}
+            if updates:
+                db.reference('/').update(updates)
+                written += len(updates)
+
+            self.stdout.write(self.style.SUCCESS(
+                f'Indexed {written} of {len(records)} {collection}'
+            ))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from tollsystem_api.storage import storage
+
+
+class Command(BaseCommand):
+    help = ('Recompute the dashboard aggregates from the full transaction/payment history. '
+            'Run while no tolls are being processed, as it replaces the live counters')
+
+    def handle(self, *args, **options):
+        counted = storage.rebuild_stats()
+        if counted is None:
+            raise CommandError('Storage backend is not available')
+        self.stdout.write(self.style.SUCCESS(f'Aggregated {counted} records'))
@@ -0,0 +1,74 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tollsystem_api.ledger import opening_entry
+from tollsystem_api.reconcile import reconcile_ledger
+from tollsystem_api.storage import storage
+
+
+class Command(BaseCommand):
+    help = ('Recompute every vehicle balance from the integer-cent ledger and report those that differ. '
+            'Run periodically with --snapshot to keep ledger snapshots close to the head of each ledger')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=500, help='Vehicle ledgers read per storage query')
+        parser.add_argument('--snapshot', action='store_true',
+                            help='Also write a snapshot of each ledger through its settled entries')
+        parser.add_argument('--settle', type=float, default=getattr(settings, 'LEDGER_SNAPSHOT_SETTLE', 300),
+                            help='Seconds an entry must be old to be covered by a snapshot')
+        parser.add_argument('--open-missing', action='store_true',
+                            help='Open the ledger of vehicles that have none at their current balance')
+        parser.add_argument('--no-confirm', action='store_true',
+                            help='Report balance mismatches without reading them again')
+        parser.add_argument('--show', type=int, default=20, help='Mismatches to print')
+        parser.add_argument('--output', help='Write the full report as JSON to this file')
+
+    def handle(self, *args, **options):
+        result = reconcile_ledger(
+            storage,
+            chunk_size=options['chunk_size'],
+            settle=options['settle'],
+            take_snapshots=options['snapshot'],
+            confirm=not options['no_confirm'],
+        )
+        if result is None:
+            raise CommandError('Storage backend is not available')
+
+        try:
+            if options['open_missing']:
+                opening = [
+                    mismatch for mismatch in result.mismatches
+                    if mismatch['problem'] == 'balance' and not mismatch['hasLedger']
+                ]
+                if not storage.append_ledger_entries(
+                    [(mismatch['vehicleId'], opening_entry(mismatch['balanceCents'])) for mismatch in opening]
+                ):
+                    raise CommandError('Could not open ledgers')
+                opened = {mismatch['vehicleId'] for mismatch in opening}
+                result.mismatches = [
+                    mismatch for mismatch in result.mismatches
+                    if mismatch['problem'] != 'balance' or mismatch['vehicleId'] not in opened
+                ]
+                self.stdout.write(f'Opened {len(opening)} ledgers at their current balance')
+            if options['snapshot'] and not storage.write_ledger_snapshots(result.snapshots):
+                raise CommandError('Could not write ledger snapshots')
+        except NotImplementedError:
+            raise CommandError('This storage backend does not keep a separate ledger')
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump({'summary': result.summary(), 'mismatches': result.mismatches}, f, indent=2)
+        for mismatch in result.mismatches[:options['show']]:
+            self.stdout.write(json.dumps(mismatch))
+
+        summary = result.summary()
+        message = (f"Reconciled {summary['entries']} ledger entries of {summary['vehicles']} vehicles "
+                   f"in {summary['seconds']}s: {summary['mismatches']} mismatches")
+        if options['snapshot']:
+            message += f", {summary['snapshots']} snapshots written"
+        if result.mismatches:
+            self.stdout.write(self.style.WARNING(message))
+        else:
+            self.stdout.write(self.style.SUCCESS(message))
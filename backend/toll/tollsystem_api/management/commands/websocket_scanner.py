@@ -0,0 +1,172 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import websockets
+from django.core.management.base import BaseCommand
+
+from tollsystem_api.heartbeats import heartbeat_registry
+from tollsystem_api.startup import warm_up
+from tollsystem_api.toll_processing import process_toll_scan, is_valid_scanner_token
+
+logger = logging.getLogger(__name__)
+
+
+class ScannerGateway:
+    """Long-lived websocket connections for RFID scanners.
+
+    Scans are charged through the same `process_toll_scan` as the HTTP
+    endpoint, on a shared thread pool so blocking storage calls never stall
+    the event loop. Each connection may have at most `max_in_flight` scans
+    outstanding; once that many are pending the gateway stops reading from
+    the socket until one completes, so a flooding scanner is slowed down by
+    TCP backpressure instead of growing an unbounded queue.
+    """
+
+    def __init__(self, max_in_flight=8, workers=32):
+        self.max_in_flight = max_in_flight
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scan')
+        self.connected = {}
+
+    async def handler(self, websocket, path=None):
+        """Handle WebSocket connections from scanners"""
+        scanner_id = None
+        slots = asyncio.Semaphore(self.max_in_flight)
+        pending = set()
+        try:
+            while True:
+                await slots.acquire()
+                try:
+                    message = await websocket.recv()
+                except BaseException:
+                    slots.release()
+                    raise
+
+                try:
+                    data = json.loads(message)
+                except ValueError:
+                    slots.release()
+                    await websocket.send(json.dumps({'type': 'error', 'error': 'Invalid JSON'}))
+                    continue
+                if not isinstance(data, dict):
+                    slots.release()
+                    await websocket.send(json.dumps({'type': 'error', 'error': 'Expected a JSON object'}))
+                    continue
+
+                message_type = data.get('type')
+                if message_type == 'rfid_scan':
+                    if scanner_id is None:
+                        slots.release()
+                        await websocket.send(json.dumps({
+                            'type': 'error',
+                            'error': 'Scanner must register first',
+                            'request_id': data.get('request_id')
+                        }))
+                        continue
+                    data.setdefault('scanner_id', scanner_id)
+                    task = asyncio.ensure_future(self.process_rfid_scan(websocket, data, slots))
+                    pending.add(task)
+                    task.add_done_callback(pending.discard)
+                    continue
+
+                slots.release()
+                if message_type == 'register':
+                    if not is_valid_scanner_token(data.get('token')):
+                        logger.warning(f"Unauthorized scanner registration: {data.get('scanner_id')}")
+                        await websocket.send(json.dumps({
+                            'type': 'error',
+                            'error': 'Unauthorized - Invalid scanner token'
+                        }))
+                        await websocket.close(code=4401, reason='Invalid scanner token')
+                        return
+                    scanner_id = data.get('scanner_id') or 'Unknown'
+                    self.connected[scanner_id] = websocket
+                    heartbeat_registry.record_heartbeat(scanner_id, 'online', data.get('tollPlazaId'))
+                    await websocket.send(json.dumps({
+                        'type': 'registered',
+                        'scanner_id': scanner_id,
+                        'status': 'connected'
+                    }))
+                    logger.info(f"Scanner {scanner_id} connected")
+                elif message_type == 'heartbeat':
+                    if scanner_id is not None:
+                        heartbeat_registry.record_heartbeat(scanner_id, data.get('status', 'online'))
+                    await websocket.send(json.dumps({
+                        'type': 'heartbeat_ack',
+                        'server_time': datetime.now().isoformat()
+                    }))
+                else:
+                    await websocket.send(json.dumps({
+                        'type': 'error',
+                        'error': f"Unknown message type: {message_type}"
+                    }))
+
+        except websockets.exceptions.ConnectionClosed:
+            logger.info(f"Scanner {scanner_id} disconnected")
+        except Exception as e:
+            logger.error(f"Scanner {scanner_id} error: {e}")
+        finally:
+            if scanner_id is not None and self.connected.get(scanner_id) is websocket:
+                del self.connected[scanner_id]
+            # Scans already read have been charged or are being charged; let them finish
+            if pending:
+                await asyncio.gather(*pending, return_exceptions=True)
+
+    async def process_rfid_scan(self, websocket, data, slots):
+        """Charge one scan on the worker pool and send the result back"""
+        try:
+            loop = asyncio.get_running_loop()
+            try:
+                status_code, payload = await loop.run_in_executor(self.executor, process_toll_scan, data)
+            except ValueError as e:
+                logger.error(f"Value error in toll processing: {e}")
+                status_code, payload = 400, {'error': 'Invalid data format', 'success': False}
+            except Exception as e:
+                logger.error(f"Error processing RFID scan: {e}")
+                status_code, payload = 500, {'error': 'Internal server error', 'success': False}
+
+            result = {'type': 'scan_result', 'status': status_code, 'request_id': data.get('request_id')}
+            result.update(payload)
+            try:
+                await websocket.send(json.dumps(result, default=str))
+            except websockets.exceptions.ConnectionClosed:
+                logger.warning(f"Scanner disconnected before result for {data.get('rfid')} was sent")
+        finally:
+            slots.release()
+
+    async def serve(self, host, port):
+        async with websockets.serve(self.handler, host, port):
+            logger.info(f"WebSocket scanner gateway listening on ws://{host}:{port}")
+            await asyncio.Future()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+class Command(BaseCommand):
+    help = 'Start WebSocket server for RFID scanners'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='0.0.0.0')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--max-in-flight', type=int, default=8,
+                            help='Outstanding scans per connection before reads pause')
+        parser.add_argument('--workers', type=int, default=32,
+                            help='Threads shared by all connections for storage calls')
+
+    def handle(self, *args, **options):
+        warm_up()
+        gateway = ScannerGateway(
+            max_in_flight=options['max_in_flight'],
+            workers=options['workers'],
+        )
+        self.stdout.write(f"WebSocket server started on ws://{options['host']}:{options['port']}")
+        try:
+            asyncio.run(gateway.serve(options['host'], options['port']))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            gateway.shutdown()
+            heartbeat_registry.stop()
@@ -0,0 +1,215 @@
+import threading
+
+from .firebase_service import FirebaseService
+from .record_keys import generate_push_id
+
+
+def _split(path):
+    return [part for part in (path or '/').split('/') if part]
+
+
+def _clone(value):
+    """Copy nested dicts/lists so callers never share the stored tree"""
+    if isinstance(value, dict):
+        return {key: _clone(child) for key, child in value.items()}
+    if isinstance(value, list):
+        return [_clone(child) for child in value]
+    return value
+
+
+class MemoryDatabase:
+    """In-memory stand-in for the parts of `firebase_admin.db` FirebaseService uses.
+
+    `reference(path)` returns an object with the same get/set/update/push/
+    delete/transaction and ordered-query methods as `db.Reference`. Writes
+    are applied under one lock, so transactions are serialised rather than
+    retried, and server-side increments (`{'.sv': {'increment': n}}`) are
+    resolved in place.
+    """
+
+    def __init__(self, tree=None):
+        self._tree = tree if tree is not None else {}
+        self._lock = threading.RLock()
+
+    def reference(self, path='/'):
+        return MemoryReference(self, path)
+
+    def _node(self, parts):
+        node = self._tree
+        for part in parts:
+            if not isinstance(node, dict):
+                return None
+            node = node.get(part)
+        return node
+
+    def _get(self, parts):
+        with self._lock:
+            return _clone(self._node(parts))
+
+    def _set(self, parts, value):
+        if isinstance(value, dict) and isinstance(value.get('.sv'), dict):
+            current = self._node(parts)
+            value = (current if isinstance(current, (int, float)) else 0) + value['.sv'].get('increment', 0)
+        if not parts:
+            self._tree = _clone(value) if isinstance(value, dict) else {}
+            return
+        node = self._tree
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[part] = {}
+            node = child
+        if value is None or value == {}:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = _clone(value)
+
+    def size(self, path='/'):
+        """Number of children under `path`"""
+        with self._lock:
+            node = self._node(_split(path))
+            return len(node) if isinstance(node, dict) else 0
+
+
+class MemoryReference:
+    def __init__(self, database, path='/'):
+        self._database = database
+        self._parts = _split(path)
+        self.path = '/' + '/'.join(self._parts)
+        self.key = self._parts[-1] if self._parts else None
+
+    def child(self, path):
+        return MemoryReference(self._database, '/'.join(self._parts + _split(path)))
+
+    def get(self):
+        return self._database._get(self._parts)
+
+    def set(self, value):
+        with self._database._lock:
+            self._database._set(self._parts, value)
+
+    def update(self, value):
+        with self._database._lock:
+            for key, child in value.items():
+                self._database._set(self._parts + _split(key), child)
+
+    def delete(self):
+        self.set(None)
+
+    def push(self, value=''):
+        ref = self.child(generate_push_id())
+        if value:
+            ref.set(value)
+        return ref
+
+    def transaction(self, transaction_update):
+        # Holding the lock means the update never sees a stale value, so it
+        # runs once instead of being retried like a Firebase transaction
+        with self._database._lock:
+            new_value = transaction_update(self._database._get(self._parts))
+            self._database._set(self._parts, new_value)
+            return new_value
+
+    def order_by_key(self):
+        return MemoryQuery(self)
+
+
+class MemoryQuery:
+    def __init__(self, reference):
+        self._reference = reference
+        self._start = None
+        self._end = None
+        self._first = None
+        self._last = None
+
+    def start_at(self, start):
+        self._start = start
+        return self
+
+    def end_at(self, end):
+        self._end = end
+        return self
+
+    def limit_to_first(self, limit):
+        self._first = limit
+        return self
+
+    def limit_to_last(self, limit):
+        self._last = limit
+        return self
+
+    def get(self):
+        database = self._reference._database
+        with database._lock:
+            node = database._node(self._reference._parts)
+            if not isinstance(node, dict):
+                return {}
+            keys = sorted(
+                key for key in node
+                if (self._start is None or key >= self._start) and (self._end is None or key <= self._end)
+            )
+            if self._first is not None:
+                keys = keys[:self._first]
+            if self._last is not None:
+                keys = keys[-self._last:]
+            return {key: _clone(node[key]) for key in keys}
+
+
+class MemoryAsyncClient:
+    """AsyncFirebaseClient interface over a MemoryDatabase"""
+
+    def __init__(self, database):
+        self._database = database
+
+    async def get(self, path):
+        return self._database.reference(path).get()
+
+    async def query(self, path, start_at=None, end_at=None, limit_to_first=None, limit_to_last=None):
+        query = self._database.reference(path).order_by_key()
+        if start_at is not None:
+            query = query.start_at(start_at)
+        if end_at is not None:
+            query = query.end_at(end_at)
+        if limit_to_first is not None:
+            query = query.limit_to_first(limit_to_first)
+        if limit_to_last is not None:
+            query = query.limit_to_last(limit_to_last)
+        return query.get()
+
+    async def update(self, path, values):
+        self._database.reference(path).update(values)
+
+    async def transaction(self, path, transaction_update):
+        return self._database.reference(path).transaction(transaction_update)
+
+
+class MemoryFirebaseService(FirebaseService):
+    """FirebaseService over a MemoryDatabase, for benchmarks and offline runs.
+
+    Runs the real service code (vehicle index, snapshot cache, transactions,
+    multi-path record writes) against an in-process tree; can be selected
+    with STORAGE_BACKEND = 'tollsystem_api.memory_db.MemoryFirebaseService'.
+    """
+
+    _instance = None
+    _initialized = False
+
+    def __new__(cls, tree=None):
+        return super().__new__(cls)
+
+    def __init__(self, tree=None):
+        if not self._initialized:
+            self.db = MemoryDatabase(tree)
+            self.rest = MemoryAsyncClient(self.db)
+            # Every write goes through this service, so the index never goes stale
+            self.vehicle_index.max_age = None
+            self._initialized = True
+            self._setup_write_queue()
+
+    def _setup_http_pool(self):
+        pass
+
+    def _setup_change_stream(self, source=None):
+        pass
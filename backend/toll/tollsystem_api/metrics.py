@@ -0,0 +1,295 @@
+import bisect
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Seconds; covers in-memory hits (~0.1ms) through slow Firebase round trips
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STARTUP_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+BYTES_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+# Label values past this many series per metric are reported as 'other', so
+# client-supplied values (plaza ids, paths) cannot grow the registry unbounded
+MAX_SERIES = 500
+OVERFLOW = 'other'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs.extend(f'{name}="{_escape(value)}"' for name, value in extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=(), max_series=MAX_SERIES):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.max_series = max_series
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        if key not in self._series and len(self._series) >= self.max_series:
+            key = tuple(OVERFLOW for _ in self.labelnames)
+        return key
+
+    def _lines(self, key, value):
+        raise NotImplementedError
+
+    def _exposed_name(self):
+        return self.name
+
+    def render(self):
+        name = self._exposed_name()
+        lines = [f'# HELP {name} {self.documentation}', f'# TYPE {name} {self.kind}']
+        with self._lock:
+            series = [(key, self._snapshot(value)) for key, value in sorted(self._series.items())]
+        for key, value in series:
+            lines.extend(self._lines(key, value))
+        return lines
+
+    def _snapshot(self, value):
+        return value
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _exposed_name(self):
+        return f'{self.name}_total'
+
+    def inc(self, amount=1, **labels):
+        with self._lock:
+            key = self._key(labels)
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _lines(self, key, value):
+        return [f'{self.name}_total{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Gauge(_Metric):
+    """Current values, each read from a function when the metrics are rendered"""
+
+    kind = 'gauge'
+
+    def set_function(self, function, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = function
+
+    def render(self):
+        name = self._exposed_name()
+        lines = [f'# HELP {name} {self.documentation}', f'# TYPE {name} {self.kind}']
+        with self._lock:
+            series = sorted(self._series.items())
+        for key, function in series:
+            try:
+                value = function()
+            except Exception as e:
+                logger.warning(f"Could not read gauge {name}: {e}")
+                continue
+            lines.extend(self._lines(key, value))
+        return lines
+
+    def _lines(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}']
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram in the Prometheus exposition format"""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS, max_series=MAX_SERIES):
+        super().__init__(name, documentation, labelnames, max_series)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(labels)
+            series = self._series.get(key)
+            if series is None:
+                # Per-bucket counts (last slot is +Inf), then sum and count
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def _snapshot(self, value):
+        return list(value[0]), value[1], value[2]
+
+    def _lines(self, key, value):
+        counts, total, count = value
+        lines = []
+        cumulative = 0
+        for bound, bucket in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket
+            labels = _format_labels(self.labelnames, key, [('le', _format_value(float(bound)))])
+            lines.append(f'{self.name}_bucket{labels} {cumulative}')
+        labels = _format_labels(self.labelnames, key)
+        lines.append(f'{self.name}_sum{labels} {_format_value(round(total, 6))}')
+        lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, *args, **kwargs):
+        return self.register(Counter(*args, **kwargs))
+
+    def histogram(self, *args, **kwargs):
+        return self.register(Histogram(*args, **kwargs))
+
+    def gauge(self, *args, **kwargs):
+        return self.register(Gauge(*args, **kwargs))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def sample_rate():
+    return getattr(settings, 'METRICS_SAMPLE_RATE', 1.0)
+
+
+def sampled():
+    """Whether to time this request's stages (counters are always kept)"""
+    rate = sample_rate()
+    return rate >= 1 or (rate > 0 and random.random() < rate)
+
+
+class StageTimer:
+    """Observes the time since the previous lap into `histogram` under label `stage`"""
+
+    def __init__(self, histogram, **labels):
+        self._histogram = histogram
+        self._labels = labels
+        self._last = time.perf_counter()
+
+    def lap(self, stage):
+        now = time.perf_counter()
+        self._histogram.observe(now - self._last, stage=stage, **self._labels)
+        self._last = now
+
+
+class _NullTimer:
+    def lap(self, stage):
+        pass
+
+
+NULL_TIMER = _NullTimer()
+
+
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'toll_http_request_seconds', 'API request latency by endpoint, method and status.',
+    ('endpoint', 'method', 'status'),
+)
+HTTP_REQUEST_BYTES = registry.histogram(
+    'toll_http_request_bytes', 'API request body size by endpoint.', ('endpoint',), buckets=BYTES_BUCKETS,
+)
+HTTP_RESPONSE_BYTES = registry.histogram(
+    'toll_http_response_bytes', 'API response body size by endpoint.', ('endpoint',), buckets=BYTES_BUCKETS,
+)
+STORAGE_CALL_SECONDS = registry.histogram(
+    'toll_storage_call_seconds', 'Storage backend call latency by method.', ('method',),
+)
+STORAGE_CALL_ERRORS = registry.counter(
+    'toll_storage_call_errors', 'Storage backend calls that raised, by method.', ('method',),
+)
+FIREBASE_REQUEST_SECONDS = registry.histogram(
+    'toll_firebase_request_seconds', 'Firebase REST round trips by HTTP method and top-level node.',
+    ('method', 'node', 'status'),
+)
+FIREBASE_RESPONSE_BYTES = registry.histogram(
+    'toll_firebase_response_bytes', 'Firebase REST response size by top-level node.', ('method', 'node'),
+    buckets=BYTES_BUCKETS,
+)
+TOLL_SCAN_SECONDS = registry.histogram(
+    'toll_scan_seconds', 'RFID toll scan processing time by plaza and outcome.', ('plaza', 'outcome'),
+)
+TOLL_SCANS = registry.counter(
+    'toll_scans', 'RFID toll scans by plaza and outcome.', ('plaza', 'outcome'),
+)
+TOLL_SCAN_STAGE_SECONDS = registry.histogram(
+    'toll_scan_stage_seconds', 'Time spent in each stage of an RFID toll scan.', ('stage',),
+)
+WATCHLIST_HITS = registry.counter(
+    'toll_watchlist_hits', 'Scans matching a watchlisted vehicle, by plaza and matched field.',
+    ('plaza', 'matched_on'),
+)
+WRITE_BEHIND_RECORDS = registry.gauge(
+    'toll_write_behind_records', 'Records in the write-behind journal, pending or dead (given up on).', ('state',),
+)
+STARTUP_SECONDS = registry.histogram(
+    'toll_startup_seconds', 'Time taken by each startup step: storage init, warm-up, first scan.', ('step',),
+    buckets=STARTUP_BUCKETS,
+)
+
+# Latest duration of each startup step in this process, for the readiness endpoint
+startup_timings = {}
+
+
+def record_startup(step, seconds):
+    startup_timings[step] = round(seconds, 4)
+    STARTUP_SECONDS.observe(seconds, step=step)
+
+
+def scan_outcome(status_code):
+    return {
+        200: 'success',
+        400: 'invalid',
+        402: 'insufficient_balance',
+        403: 'suspended',
+        404: 'unknown_tag',
+    }.get(status_code, 'error' if status_code >= 500 else str(status_code))
+
+
+def firebase_response_hook(response, *args, **kwargs):
+    """requests response hook recording Firebase REST timings and payload sizes"""
+    try:
+        path = response.request.path_url.split('?', 1)[0]
+        node = path.strip('/').split('/', 1)[0].split('.json', 1)[0] or '/'
+        method = response.request.method
+        FIREBASE_REQUEST_SECONDS.observe(
+            response.elapsed.total_seconds(), method=method, node=node, status=response.status_code
+        )
+        length = response.headers.get('Content-Length')
+        FIREBASE_RESPONSE_BYTES.observe(
+            int(length) if length is not None else len(response.content), method=method, node=node
+        )
+    except Exception as e:
+        logger.debug(f"Could not record Firebase request metrics: {e}")
+    return response
+
@@ -0,0 +1,53 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .metrics import HTTP_REQUEST_BYTES, HTTP_REQUEST_SECONDS, HTTP_RESPONSE_BYTES, sampled
+
+
+class MetricsMiddleware:
+    """Records latency and body sizes of every request, labelled by URL name.
+
+    Works in both sync and async stacks, so async views are not pushed onto
+    a thread by it.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not sampled():
+            return self.get_response(request)
+        started = time.perf_counter()
+        response = self.get_response(request)
+        self._observe(request, response, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if not sampled():
+            return await self.get_response(request)
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self._observe(request, response, time.perf_counter() - started)
+        return response
+
+    def _observe(self, request, response, elapsed):
+        match = getattr(request, 'resolver_match', None)
+        endpoint = (match.url_name or match.view_name) if match else 'unmatched'
+        HTTP_REQUEST_SECONDS.observe(elapsed, endpoint=endpoint, method=request.method, status=response.status_code)
+        try:
+            request_bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+        except ValueError:
+            request_bytes = 0
+        if request_bytes:
+            HTTP_REQUEST_BYTES.observe(request_bytes, endpoint=endpoint)
+        if not response.streaming:
+            HTTP_RESPONSE_BYTES.observe(len(response.content), endpoint=endpoint)
@@ -0,0 +1,155 @@
+# Generated by Django 4.2.26 on 2026-10-18 07:16
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+import tollsystem_api.record_keys
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tollsystem_api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PricingRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('vehicle_type', models.CharField(max_length=20)),
+                ('base_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('currency', models.CharField(default='USD', max_length=3)),
+                ('description', models.CharField(blank=True, max_length=200)),
+                ('is_active', models.BooleanField(default=True)),
+                ('toll_plaza_id', models.CharField(blank=True, max_length=50)),
+                ('time_band', models.CharField(blank=True, max_length=20)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='balance_after',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='key',
+            field=models.CharField(default=tollsystem_api.record_keys.generate_push_id, max_length=40, unique=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='tollsystem_api.owner'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='reference_number',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='key',
+            field=models.CharField(default=tollsystem_api.record_keys.generate_push_id, max_length=40, unique=True),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='license_plate',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='owner',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, to='tollsystem_api.owner'),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='reader_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='rfid',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='status',
+            field=models.CharField(default='completed', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='toll_plaza_id',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='tollrecord',
+            name='vehicle_type',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='make',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='model',
+            field=models.CharField(blank=True, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='reactivated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='suspended_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='vehicle',
+            name='year',
+            field=models.CharField(blank=True, max_length=4),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='payment_method',
+            field=models.CharField(blank=True, max_length=20),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='tollrecord',
+            name='timestamp',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='vehicle',
+            name='status',
+            field=models.CharField(db_index=True, default='active', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['owner', '-timestamp'], name='tollsystem__owner_i_666348_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['timestamp'], name='tollsystem__timesta_6a1fce_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tollrecord',
+            index=models.Index(fields=['owner', '-timestamp'], name='tollsystem__owner_i_461fa3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tollrecord',
+            index=models.Index(fields=['timestamp'], name='tollsystem__timesta_8e05e2_idx'),
+        ),
+    ]
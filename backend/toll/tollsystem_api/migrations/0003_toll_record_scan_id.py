@@ -0,0 +1,22 @@
+# Generated by Django 4.2.26 on 2026-10-18 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tollsystem_api', '0002_storage_backend_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tollrecord',
+            name='scan_id',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddIndex(
+            model_name='tollrecord',
+            index=models.Index(fields=['reader_id', 'scan_id'], name='tollsystem__reader__911392_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.26 on 2026-10-18 07:24
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tollsystem_api', '0003_toll_record_scan_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HardwareEndpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('endpoint_id', models.CharField(max_length=50, unique=True)),
+                ('toll_plaza_id', models.CharField(blank=True, max_length=50)),
+                ('status', models.CharField(default='offline', max_length=20)),
+                ('is_online', models.BooleanField(default=False)),
+                ('last_heartbeat', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
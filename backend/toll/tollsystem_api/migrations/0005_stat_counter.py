@@ -0,0 +1,28 @@
+# Generated by Django 4.2.26 on 2026-10-18 07:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tollsystem_api', '0004_hardware_endpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('group', models.CharField(max_length=20)),
+                ('key', models.CharField(max_length=100)),
+                ('count', models.BigIntegerField(default=0)),
+                ('revenue_cents', models.BigIntegerField(default=0)),
+                ('recharges', models.BigIntegerField(default=0)),
+                ('recharge_amount_cents', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'unique_together': {('group', 'key')},
+            },
+        ),
+    ]
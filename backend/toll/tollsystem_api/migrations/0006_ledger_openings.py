@@ -0,0 +1,43 @@
+from decimal import Decimal
+
+from django.db import migrations
+from django.db.models import Sum
+
+from tollsystem_api.record_keys import generate_push_id
+
+
+def open_ledgers(apps, schema_editor):
+    """Record what the toll and payment history does not explain of each balance
+    (seeded balances, edits made outside the service) as an opening entry"""
+    Vehicle = apps.get_model('tollsystem_api', 'Vehicle')
+    TollRecord = apps.get_model('tollsystem_api', 'TollRecord')
+    Payment = apps.get_model('tollsystem_api', 'Payment')
+    paid = dict(Payment.objects.values_list('vehicle_id').annotate(total=Sum('amount')))
+    charged = dict(TollRecord.objects.values_list('vehicle_id').annotate(total=Sum('toll_amount')))
+    openings = []
+    for pk, owner_id, balance in Vehicle.objects.values_list('pk', 'owner_id', 'balance').iterator():
+        difference = balance - (paid.get(pk) or Decimal(0)) + (charged.get(pk) or Decimal(0))
+        if difference:
+            openings.append(Payment(
+                key=generate_push_id(),
+                vehicle_id=pk,
+                owner_id=owner_id,
+                amount=difference,
+                payment_method='opening',
+            ))
+    Payment.objects.bulk_create(openings, batch_size=500)
+
+
+def close_ledgers(apps, schema_editor):
+    apps.get_model('tollsystem_api', 'Payment').objects.filter(payment_method='opening').delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tollsystem_api', '0005_stat_counter'),
+    ]
+
+    operations = [
+        migrations.RunPython(open_ledgers, close_ledgers),
+    ]
@@ -1,5 +1,8 @@
 # Create your models here.
 from django.db import models
+from django.utils import timezone
+
+from .record_keys import generate_push_id
 
 class Owner(models.Model):
     name = models.CharField(max_length=200)
@@ -16,20 +19,80 @@ class Vehicle(models.Model):
     rfid_tag = models.CharField(max_length=50, unique=True)
     vehicle_type = models.CharField(max_length=20)
     balance = models.DecimalField(max_digits=10, decimal_places=2, default=0)
-    status = models.CharField(max_length=20, default='active')
+    status = models.CharField(max_length=20, default='active', db_index=True)
+    make = models.CharField(max_length=50, blank=True)
+    model = models.CharField(max_length=50, blank=True)
+    year = models.CharField(max_length=4, blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    suspended_at = models.DateTimeField(null=True, blank=True)
+    reactivated_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return self.plate_number
 
 class TollRecord(models.Model):
+    key = models.CharField(max_length=40, unique=True, default=generate_push_id)
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE)
+    owner = models.ForeignKey(Owner, on_delete=models.CASCADE, null=True)
+    rfid = models.CharField(max_length=50, blank=True)
+    vehicle_type = models.CharField(max_length=20, blank=True)
+    license_plate = models.CharField(max_length=20, blank=True)
     toll_amount = models.DecimalField(max_digits=10, decimal_places=2)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    timestamp = models.DateTimeField(default=timezone.now)
     location = models.CharField(max_length=200)
+    toll_plaza_id = models.CharField(max_length=50, blank=True)
+    reader_id = models.CharField(max_length=50, blank=True)
+    scan_id = models.CharField(max_length=100, blank=True)
+    status = models.CharField(max_length=20, default='completed')
     balance_after = models.DecimalField(max_digits=10, decimal_places=2)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', '-timestamp']),
+            models.Index(fields=['timestamp']),
+            models.Index(fields=['reader_id', 'scan_id']),
+        ]
+
 class Payment(models.Model):
+    key = models.CharField(max_length=40, unique=True, default=generate_push_id)
     vehicle = models.ForeignKey(Vehicle, on_delete=models.CASCADE)
+    owner = models.ForeignKey(Owner, on_delete=models.CASCADE, null=True)
     amount = models.DecimalField(max_digits=10, decimal_places=2)
-    payment_method = models.CharField(max_length=20)
-    timestamp = models.DateTimeField(auto_now_add=True)
\ No newline at end of file
+    payment_method = models.CharField(max_length=20, blank=True)
+    reference_number = models.CharField(max_length=50, blank=True)
+    timestamp = models.DateTimeField(default=timezone.now)
+    balance_after = models.DecimalField(max_digits=10, decimal_places=2, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['owner', '-timestamp']),
+            models.Index(fields=['timestamp']),
+        ]
+
+class PricingRule(models.Model):
+    vehicle_type = models.CharField(max_length=20)
+    base_price = models.DecimalField(max_digits=10, decimal_places=2)
+    currency = models.CharField(max_length=3, default='USD')
+    description = models.CharField(max_length=200, blank=True)
+    is_active = models.BooleanField(default=True)
+    toll_plaza_id = models.CharField(max_length=50, blank=True)
+    time_band = models.CharField(max_length=20, blank=True)
+
+class HardwareEndpoint(models.Model):
+    endpoint_id = models.CharField(max_length=50, unique=True)
+    toll_plaza_id = models.CharField(max_length=50, blank=True)
+    status = models.CharField(max_length=20, default='offline')
+    is_online = models.BooleanField(default=False)
+    last_heartbeat = models.DateTimeField(null=True, blank=True)
+
+class StatCounter(models.Model):
+    """Dashboard aggregate for one (group, key), e.g. ('byPlaza', 'plaza1')"""
+    group = models.CharField(max_length=20)
+    key = models.CharField(max_length=100)
+    count = models.BigIntegerField(default=0)
+    revenue_cents = models.BigIntegerField(default=0)
+    recharges = models.BigIntegerField(default=0)
+    recharge_amount_cents = models.BigIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('group', 'key')
@@ -0,0 +1,742 @@
+import heapq
+import logging
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Q, Sum
+
+from .models import Owner, Vehicle, TollRecord, Payment, PricingRule, HardwareEndpoint, StatCounter
+from .record_keys import parse_timestamp, timestamp_key, split_owner_index_key
+from .stats import stat_increments, merge_increments, to_cents
+from .storage import StorageBackend, InsufficientBalance
+from .watchlist import WATCHED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+CENT = Decimal('0.01')
+
+# Firebase vehicle field -> Vehicle model field
+VEHICLE_FIELDS = {
+    'licensePlate': 'plate_number',
+    'rfid': 'rfid_tag',
+    'type': 'vehicle_type',
+    'balance': 'balance',
+    'status': 'status',
+    'make': 'make',
+    'model': 'model',
+    'year': 'year',
+    'createdAt': 'created_at',
+    'suspendedAt': 'suspended_at',
+    'reactivatedAt': 'reactivated_at',
+}
+VEHICLE_TIMESTAMP_FIELDS = {'created_at', 'suspended_at', 'reactivated_at'}
+
+# Payment rows with these methods are ledger entries (ledger.opening_entry, balance
+# adjustments) rather than payments: they count towards the ledger but are
+# left out of payment history, exports and stats
+LEDGER_PAYMENT_METHODS = ('opening', 'adjustment')
+
+# Aggregate field -> StatCounter field
+STAT_FIELDS = {
+    'count': 'count',
+    'revenueCents': 'revenue_cents',
+    'recharges': 'recharges',
+    'rechargeAmountCents': 'recharge_amount_cents',
+}
+
+
+def _to_pk(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _money(value):
+    return Decimal(str(value)).quantize(CENT)
+
+
+def _iso(value):
+    if value is None:
+        return None
+    return value.astimezone(dt_timezone.utc).isoformat().replace('+00:00', 'Z')
+
+
+def _compact(data):
+    """Drop None values, as Firebase does for null children"""
+    return {key: value for key, value in data.items() if value is not None}
+
+
+def owner_to_dict(owner):
+    return _compact({
+        'name': owner.name,
+        'email': owner.email,
+        'phone': owner.phone,
+        'createdAt': _iso(owner.created_at),
+    })
+
+
+def vehicle_to_dict(vehicle):
+    return _compact({
+        'licensePlate': vehicle.plate_number,
+        'rfid': vehicle.rfid_tag,
+        'type': vehicle.vehicle_type,
+        'ownerId': str(vehicle.owner_id),
+        'ownerName': vehicle.owner.name,
+        'balance': float(vehicle.balance),
+        'status': vehicle.status,
+        'make': vehicle.make,
+        'model': vehicle.model,
+        'year': vehicle.year,
+        'createdAt': _iso(vehicle.created_at),
+        'suspendedAt': _iso(vehicle.suspended_at),
+        'reactivatedAt': _iso(vehicle.reactivated_at),
+    })
+
+
+def toll_record_to_dict(record):
+    return _compact({
+        'id': record.key,
+        'vehicleId': str(record.vehicle_id),
+        'ownerId': str(record.owner_id) if record.owner_id else None,
+        'rfid': record.rfid,
+        'vehicleType': record.vehicle_type,
+        'amount': float(record.toll_amount),
+        'balanceAfter': float(record.balance_after),
+        'tollPlazaId': record.toll_plaza_id,
+        'checkpoint': record.location,
+        'readerId': record.reader_id,
+        'scanId': record.scan_id or None,
+        'licensePlate': record.license_plate,
+        'timestamp': _iso(record.timestamp),
+        'status': record.status,
+    })
+
+
+def payment_to_dict(payment):
+    return _compact({
+        'id': payment.key,
+        'vehicleId': str(payment.vehicle_id),
+        'ownerId': str(payment.owner_id) if payment.owner_id else None,
+        'amount': float(payment.amount),
+        'balanceAfter': float(payment.balance_after) if payment.balance_after is not None else None,
+        'paymentMethod': payment.payment_method,
+        'referenceNumber': payment.reference_number,
+        'timestamp': _iso(payment.timestamp),
+    })
+
+
+class OrmStorage(StorageBackend):
+    """StorageBackend on the Django ORM (SQLite/Postgres via settings.DATABASES).
+
+    Lookups by RFID tag and plate use the unique indexes on `rfid_tag` and
+    `plate_number`; owner history uses the (owner, -timestamp) indexes.
+    Balance changes and their records commit in one database transaction.
+    """
+
+    RECORD_MODELS = {
+        'transactions': (TollRecord, toll_record_to_dict),
+        'payments': (Payment, payment_to_dict),
+    }
+
+    def _records(self, collection):
+        """(queryset, to_dict) of a record collection"""
+        model, to_dict = self.RECORD_MODELS[collection]
+        if model is Payment:
+            return Payment.objects.exclude(payment_method__in=LEDGER_PAYMENT_METHODS), to_dict
+        return model.objects.all(), to_dict
+
+    # Owners
+
+    def get_owners(self):
+        try:
+            return {str(owner.pk): owner_to_dict(owner) for owner in Owner.objects.all()}
+        except Exception as e:
+            logger.error(f"Error getting owners: {e}")
+            return None
+
+    def get_owner(self, owner_id):
+        pk = _to_pk(owner_id)
+        if pk is None:
+            return None
+        try:
+            owner = Owner.objects.filter(pk=pk).first()
+            return owner_to_dict(owner) if owner else None
+        except Exception as e:
+            logger.error(f"Error getting owner {owner_id}: {e}")
+            return None
+
+    def get_owners_page(self, limit, after=None):
+        try:
+            owners = Owner.objects.order_by('pk')
+            if after is not None:
+                owners = owners.filter(pk__gt=_to_pk(after) or 0)
+            rows = list(owners[:limit + 1] if limit else owners)
+            next_key = str(rows[limit - 1].pk) if limit and len(rows) > limit else None
+            return [(str(owner.pk), owner_to_dict(owner)) for owner in rows[:limit]], next_key
+        except Exception as e:
+            logger.error(f"Error getting owners page: {e}")
+            return None, None
+
+    def add_owner(self, data):
+        try:
+            owner = Owner.objects.create(
+                name=data.get('name') or '',
+                email=data.get('email'),
+                phone=data.get('phone') or '',
+            )
+            return str(owner.pk)
+        except Exception as e:
+            logger.error(f"Error adding owner: {e}")
+            return None
+
+    # Vehicles
+
+    def _vehicles(self):
+        return Vehicle.objects.select_related('owner')
+
+    def get_vehicles(self):
+        try:
+            return {str(vehicle.pk): vehicle_to_dict(vehicle) for vehicle in self._vehicles()}
+        except Exception as e:
+            logger.error(f"Error getting vehicles: {e}")
+            return None
+
+    def get_vehicle(self, vehicle_id):
+        pk = _to_pk(vehicle_id)
+        if pk is None:
+            return None
+        try:
+            vehicle = self._vehicles().filter(pk=pk).first()
+            return vehicle_to_dict(vehicle) if vehicle else None
+        except Exception as e:
+            logger.error(f"Error getting vehicle {vehicle_id}: {e}")
+            return None
+
+    def find_vehicle_by_rfid(self, rfid):
+        if not rfid:
+            return None, None
+        try:
+            vehicle = self._vehicles().filter(rfid_tag=rfid).first()
+            if vehicle is None:
+                return None, None
+            return str(vehicle.pk), vehicle_to_dict(vehicle)
+        except Exception as e:
+            logger.error(f"Error getting vehicle by RFID: {e}")
+            return None, None
+
+    def match_plate(self, plate, limit=5):
+        # Exact (case-insensitive) matches only; fuzzy matching needs the in-memory plate index
+        if not plate:
+            return []
+        try:
+            vehicles = self._vehicles().filter(plate_number__iexact=str(plate).strip()).order_by('pk')[:limit]
+            return [(str(vehicle.pk), vehicle_to_dict(vehicle), 1.0) for vehicle in vehicles]
+        except Exception as e:
+            logger.error(f"Error matching licence plate: {e}")
+            return []
+
+    def check_watchlist(self, rfid=None, plate=None):
+        conditions = Q()
+        if rfid:
+            conditions |= Q(rfid_tag=rfid)
+        if plate:
+            conditions |= Q(plate_number__iexact=str(plate).strip())
+        if not conditions:
+            return None, None, None
+        try:
+            vehicle = self._vehicles().filter(conditions, status__in=WATCHED_STATUSES).first()
+            if vehicle is None:
+                return None, None, None
+            matched_on = 'rfid' if rfid and vehicle.rfid_tag == rfid else 'plate'
+            return str(vehicle.pk), vehicle_to_dict(vehicle), matched_on
+        except Exception as e:
+            logger.error(f"Error checking watchlist: {e}")
+            return None, None, None
+
+    def get_watchlist(self):
+        try:
+            vehicles = self._vehicles().filter(status__in=WATCHED_STATUSES).order_by('pk')
+            return {str(vehicle.pk): vehicle_to_dict(vehicle) for vehicle in vehicles}
+        except Exception as e:
+            logger.error(f"Error getting watchlist: {e}")
+            return None
+
+    def get_owner_vehicles(self, owner_id):
+        pk = _to_pk(owner_id)
+        if pk is None:
+            return {}
+        try:
+            vehicles = self._vehicles().filter(owner_id=pk).order_by('pk')
+            return {str(vehicle.pk): vehicle_to_dict(vehicle) for vehicle in vehicles}
+        except Exception as e:
+            logger.error(f"Error getting vehicles for owner {owner_id}: {e}")
+            return None
+
+    def get_vehicles_page(self, limit, after=None, predicate=None):
+        try:
+            vehicles = self._vehicles().order_by('pk')
+            if after is not None:
+                vehicles = vehicles.filter(pk__gt=_to_pk(after) or 0)
+            items = []
+            next_key = None
+            for vehicle in vehicles.iterator(chunk_size=max(limit or 0, 100)):
+                data = vehicle_to_dict(vehicle)
+                if predicate is not None and not predicate(data):
+                    continue
+                if len(items) == limit:
+                    next_key = items[-1][0]
+                    break
+                items.append((str(vehicle.pk), data))
+            return items, next_key
+        except Exception as e:
+            logger.error(f"Error getting vehicles page: {e}")
+            return None, None
+
+    def update_vehicle(self, vehicle_id, fields):
+        pk = _to_pk(vehicle_id)
+        if pk is None:
+            return False
+        changes = {}
+        for key, value in fields.items():
+            field = VEHICLE_FIELDS.get(key)
+            if field is None:
+                logger.warning(f"Ignoring unknown vehicle field {key}")
+                continue
+            if field in VEHICLE_TIMESTAMP_FIELDS:
+                value = parse_timestamp(value)
+            elif field == 'balance':
+                value = _money(value or 0)
+            elif value is None:
+                value = ''
+            changes[field] = value
+        try:
+            return Vehicle.objects.filter(pk=pk).update(**changes) > 0
+        except Exception as e:
+            logger.error(f"Error updating vehicle {vehicle_id}: {e}")
+            return False
+
+    # Balances and history
+
+    def _build_record(self, collection, data):
+        """Unsaved TollRecord/Payment for a Firebase-shaped record"""
+        vehicle_id = _to_pk(data.get('vehicleId'))
+        owner_id = _to_pk(data.get('ownerId'))
+        timestamp = parse_timestamp(data.get('timestamp'))
+        extra = {'key': data['id']} if data.get('id') else {}
+        if timestamp is not None:
+            extra['timestamp'] = timestamp
+        if collection == 'transactions':
+            return TollRecord(
+                vehicle_id=vehicle_id,
+                owner_id=owner_id,
+                rfid=data.get('rfid') or '',
+                vehicle_type=data.get('vehicleType') or '',
+                license_plate=data.get('licensePlate') or '',
+                toll_amount=_money(data.get('amount', 0)),
+                location=data.get('checkpoint') or '',
+                toll_plaza_id=data.get('tollPlazaId') or '',
+                reader_id=data.get('readerId') or '',
+                scan_id=data.get('scanId') or '',
+                status=data.get('status') or 'completed',
+                balance_after=_money(data.get('balanceAfter', 0)),
+                **extra
+            )
+        else:
+            balance_after = data.get('balanceAfter')
+            return Payment(
+                vehicle_id=vehicle_id,
+                owner_id=owner_id,
+                amount=_money(data.get('amount', 0)),
+                payment_method=data.get('paymentMethod') or '',
+                reference_number=data.get('referenceNumber') or '',
+                balance_after=_money(balance_after) if balance_after is not None else None,
+                **extra
+            )
+
+    def _create_record(self, collection, data):
+        with transaction.atomic():
+            record = self._build_record(collection, data)
+            record.save()
+            self._bump_stats(stat_increments(collection, data))
+        return record.key
+
+    def _bump_stats(self, increments):
+        """Add increments to the StatCounter rows, creating missing ones"""
+        for (group, key), fields in increments.items():
+            values = {STAT_FIELDS[field]: F(STAT_FIELDS[field]) + amount for field, amount in fields.items()}
+            if not StatCounter.objects.filter(group=group, key=key).update(**values):
+                StatCounter.objects.get_or_create(group=group, key=key)
+                StatCounter.objects.filter(group=group, key=key).update(**values)
+
+    def _adjust_balance(self, vehicle_id, delta, collection, record, min_balance=None):
+        pk = _to_pk(vehicle_id)
+        if pk is None:
+            return None
+        try:
+            with transaction.atomic():
+                vehicle = Vehicle.objects.select_for_update().get(pk=pk)
+                previous_balance = vehicle.balance
+                new_balance = (previous_balance + _money(delta)).quantize(CENT)
+                if min_balance is not None and new_balance < min_balance:
+                    raise InsufficientBalance(float(previous_balance), -delta)
+                vehicle.balance = new_balance
+                vehicle.save(update_fields=['balance'])
+
+                data = dict(record)
+                data['balanceAfter'] = float(new_balance)
+                record_id = self._create_record(collection, data)
+            return float(previous_balance), float(new_balance), record_id
+        except InsufficientBalance:
+            raise
+        except Exception as e:
+            logger.error(f"Error adjusting balance of {vehicle_id} by {delta}: {e}")
+            return None
+
+    def debit_balance(self, vehicle_id, amount, record):
+        return self._adjust_balance(vehicle_id, -amount, 'transactions', record, min_balance=0)
+
+    def credit_balance(self, vehicle_id, amount, record):
+        return self._adjust_balance(vehicle_id, amount, 'payments', record)
+
+    def debit_balances(self, debits):
+        """Apply a batch of toll debits in one database transaction.
+
+        Vehicles are locked in id order so concurrent batches cannot deadlock,
+        and all accepted records are inserted with one bulk insert.
+        """
+        outcome = {}
+        records = []
+        increments = {}
+        try:
+            with transaction.atomic():
+                pks = {vehicle_id: _to_pk(vehicle_id) for vehicle_id in debits}
+                vehicles = Vehicle.objects.select_for_update().in_bulk(
+                    sorted(pk for pk in pks.values() if pk is not None)
+                )
+                for vehicle_id, charges in debits.items():
+                    vehicle = vehicles.get(pks[vehicle_id])
+                    if vehicle is None:
+                        outcome[vehicle_id] = None
+                        continue
+                    balance = vehicle.balance
+                    vehicle_results = []
+                    for amount, record in charges:
+                        new_balance = (balance - _money(amount)).quantize(CENT)
+                        if new_balance < 0:
+                            vehicle_results.append(InsufficientBalance(float(balance), amount))
+                            continue
+                        data = dict(record)
+                        data['balanceAfter'] = float(new_balance)
+                        toll_record = self._build_record('transactions', data)
+                        records.append(toll_record)
+                        merge_increments(increments, stat_increments('transactions', data))
+                        vehicle_results.append((float(balance), float(new_balance), toll_record.key))
+                        balance = new_balance
+                    if balance != vehicle.balance:
+                        vehicle.balance = balance
+                        vehicle.save(update_fields=['balance'])
+                    outcome[vehicle_id] = vehicle_results
+                TollRecord.objects.bulk_create(records)
+                self._bump_stats(increments)
+            return outcome
+        except Exception as e:
+            logger.error(f"Error applying {len(records)} bulk debits: {e}")
+            return None
+
+    def get_scan_receipts(self, reader_id, scan_ids):
+        try:
+            receipts = TollRecord.objects.filter(
+                reader_id=reader_id, scan_id__in=[str(scan_id) for scan_id in scan_ids]
+            ).values_list('scan_id', 'key')
+            return dict(receipts)
+        except Exception as e:
+            logger.error(f"Error getting scan receipts for reader {reader_id}: {e}")
+            return None
+
+    def push_toll_record(self, data):
+        try:
+            return self._create_record('transactions', data)
+        except Exception as e:
+            logger.error(f"Error saving toll record: {e}")
+            return None
+
+    def push_payment_record(self, data):
+        try:
+            return self._create_record('payments', data)
+        except Exception as e:
+            logger.error(f"Error saving payment record: {e}")
+            return None
+
+    def write_records(self, records, replayed=()):
+        with transaction.atomic():
+            for collection, record_id, data in records:
+                model, _ = self.RECORD_MODELS[collection]
+                if model.objects.filter(key=record_id).exists():
+                    continue
+                data = dict(data)
+                data['id'] = record_id
+                self._create_record(collection, data)
+
+    def get_owner_records(self, collection, owner_id, limit=None, after=None, since=None, until=None):
+        records, to_dict = self._records(collection)
+        pk = _to_pk(owner_id)
+        if pk is None:
+            return [], None
+        try:
+            records = records.filter(owner_id=pk).order_by('-timestamp', '-key')
+            if since:
+                records = records.filter(timestamp__gte=parse_timestamp(since))
+            if until:
+                records = records.filter(timestamp__lte=parse_timestamp(until))
+            if after is not None:
+                after_time, after_key = split_owner_index_key(after)
+                records = records.filter(
+                    Q(timestamp__lt=after_time) | Q(timestamp=after_time, key__lt=after_key)
+                )
+            if limit:
+                rows = list(records[:limit + 1])
+            else:
+                rows = list(records)
+            next_key = None
+            if limit and len(rows) > limit:
+                rows = rows[:limit]
+                last = rows[-1]
+                next_key = f"{timestamp_key(last.timestamp)}_{last.key}"
+            return [to_dict(row) for row in rows], next_key
+        except Exception as e:
+            logger.error(f"Error getting {collection} for owner {owner_id}: {e}")
+            return None, None
+
+    def iter_records(self, collection, since=None, until=None, plaza=None, chunk_size=1000, archived=True):
+        """Stream records in timestamp order over the timestamp index, with a
+        server-side cursor where the database has them"""
+        records, to_dict = self._records(collection)
+        records = records.order_by('timestamp', 'key')
+        if since:
+            records = records.filter(timestamp__gte=parse_timestamp(since))
+        if until:
+            records = records.filter(timestamp__lte=parse_timestamp(until))
+        if plaza:
+            if collection != 'transactions':
+                return
+            records = records.filter(toll_plaza_id=plaza)
+        for record in records.iterator(chunk_size=chunk_size):
+            yield to_dict(record)
+
+    # Balance ledger: the toll and payment tables are append-only and exact, so
+    # they serve as the ledger directly and no snapshots are kept. Openings and
+    # adjustments are Payment rows with a LEDGER_PAYMENT_METHODS method
+
+    def update_vehicle_balance(self, vehicle_id, new_balance):
+        """Set a balance and record the difference as an adjustment, in one transaction"""
+        pk = _to_pk(vehicle_id)
+        if pk is None:
+            return False
+        try:
+            with transaction.atomic():
+                vehicle = Vehicle.objects.select_for_update().get(pk=pk)
+                new_balance = _money(new_balance)
+                delta = new_balance - vehicle.balance
+                vehicle.balance = new_balance
+                vehicle.save(update_fields=['balance'])
+                if delta:
+                    Payment.objects.create(
+                        vehicle_id=pk,
+                        owner_id=vehicle.owner_id,
+                        amount=delta,
+                        payment_method='adjustment',
+                        balance_after=new_balance,
+                    )
+            return True
+        except Exception as e:
+            logger.error(f"Error setting balance of {vehicle_id}: {e}")
+            return False
+
+    def append_ledger_entries(self, entries):
+        """Insert each entry as a Payment row with its kind as the method"""
+        try:
+            pks = [_to_pk(vehicle_id) for vehicle_id, _ in entries]
+            owners = dict(Vehicle.objects.filter(pk__in=[pk for pk in pks if pk is not None])
+                          .values_list('pk', 'owner_id'))
+            rows = []
+            for pk, (vehicle_id, entry) in zip(pks, entries):
+                if pk not in owners:
+                    logger.warning(f"Skipping ledger entry of unknown vehicle {vehicle_id}")
+                    continue
+                timestamp = parse_timestamp(entry.get('timestamp'))
+                rows.append(Payment(
+                    vehicle_id=pk,
+                    owner_id=owners[pk],
+                    amount=(Decimal(int(entry['cents'])) / 100).quantize(CENT),
+                    payment_method=entry.get('kind') or 'adjustment',
+                    **({'timestamp': timestamp} if timestamp is not None else {})
+                ))
+            Payment.objects.bulk_create(rows, batch_size=500)
+            return True
+        except Exception as e:
+            logger.error(f"Error appending {len(entries)} ledger entries: {e}")
+            return False
+
+    def get_ledger_balance(self, vehicle_id, snapshot=None):
+        # Summed whole by the database; `snapshot` is only a shortcut for backends that need one
+        pk = _to_pk(vehicle_id)
+        if pk is None:
+            return None
+        try:
+            paid = Payment.objects.filter(vehicle_id=pk).aggregate(total=Sum('amount'), entries=Count('id'))
+            charged = TollRecord.objects.filter(vehicle_id=pk).aggregate(total=Sum('toll_amount'), entries=Count('id'))
+            return {
+                'cents': to_cents(paid['total'] or 0) - to_cents(charged['total'] or 0),
+                'snapshot': None,
+                'tailEntries': paid['entries'] + charged['entries'],
+            }
+        except Exception as e:
+            logger.error(f"Error getting ledger balance of {vehicle_id}: {e}")
+            return None
+
+    def iter_ledger(self, chunk_size=500):
+        """Merge both tables, each read in (vehicle, key) order, into per-vehicle runs"""
+        def entries(model, amount_field, sign):
+            rows = model.objects.order_by('vehicle_id', 'key').values_list('vehicle_id', 'key', amount_field)
+            for vehicle_id, key, amount in rows.iterator(chunk_size=chunk_size * 20):
+                yield vehicle_id, key, sign * to_cents(amount)
+
+        merged = heapq.merge(entries(TollRecord, 'toll_amount', -1), entries(Payment, 'amount', 1))
+        for vehicle_id, rows in groupby(merged, key=lambda row: row[0]):
+            rows = list(rows)
+            yield str(vehicle_id), [key for _, key, _ in rows], [cents for _, _, cents in rows]
+
+    # Configuration
+
+    def get_pricing_rules(self):
+        try:
+            return {
+                str(rule.pk): _compact({
+                    'vehicleType': rule.vehicle_type,
+                    'basePrice': float(rule.base_price),
+                    'currency': rule.currency,
+                    'description': rule.description,
+                    'isActive': rule.is_active,
+                    'tollPlazaId': rule.toll_plaza_id or None,
+                    'timeBand': rule.time_band or None,
+                })
+                for rule in PricingRule.objects.order_by('pk')
+            }
+        except Exception as e:
+            logger.error(f"Error getting pricing rules: {e}")
+            return None
+
+    def get_toll_plazas(self):
+        # There is no plaza table; plazas are known by the ids that reference them
+        try:
+            plaza_ids = set(HardwareEndpoint.objects.exclude(toll_plaza_id='').values_list('toll_plaza_id', flat=True))
+            plaza_ids.update(PricingRule.objects.exclude(toll_plaza_id='').values_list('toll_plaza_id', flat=True))
+            return {plaza_id: {'id': plaza_id} for plaza_id in sorted(plaza_ids)}
+        except Exception as e:
+            logger.error(f"Error getting toll plazas: {e}")
+            return None
+
+    # Dashboard
+
+    def _counter_fields(self, counter):
+        fields = {field: getattr(counter, column) for field, column in STAT_FIELDS.items()}
+        return {field: value for field, value in fields.items() if value}
+
+    def get_stats(self, hours=24, days=30):
+        try:
+            stats = {}
+            for group in ('totals', 'byPlaza', 'byVehicleType'):
+                stats[group] = {
+                    counter.key: self._counter_fields(counter)
+                    for counter in StatCounter.objects.filter(group=group)
+                }
+            for group, limit in (('byHour', hours), ('byDay', days)):
+                latest = StatCounter.objects.filter(group=group).order_by('-key')[:limit]
+                stats[group] = {counter.key: self._counter_fields(counter) for counter in latest}
+            return stats
+        except Exception as e:
+            logger.error(f"Error getting stats: {e}")
+            return None
+
+    def get_vehicle_counts(self):
+        try:
+            by_status = dict(Vehicle.objects.values_list('status').annotate(total=Count('id')))
+            threshold = getattr(settings, 'LOW_BALANCE_THRESHOLD', 10)
+            return {
+                'total': sum(by_status.values()),
+                'byStatus': by_status,
+                'lowBalance': Vehicle.objects.filter(balance__lt=threshold).count(),
+            }
+        except Exception as e:
+            logger.error(f"Error counting vehicles: {e}")
+            return None
+
+    def rebuild_stats(self):
+        increments = {}
+        counted = 0
+        for collection in self.RECORD_MODELS:
+            records, to_dict = self._records(collection)
+            for record in records.iterator():
+                merge_increments(increments, stat_increments(collection, to_dict(record)))
+                counted += 1
+        with transaction.atomic():
+            StatCounter.objects.all().delete()
+            StatCounter.objects.bulk_create([
+                StatCounter(group=group, key=key, **{STAT_FIELDS[field]: amount for field, amount in fields.items()})
+                for (group, key), fields in increments.items()
+            ])
+        return counted
+
+    # Scanners
+
+    def get_hardware_endpoints(self):
+        try:
+            return {
+                endpoint.endpoint_id: _compact({
+                    'endpointId': endpoint.endpoint_id,
+                    'tollPlazaId': endpoint.toll_plaza_id or None,
+                    'status': endpoint.status,
+                    'isOnline': endpoint.is_online,
+                    'lastHeartbeat': _iso(endpoint.last_heartbeat),
+                })
+                for endpoint in HardwareEndpoint.objects.all()
+            }
+        except Exception as e:
+            logger.error(f"Error getting hardware endpoints: {e}")
+            return None
+
+    def update_hardware_endpoints(self, updates):
+        fields_map = {
+            'tollPlazaId': 'toll_plaza_id',
+            'status': 'status',
+            'isOnline': 'is_online',
+            'lastHeartbeat': 'last_heartbeat',
+        }
+        try:
+            with transaction.atomic():
+                existing = HardwareEndpoint.objects.select_for_update().in_bulk(list(updates), field_name='endpoint_id')
+                created = []
+                changed = []
+                for endpoint_id, fields in updates.items():
+                    endpoint = existing.get(endpoint_id)
+                    if endpoint is None:
+                        endpoint = HardwareEndpoint(endpoint_id=endpoint_id)
+                        created.append(endpoint)
+                    else:
+                        changed.append(endpoint)
+                    for field, value in fields.items():
+                        if field == 'lastHeartbeat':
+                            value = parse_timestamp(value)
+                        if field in fields_map:
+                            setattr(endpoint, fields_map[field], value)
+                HardwareEndpoint.objects.bulk_create(created)
+                if changed:
+                    HardwareEndpoint.objects.bulk_update(changed, list(fields_map.values()))
+            return True
+        except Exception as e:
+            logger.error(f"Error updating {len(updates)} hardware endpoints: {e}")
+            return False
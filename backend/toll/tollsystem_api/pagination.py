@@ -0,0 +1,76 @@
+import base64
+import json
+
+from django.conf import settings
+
+from .record_keys import parse_timestamp
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(key):
+    """Opaque cursor for the storage key a page ended on"""
+    if key is None:
+        return None
+    raw = json.dumps({'k': key}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        return json.loads(base64.urlsafe_b64decode(padded.encode()))['k']
+    except Exception:
+        raise ValueError('Invalid cursor')
+
+
+class PageParams:
+    """`limit`, `cursor`, `since` and `until` query parameters of a list request.
+
+    A request with neither `limit` nor `cursor` is not paged (limit None) and
+    gets the whole list, as clients written before pagination expect.
+    """
+
+    def __init__(self, limit, after=None, since=None, until=None):
+        self.limit = limit
+        self.after = after
+        self.since = since
+        self.until = until
+
+    @classmethod
+    def from_request(cls, request):
+        default_limit = getattr(settings, 'API_PAGE_SIZE', 100)
+        max_limit = getattr(settings, 'API_MAX_PAGE_SIZE', 1000)
+        cursor = request.GET.get('cursor')
+        limit = None
+        if 'limit' in request.GET or cursor:
+            try:
+                limit = int(request.GET.get('limit', default_limit))
+            except ValueError:
+                raise ValueError('limit must be an integer')
+            if limit <= 0:
+                raise ValueError('limit must be positive')
+            limit = min(limit, max_limit)
+
+        since = request.GET.get('since')
+        until = request.GET.get('until')
+        if since and parse_timestamp(since) is None:
+            raise ValueError('since must be an ISO-8601 timestamp')
+        if until and parse_timestamp(until) is None:
+            raise ValueError('until must be an ISO-8601 timestamp')
+
+        return cls(
+            limit=limit,
+            after=decode_cursor(cursor),
+            since=since,
+            until=until,
+        )
+
+
+def paginated_response(response, next_key):
+    """Attach the next-page cursor to a list response, if there is one"""
+    if next_key is not None:
+        response[NEXT_CURSOR_HEADER] = encode_cursor(next_key)
+    return response
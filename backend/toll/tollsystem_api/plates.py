@@ -0,0 +1,209 @@
+# Characters plate OCR commonly confuses, folded onto one representative so
+# reads differing only in these match without spending an edit
+CONFUSABLES = str.maketrans({
+    'O': '0', 'Q': '0', 'D': '0',
+    'I': '1', 'L': '1',
+    'Z': '2',
+    'S': '5',
+    'G': '6',
+    'B': '8',
+})
+
+EXACT_CONFIDENCE = 1.0
+FOLDED_CONFIDENCE = 0.95
+
+
+def normalize_plate(plate):
+    """Canonical form of a licence plate: upper case, letters and digits only"""
+    if not plate:
+        return None
+    return ''.join(ch for ch in str(plate).upper() if ch.isalnum()) or None
+
+
+def fold_plate(normalized):
+    """`normalized` with OCR-confusable characters folded together"""
+    return normalized.translate(CONFUSABLES)
+
+
+def edit_distance(a, b, limit=None):
+    """Optimal string alignment distance (edits plus adjacent transpositions).
+
+    Stops early and returns `limit + 1` once the distance must exceed `limit`.
+    """
+    if a == b:
+        return 0
+    if limit is not None and abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                value = min(value, before[j - 2] + 1)
+            current[j] = value
+        if limit is not None and min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def _deletions(key):
+    return {key[:i] + key[i + 1:] for i in range(len(key))}
+
+
+# Multimaps holding a single value inline and a tuple only on collision, so
+# the common one-plate-per-key case costs one dict entry
+
+def _values(table, key):
+    value = table.get(key)
+    if value is None:
+        return ()
+    return value if isinstance(value, tuple) else (value,)
+
+
+def _put(table, key, value):
+    current = table.get(key)
+    if current is None:
+        table[key] = value
+    elif isinstance(current, tuple):
+        if value not in current:
+            table[key] = current + (value,)
+    elif current != value:
+        table[key] = (current, value)
+
+
+def _remove(table, key, value):
+    current = table.get(key)
+    if current is None:
+        return
+    if isinstance(current, tuple):
+        remaining = tuple(item for item in current if item != value)
+        table[key] = remaining[0] if len(remaining) == 1 else remaining
+    elif current == value:
+        del table[key]
+
+
+class PlateIndex:
+    """Exact and OCR-tolerant lookup of vehicle ids by licence plate.
+
+    Plates are indexed by their normalized text, by their confusable-folded
+    key, and by every one-character deletion of the folded key. A read is
+    matched exactly first, then on the folded key, then against folded keys
+    sharing a deletion with it: every plate within one edit, plus two-edit
+    neighbours such as transpositions or an insertion and a deletion, each
+    confirmed with `edit_distance`. A lookup is a handful of dict hits
+    whatever the number of plates; the deletion table costs about one entry
+    per plate character, and is skipped when `max_distance` is 0.
+    """
+
+    def __init__(self, max_distance=2):
+        self.max_distance = max_distance
+        self._exact = {}
+        self._folded = {}
+        self._deletes = {}
+
+    def clear(self):
+        self._exact = {}
+        self._folded = {}
+        self._deletes = {}
+
+    def add(self, vehicle_id, plate):
+        normalized = normalize_plate(plate)
+        if not normalized:
+            return
+        self._exact[normalized] = vehicle_id
+        key = fold_plate(normalized)
+        if key not in self._folded and self.max_distance > 0:
+            deletes = self._deletes
+            for variant in _deletions(key):
+                if deletes.setdefault(variant, key) != key:
+                    _put(deletes, variant, key)
+        _put(self._folded, key, vehicle_id)
+
+    def remove(self, vehicle_id, plate):
+        normalized = normalize_plate(plate)
+        if not normalized:
+            return
+        if self._exact.get(normalized) == vehicle_id:
+            del self._exact[normalized]
+        key = fold_plate(normalized)
+        _remove(self._folded, key, vehicle_id)
+        if not _values(self._folded, key) and self.max_distance > 0:
+            for variant in _deletions(key):
+                _remove(self._deletes, variant, key)
+
+    def move(self, vehicle_id, old_plate, new_plate):
+        """Re-register a vehicle under a new plate. The new entries go in before
+        the old ones come out, so a concurrent lookup never misses it"""
+        old, new = normalize_plate(old_plate), normalize_plate(new_plate)
+        if old == new:
+            return
+        if old and new and fold_plate(old) == fold_plate(new):
+            # Same folded key: only the exact entry changes
+            self._exact[new] = vehicle_id
+            if self._exact.get(old) == vehicle_id:
+                del self._exact[old]
+            return
+        self.add(vehicle_id, new_plate)
+        self.remove(vehicle_id, old_plate)
+
+    def get(self, plate):
+        """Vehicle id registered under exactly this plate, or None"""
+        normalized = normalize_plate(plate)
+        return self._exact.get(normalized) if normalized else None
+
+    def match(self, plate, limit=5):
+        """Return up to `limit` `(vehicle_id, confidence)` pairs, best first.
+
+        Confidence is 1.0 for an exact match, 0.95 for a match once
+        confusable characters are folded, and 0.95 * (1 - distance / length)
+        for an edit-distance match; it is split evenly between vehicles that
+        tie for the best match.
+        """
+        normalized = normalize_plate(plate)
+        if not normalized:
+            return []
+        vehicle_id = self._exact.get(normalized)
+        if vehicle_id is not None:
+            return [(vehicle_id, EXACT_CONFIDENCE)]
+
+        key = fold_plate(normalized)
+        matches = [(vehicle_id, FOLDED_CONFIDENCE) for vehicle_id in _values(self._folded, key)]
+        if not matches and self.max_distance > 0:
+            matches = self._near(key)
+        if not matches:
+            return []
+
+        best = max(confidence for _, confidence in matches)
+        tied = sum(1 for _, confidence in matches if confidence == best)
+        if tied > 1:
+            matches = [
+                (vehicle_id, confidence / tied if confidence == best else confidence)
+                for vehicle_id, confidence in matches
+            ]
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        return [(vehicle_id, round(confidence, 3)) for vehicle_id, confidence in matches[:limit]]
+
+    def _near(self, key):
+        # Keys one insertion away have `key` as a deletion; keys one deletion
+        # away are a deletion of `key`; the rest share a deletion with it
+        candidates = set(_values(self._deletes, key))
+        for variant in _deletions(key):
+            if variant in self._folded:
+                candidates.add(variant)
+            candidates.update(_values(self._deletes, variant))
+        candidates.discard(key)
+
+        matches = []
+        for candidate in candidates:
+            distance = edit_distance(key, candidate, self.max_distance)
+            if distance > self.max_distance:
+                continue
+            confidence = FOLDED_CONFIDENCE * (1 - distance / max(len(key), len(candidate)))
+            matches.extend((vehicle_id, confidence) for vehicle_id in _values(self._folded, candidate))
+        return matches
+
+    def __len__(self):
+        return len(self._exact)
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+
+from .storage import storage, run_sync
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOLL_AMOUNT = 5.00
+DEFAULT_VEHICLE_TYPE = 'Small Car'
+
+
+class PricingUnavailable(Exception):
+    """Raised when pricing rules have never been read, so no toll can be priced"""
+
+
+class PricingEngine:
+    """Compiled, cached view of the `pricingRules` tree.
+
+    Active rules are compiled into a dict keyed by
+    `(vehicleType, tollPlazaId, timeBand)` where the plaza and band parts are
+    None for rules that apply everywhere / all day. A price lookup is at most
+    four dict hits; the rules are only re-read when the TTL expires or
+    `invalidate()` is called.
+
+    If a read fails the last good table is served until the next TTL. If
+    there is none yet, lookups raise PricingUnavailable rather than charge
+    the default amount, and the read is retried after `retry_interval`.
+    """
+
+    def __init__(self, loader, ttl=300, time_bands=None, retry_interval=5):
+        self._loader = loader
+        self._ttl = ttl
+        self.retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._table = None
+        self._digest = None
+        self._expires_at = 0
+        self.version = 0
+        self._hour_bands = self._compile_bands(time_bands or {})
+
+    @staticmethod
+    def _compile_bands(time_bands):
+        """Map each hour of the day to its band name (None if unbanded)"""
+        hours = [None] * 24
+        for band, ranges in time_bands.items():
+            for start, end in ranges:
+                hour = start % 24
+                while hour != end % 24:
+                    hours[hour] = band
+                    hour = (hour + 1) % 24
+        return hours
+
+    @staticmethod
+    def compile_rules(rules):
+        table = {}
+        for rule_id, rule in (rules or {}).items():
+            if not isinstance(rule, dict) or not rule.get('isActive'):
+                continue
+            vehicle_type = rule.get('vehicleType')
+            if not vehicle_type:
+                continue
+            try:
+                price = float(rule.get('basePrice', DEFAULT_TOLL_AMOUNT))
+            except (TypeError, ValueError):
+                logger.warning(f"Skipping pricing rule {rule_id} with invalid basePrice")
+                continue
+            key = (vehicle_type, rule.get('tollPlazaId') or None, rule.get('timeBand') or None)
+            # First active rule wins, as before
+            table.setdefault(key, price)
+        return table
+
+    def _refresh(self):
+        with self._lock:
+            if self._table is not None and time.monotonic() < self._expires_at:
+                return self._table
+            if self._table is None and time.monotonic() < self._expires_at:
+                raise PricingUnavailable("Pricing rules unavailable")
+            rules = self._loader()
+            if rules is None and self._table is None:
+                # Not cached: the next lookup after the retry interval reads again
+                self._expires_at = time.monotonic() + min(self.retry_interval, self._ttl)
+                logger.error("Pricing rules unavailable and none cached, failing scans")
+                raise PricingUnavailable("Pricing rules unavailable")
+            if rules is None:
+                # Keep serving the last good table rather than failing every scan
+                logger.warning("Pricing rules unavailable, serving cached table")
+            else:
+                digest = hashlib.sha1(json.dumps(rules or {}, sort_keys=True, default=str).encode()).hexdigest()
+                if digest != self._digest:
+                    self._table = self.compile_rules(rules)
+                    self._digest = digest
+                    self.version += 1
+                    logger.info(f"Pricing rules compiled: version {self.version}, {len(self._table)} entries")
+            self._expires_at = time.monotonic() + self._ttl
+            return self._table
+
+    def table(self):
+        table = self._table
+        if table is None or time.monotonic() >= self._expires_at:
+            table = self._refresh()
+        return table
+
+    async def atable(self):
+        """table() for async callers: a refresh (which reads storage) runs off the event loop"""
+        table = self._table
+        if table is None or time.monotonic() >= self._expires_at:
+            table = await run_sync(self._refresh)
+        return table
+
+    def get_price(self, vehicle_type, plaza_id=None, when=None):
+        """Toll amount for a vehicle type at a plaza and time"""
+        table = self.table()
+        band = self._hour_bands[(when or timezone.localtime()).hour]
+        for key in (
+            (vehicle_type, plaza_id, band),
+            (vehicle_type, plaza_id, None),
+            (vehicle_type, None, band),
+            (vehicle_type, None, None),
+        ):
+            price = table.get(key)
+            if price is not None:
+                return price
+        return DEFAULT_TOLL_AMOUNT
+
+    def invalidate(self):
+        """Force the next lookup to re-read pricing rules"""
+        self._expires_at = 0
+
+    def apply_change(self, path, data, event_type='put'):
+        """Hook for `pricingRules` change events"""
+        self.invalidate()
+
+
+pricing_engine = PricingEngine(
+    lambda: storage.get_pricing_rules(),
+    ttl=getattr(settings, 'PRICING_CACHE_TTL', 300),
+    time_bands=getattr(settings, 'TOLL_TIME_BANDS', None),
+    retry_interval=getattr(settings, 'PRICING_RETRY_INTERVAL', 5),
+)
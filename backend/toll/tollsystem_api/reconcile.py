@@ -0,0 +1,161 @@
+import time
+from bisect import bisect_right
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from .ledger import ledger_snapshot
+from .record_keys import push_id_prefix
+from .stats import to_cents
+
+
+class Reconciliation:
+    """Outcome of recomputing every balance from the ledger"""
+
+    def __init__(self):
+        self.vehicles = 0
+        self.entries = 0
+        self.mismatches = []
+        self.snapshots = {}
+        self.seconds = 0.0
+
+    def summary(self):
+        return {
+            'vehicles': self.vehicles,
+            'entries': self.entries,
+            'mismatches': len(self.mismatches),
+            'snapshots': len(self.snapshots),
+            'seconds': round(self.seconds, 3),
+        }
+
+
+def _sums(cents, lengths, positions):
+    """Per-vehicle sums of the first `positions` entries of consecutive runs of `lengths`.
+
+    One running sum over the flattened cents answers every prefix with two
+    lookups, so a chunk costs a few array passes whatever its vehicles hold.
+    """
+    running = np.zeros(len(cents) + 1, dtype=np.int64)
+    np.cumsum(cents, out=running[1:])
+    starts = np.zeros(len(lengths), dtype=np.int64)
+    np.cumsum(lengths[:-1], out=starts[1:])
+    return [running[starts + position] - running[starts] for position in positions]
+
+
+def _recheck(backend, vehicle_id, cents, through):
+    """Fresh (stored, ledger) balance of one vehicle in cents, None where unreadable;
+    the ledger is summed on from the `cents` this pass counted `through` its last key"""
+    vehicle = backend.get_vehicle(vehicle_id)
+    ledger = backend.get_ledger_balance(vehicle_id, snapshot={'cents': cents, 'through': through})
+    return (
+        to_cents(vehicle.get('balance') or 0) if vehicle else None,
+        ledger['cents'] if ledger else None,
+    )
+
+
+def reconcile_ledger(backend, chunk_size=500, settle=300, take_snapshots=False, confirm=True):
+    """Recompute every vehicle's balance from its ledger and compare.
+
+    Ledger entries are read a chunk of vehicles at a time and summed with
+    NumPy (see `_sums`). Reports vehicles whose stored balance differs from
+    their ledger ('balance'), and whose snapshot differs from the entries
+    it claims to cover ('snapshot', i.e. an entry landed behind it). With
+    `take_snapshots`, also builds new snapshots through each vehicle's last
+    entry older than `settle` seconds: records still in a write-behind
+    queue keep the key they were given when queued.
+
+    Balances are read before the ledger, so a vehicle charged meanwhile
+    differs; with `confirm`, balance mismatches are read again one by one
+    and only those that persist are reported.
+    """
+    started = time.perf_counter()
+    result = Reconciliation()
+    vehicles = backend.get_vehicles()
+    snapshots = backend.get_ledger_snapshots()
+    if vehicles is None or snapshots is None:
+        return None
+    now = datetime.utcnow()
+    cutoff = push_id_prefix(now - timedelta(seconds=settle))
+    taken_at = now.isoformat() + 'Z'
+
+    ids = []
+    last_keys = {}
+    totals = []
+    chunk = []
+
+    def flush():
+        lengths, flat = [], []
+        snapshot_cents, covered, settled = [], [], []
+        for vehicle_id, keys, cents in chunk:
+            lengths.append(len(cents))
+            flat.extend(cents)
+            snapshot = snapshots.get(vehicle_id)
+            if snapshot and snapshot.get('through'):
+                snapshot_cents.append(int(snapshot.get('cents', 0)))
+                covered.append(bisect_right(keys, snapshot['through']))
+            else:
+                snapshot_cents.append(None)
+                covered.append(0)
+            settled.append(bisect_right(keys, cutoff) if take_snapshots else 0)
+        lengths = np.array(lengths, dtype=np.int64)
+        covered = np.array(covered, dtype=np.int64)
+        settled = np.array(settled, dtype=np.int64)
+        total, covered_sum, settled_sum = _sums(np.array(flat, dtype=np.int64), lengths, (lengths, covered, settled))
+
+        has_snapshot = np.fromiter((cents is not None for cents in snapshot_cents), dtype=bool, count=len(chunk))
+        claimed = np.array([cents or 0 for cents in snapshot_cents], dtype=np.int64)
+        for row in np.flatnonzero(has_snapshot & (claimed != covered_sum)):
+            vehicle_id = chunk[row][0]
+            result.mismatches.append({
+                'vehicleId': vehicle_id,
+                'problem': 'snapshot',
+                'snapshotCents': int(claimed[row]),
+                'ledgerCents': int(covered_sum[row]),
+                'through': snapshots[vehicle_id]['through'],
+            })
+        for row in np.flatnonzero(settled > covered):
+            vehicle_id, keys, _ = chunk[row]
+            position = int(settled[row])
+            result.snapshots[vehicle_id] = ledger_snapshot(settled_sum[row], keys[position - 1], position, taken_at)
+
+        ids.extend(vehicle_id for vehicle_id, _, _ in chunk)
+        last_keys.update((vehicle_id, keys[-1] if keys else None) for vehicle_id, keys, _ in chunk)
+        totals.append(total)
+        result.entries += len(flat)
+        chunk.clear()
+
+    for run in backend.iter_ledger(chunk_size):
+        chunk.append(run)
+        if len(chunk) >= chunk_size:
+            flush()
+    if chunk:
+        flush()
+
+    # Vehicles without a ledger should hold nothing
+    ids.extend(vehicle_id for vehicle_id in vehicles if vehicle_id not in last_keys)
+    ledger = np.concatenate(totals + [np.zeros(len(ids) - sum(len(t) for t in totals), dtype=np.int64)])
+    # Balances are kept rounded to the cent, so scaling and rounding is exact
+    stored = np.rint(np.fromiter(
+        (float((vehicles.get(vehicle_id) or {}).get('balance') or 0) for vehicle_id in ids),
+        dtype=np.float64, count=len(ids)
+    ) * 100).astype(np.int64)
+    for row in np.flatnonzero(stored != ledger):
+        vehicle_id = ids[row]
+        balance_cents, ledger_cents = int(stored[row]), int(ledger[row])
+        # A vehicle with no ledger at all was not just charged: no need to look again
+        if confirm and last_keys.get(vehicle_id):
+            balance_cents, ledger_cents = _recheck(backend, vehicle_id, ledger_cents, last_keys[vehicle_id])
+            if balance_cents == ledger_cents:
+                continue
+        result.mismatches.append({
+            'vehicleId': vehicle_id,
+            'problem': 'balance',
+            'balanceCents': balance_cents,
+            'ledgerCents': ledger_cents,
+            'differenceCents': None if None in (balance_cents, ledger_cents) else balance_cents - ledger_cents,
+            'hasLedger': vehicle_id in last_keys,
+        })
+
+    result.vehicles = len(ids)
+    result.seconds = time.perf_counter() - started
+    return result
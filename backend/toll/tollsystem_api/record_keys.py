@@ -0,0 +1,119 @@
+import hashlib
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+PUSH_CHARS = '-0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ_abcdefghijklmnopqrstuvwxyz'
+
+_push_lock = threading.Lock()
+_last_push_time = 0
+_last_rand_chars = [0] * 12
+
+
+def generate_push_id():
+    """Generate a chronologically sortable Firebase push key locally.
+
+    Same algorithm as the Firebase client SDKs, so records can be written with
+    a multi-path update instead of a separate `push()` round trip.
+    """
+    global _last_push_time
+    with _push_lock:
+        now = int(time.time() * 1000)
+        duplicate_time = now == _last_push_time
+        _last_push_time = now
+
+        time_chars = []
+        for _ in range(8):
+            time_chars.append(PUSH_CHARS[now % 64])
+            now //= 64
+        push_id = ''.join(reversed(time_chars))
+
+        if not duplicate_time:
+            for i in range(12):
+                _last_rand_chars[i] = random.randrange(64)
+        else:
+            # Same millisecond: increment the random part so keys stay ordered
+            i = 11
+            while i >= 0 and _last_rand_chars[i] == 63:
+                _last_rand_chars[i] = 0
+                i -= 1
+            if i >= 0:
+                _last_rand_chars[i] += 1
+
+        return push_id + ''.join(PUSH_CHARS[c] for c in _last_rand_chars)
+
+
+def push_id_prefix(value):
+    """The 8-character time part of push keys generated at `value` (a datetime or
+    ISO-8601 string); push keys from that millisecond on sort at or after it"""
+    parsed = parse_timestamp(value)
+    now = max(int(parsed.timestamp() * 1000), 0) if parsed else 0
+    time_chars = []
+    for _ in range(8):
+        time_chars.append(PUSH_CHARS[now % 64])
+        now //= 64
+    return ''.join(reversed(time_chars))
+
+
+def parse_timestamp(value):
+    """Parse an ISO-8601 timestamp as stored in Firebase into an aware UTC datetime"""
+    if not value:
+        return None
+    if isinstance(value, datetime):
+        parsed = value
+    else:
+        try:
+            parsed = datetime.fromisoformat(str(value).replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    if parsed.tzinfo is None:
+        return parsed.replace(tzinfo=timezone.utc)
+    return parsed.astimezone(timezone.utc)
+
+
+def timestamp_key(value):
+    """Fixed-width, lexically sortable key for a timestamp (valid as a Firebase key)"""
+    parsed = parse_timestamp(value)
+    if parsed is None:
+        return '0' * 20
+    return parsed.strftime('%Y%m%d%H%M%S%f')
+
+
+def parse_timestamp_key(key):
+    """Inverse of `timestamp_key`: the aware UTC datetime a key was made from"""
+    try:
+        return datetime.strptime(key[:20], '%Y%m%d%H%M%S%f').replace(tzinfo=timezone.utc)
+    except (TypeError, ValueError):
+        return None
+
+
+def owner_index_key(timestamp, record_id):
+    """Key for a record in an owner's secondary index, ordered by time then id"""
+    return f"{timestamp_key(timestamp)}_{record_id}"
+
+
+def split_owner_index_key(key):
+    """Return (timestamp, record_id) from an owner index key"""
+    stamp, _, record_id = (key or '').partition('_')
+    return parse_timestamp_key(stamp), record_id
+
+
+_UNSAFE_KEY_CHARS = re.compile(r'[.$#\[\]/\x00-\x1f\x7f]')
+
+
+def safe_key(value):
+    """A Firebase-safe path segment for an arbitrary client-supplied id"""
+    value = str(value)
+    if not value or len(value) > 200 or _UNSAFE_KEY_CHARS.search(value):
+        return hashlib.sha1(value.encode()).hexdigest()
+    return value
+
+
+def scan_receipt_key(scan_id):
+    """Key for a reader's scan id under its receipts node.
+
+    Prefixed so numeric scan ids are ordered as strings rather than integers.
+    """
+    return f"s_{safe_key(scan_id)}"
@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+
+from cachetools import TLRUCache
+from django.conf import settings
+from rest_framework import status
+
+logger = logging.getLogger(__name__)
+
+TAG = 'tag'
+KEY = 'key'
+
+
+class _Claim:
+    """One scan's slot in the window.
+
+    The first scan for a key owns the claim and must call `complete` (or
+    `fail`) with its result; duplicates get the same claim with
+    `duplicate` set and read the owner's result, waiting for it if the
+    owner is still charging.
+    """
+
+    __slots__ = ('window', 'keys', 'future', 'duplicate')
+
+    def __init__(self, window, keys, future, duplicate):
+        self.window = window
+        self.keys = keys
+        self.future = future
+        self.duplicate = duplicate
+
+    def complete(self, status_code, payload):
+        self.window._settle(self, status_code)
+        self.future.set_result((status_code, payload))
+
+    def fail(self, error):
+        self.window._settle(self, None)
+        self.future.set_exception(error)
+
+    def result(self):
+        try:
+            return _duplicate(*self.future.result(timeout=self.window.wait))
+        except FutureTimeout:
+            return _in_progress()
+
+    async def aresult(self):
+        try:
+            result = await asyncio.wait_for(asyncio.wrap_future(self.future), self.window.wait)
+        except asyncio.TimeoutError:
+            return _in_progress()
+        return _duplicate(*result)
+
+
+class _Unclaimed:
+    """Claim for scans that are not deduplicated (window disabled)"""
+
+    duplicate = False
+
+    def complete(self, status_code, payload):
+        pass
+
+    def fail(self, error):
+        pass
+
+
+UNCLAIMED = _Unclaimed()
+
+
+def _duplicate(status_code, payload):
+    return status_code, dict(payload, duplicate=True)
+
+
+def _in_progress():
+    return status.HTTP_409_CONFLICT, {
+        'error': 'Duplicate scan is still being processed',
+        'success': False,
+        'duplicate': True
+    }
+
+
+class ScanDeduplicator:
+    """Bounded, expiring window of recent scans, to absorb reader double-reads and retries.
+
+    A scan is keyed by its tag at a plaza/reader, remembered for `window`
+    seconds, and by the client's idempotency key (`Idempotency-Key` header or
+    `scan_id`) from that reader, remembered for `key_ttl` seconds. A scan
+    matching either key while it is remembered is a duplicate and gets the
+    first scan's result without touching storage. Results of 5xx or raised
+    errors are forgotten so a retry is charged normally. At most `maxsize`
+    keys are kept, least recently used first out. Each process keeps its own
+    window.
+    """
+
+    def __init__(self, window=10, key_ttl=600, maxsize=100000, wait=10, timer=time.monotonic):
+        self.window = window
+        self.key_ttl = key_ttl
+        self.wait = wait
+        self._entries = TLRUCache(maxsize, self._expiry, timer=timer)
+        self._lock = threading.Lock()
+
+    def _expiry(self, key, claim, now):
+        return now + (self.window if key[0] == TAG else self.key_ttl)
+
+    def _keys(self, rfid, data, idempotency_key):
+        reader_id = str(data.get('scanner_id') or 'Unknown')
+        if idempotency_key in (None, ''):
+            idempotency_key = data.get('scan_id')
+        keys = []
+        if idempotency_key not in (None, '') and self.key_ttl > 0:
+            keys.append((KEY, reader_id, str(idempotency_key)))
+        if self.window > 0:
+            keys.append((TAG, str(rfid), str(data.get('tollPlazaId') or 'unknown'), reader_id))
+        return keys
+
+    def claim(self, rfid, data, idempotency_key=None):
+        """Claim the scan of `rfid` described by `data`; see `_Claim`"""
+        keys = self._keys(rfid, data, idempotency_key)
+        if not keys:
+            return UNCLAIMED
+        with self._lock:
+            for key in keys:
+                claim = self._entries.get(key)
+                if claim is not None:
+                    # Remember this scan's other keys too, so its own retries match
+                    for other in keys:
+                        if other not in self._entries:
+                            claim.keys.append(other)
+                            self._entries[other] = claim
+                    logger.info(f"Duplicate scan of {rfid} absorbed ({key[0]} match)")
+                    return _Claim(self, claim.keys, claim.future, True)
+            claim = _Claim(self, keys, Future(), False)
+            for key in keys:
+                self._entries[key] = claim
+        return claim
+
+    def _settle(self, claim, status_code):
+        with self._lock:
+            for key in claim.keys:
+                if self._entries.get(key) is not claim:
+                    continue
+                if status_code is None or status_code >= 500:
+                    del self._entries[key]
+                else:
+                    # Re-insert so the window runs from when the result was known
+                    self._entries[key] = claim
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+scan_deduplicator = ScanDeduplicator(
+    window=getattr(settings, 'SCAN_DEDUP_WINDOW', 10),
+    key_ttl=getattr(settings, 'SCAN_IDEMPOTENCY_TTL', 600),
+    maxsize=getattr(settings, 'SCAN_DEDUP_MAX_ENTRIES', 100000),
+    wait=getattr(settings, 'SCAN_DEDUP_WAIT', 10),
+)
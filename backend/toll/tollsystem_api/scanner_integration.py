@@ -1,7 +1,9 @@
-import requests
 import json
 from django.conf import settings
 
+from .http_pool import get_http_client
+from .pricing import pricing_engine, DEFAULT_VEHICLE_TYPE
+
 class RFIDScanner:
     """Handle RFID scanner communication"""
     
@@ -16,15 +18,17 @@ class RFIDScanner:
             # Extract RFID tag from scanner data
             rfid_tag = rfid_data.get('rfid_tag')
             checkpoint = rfid_data.get('checkpoint', 'Unknown')
+            toll_plaza_id = rfid_data.get('tollPlazaId')
             timestamp = rfid_data.get('timestamp')
             
-            # Send to Django API for processing
-            response = requests.post(
+            # Send to Django API for processing over the shared keep-alive client
+            response = get_http_client().post(
                 f"{settings.DJANGO_API_URL}/toll/rfid-scan/",
                 json={
                     'rfid': rfid_tag,
                     'checkpoint': checkpoint,
-                    'toll_amount': self.get_toll_amount(checkpoint),
+                    'tollPlazaId': toll_plaza_id,
+                    'toll_amount': self.get_toll_amount(checkpoint, toll_plaza_id=toll_plaza_id),
                     'timestamp': timestamp
                 },
                 headers={'Content-Type': 'application/json'}
@@ -36,12 +40,6 @@ class RFIDScanner:
             print(f"Scanner integration error: {e}")
             return {'error': str(e)}
     
-    def get_toll_amount(self, checkpoint):
-        """Get toll amount based on checkpoint"""
-        toll_rates = {
-            'Toll Plaza A': 5.00,
-            'Toll Plaza B': 7.50,
-            'Toll Plaza C': 6.00,
-            'Toll Plaza D': 4.50,
-        }
-        return toll_rates.get(checkpoint, 5.00)
\ No newline at end of file
+    def get_toll_amount(self, checkpoint, vehicle_type=DEFAULT_VEHICLE_TYPE, toll_plaza_id=None):
+        """Get toll amount from the shared pricing engine"""
+        return pricing_engine.get_price(vehicle_type, toll_plaza_id or checkpoint)
@@ -0,0 +1,212 @@
+import logging
+import threading
+import time
+
+from cachetools import TLRUCache
+
+logger = logging.getLogger(__name__)
+
+
+def _copy(tree):
+    """Copy a snapshot two levels deep so callers can modify records freely"""
+    if not isinstance(tree, dict):
+        return tree
+    return {key: dict(value) if isinstance(value, dict) else value for key, value in tree.items()}
+
+
+class SnapshotCache:
+    """Read-through cache of whole subtrees (`owners`, `vehicles`, ...).
+
+    `get(name, loader)` returns the cached snapshot while it is younger than
+    the TTL for `name`; otherwise one caller runs `loader()` while concurrent
+    callers for the same name wait for its result (single flight). Loader
+    results of None are not cached. Mutations made through the service
+    either patch the cached snapshot (`update_entry`, `set_entry`) or drop it
+    (`invalidate`); a load that overlaps an invalidation is not cached.
+
+    Subtrees fed by a change stream (`apply_change`) are held outside the
+    TTL cache and served without expiring until `unpin` is called.
+    """
+
+    def __init__(self, ttls=None, default_ttl=30, maxsize=64, timer=time.monotonic):
+        self._ttls = dict(ttls or {})
+        self._default_ttl = default_ttl
+        self._timer = timer
+        self._cache = TLRUCache(maxsize, self._expiry, timer=timer)
+        self._lock = threading.Lock()
+        self._load_locks = {}
+        self._generations = {}
+        self._loaded_at = {}
+        self._stats = {}
+        self._streamed = {}
+
+    def _expiry(self, name, value, now):
+        return now + self._ttls.get(name, self._default_ttl)
+
+    def _count(self, name, event):
+        counters = self._stats.setdefault(name, {'hits': 0, 'misses': 0, 'loads': 0, 'errors': 0})
+        counters[event] += 1
+
+    def _lookup(self, name):
+        if name in self._streamed:
+            return True, self._streamed[name]
+        try:
+            return True, self._cache[name]
+        except KeyError:
+            return False, None
+
+    def get(self, name, loader):
+        with self._lock:
+            found, value = self._lookup(name)
+            if found:
+                self._count(name, 'hits')
+                return _copy(value)
+            self._count(name, 'misses')
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        with load_lock:
+            # Another caller may have loaded it while we waited
+            with self._lock:
+                found, value = self._lookup(name)
+                if found:
+                    return _copy(value)
+                generation = self._generations.get(name, 0)
+
+            try:
+                value = loader()
+            except Exception as e:
+                logger.error(f"Error loading {name} snapshot: {e}")
+                value = None
+            with self._lock:
+                if value is None:
+                    self._count(name, 'errors')
+                    return None
+                self._count(name, 'loads')
+                if self._generations.get(name, 0) == generation:
+                    self._cache[name] = value
+                    self._loaded_at[name] = self._timer()
+            return _copy(value)
+
+    def peek(self, name):
+        """The cached snapshot if there is a fresh one, without loading"""
+        with self._lock:
+            found, value = self._lookup(name)
+            return value if found else None
+
+    def invalidate(self, name=None):
+        """Drop one snapshot (or all of them) so the next read reloads it"""
+        with self._lock:
+            names = [name] if name is not None else list(self._cache.keys())
+            for key in names:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._cache.pop(key, None)
+
+    def apply_change(self, name, path, data, event_type='put'):
+        """Apply a change-stream event relative to subtree `name`.
+
+        A `put` at the root replaces the subtree and pins it; later events
+        patch the pinned copy. Events for a subtree that is not pinned drop
+        any TTL-cached copy instead.
+        """
+        parts = [part for part in (path or '/').split('/') if part]
+        with self._lock:
+            self._generations[name] = self._generations.get(name, 0) + 1
+            if not parts and event_type == 'put':
+                self._cache.pop(name, None)
+                self._streamed[name] = data if isinstance(data, dict) else {}
+                self._loaded_at[name] = self._timer()
+                self._count(name, 'loads')
+                return
+            tree = self._streamed.get(name)
+            if tree is None:
+                self._cache.pop(name, None)
+                return
+            if event_type == 'patch' and isinstance(data, dict):
+                for key, value in data.items():
+                    self._set_path(tree, parts + [part for part in key.split('/') if part], value)
+            else:
+                self._set_path(tree, parts, data)
+
+    @staticmethod
+    def _set_path(tree, parts, value):
+        if not parts:
+            tree.clear()
+            if isinstance(value, dict):
+                tree.update(value)
+            return
+        node = tree
+        for part in parts[:-1]:
+            child = node.get(part)
+            if not isinstance(child, dict):
+                if value is None:
+                    return
+                child = node[part] = {}
+            else:
+                # Copy on write: snapshots handed out earlier share these dicts
+                child = node[part] = dict(child)
+            node = child
+        if value is None:
+            node.pop(parts[-1], None)
+        else:
+            node[parts[-1]] = value
+
+    def pinned(self, name):
+        """Whether a subtree is currently served from its change stream"""
+        with self._lock:
+            return name in self._streamed
+
+    def unpin(self, name=None):
+        """Stop serving streamed subtrees (e.g. when the stream is closed)"""
+        with self._lock:
+            names = [name] if name is not None else list(self._streamed)
+            for key in names:
+                self._generations[key] = self._generations.get(key, 0) + 1
+                self._streamed.pop(key, None)
+
+    def update_entry(self, name, key, fields):
+        """Merge `fields` into child `key` of a cached snapshot; None values delete fields"""
+        with self._lock:
+            found, tree = self._lookup(name)
+            if not found:
+                return
+            self._generations[name] = self._generations.get(name, 0) + 1
+            current = tree.get(key)
+            if not isinstance(current, dict):
+                current = {}
+            merged = dict(current)
+            for field, value in fields.items():
+                if value is None:
+                    merged.pop(field, None)
+                else:
+                    merged[field] = value
+            tree[key] = merged
+
+    def set_entry(self, name, key, value):
+        """Replace child `key` of a cached snapshot (None removes it)"""
+        with self._lock:
+            found, tree = self._lookup(name)
+            if not found:
+                return
+            self._generations[name] = self._generations.get(name, 0) + 1
+            if value is None:
+                tree.pop(key, None)
+            else:
+                tree[key] = value
+
+    def stats(self):
+        """Hit/miss/load counters and snapshot ages per subtree"""
+        now = self._timer()
+        with self._lock:
+            result = {}
+            for name, counters in self._stats.items():
+                lookups = counters['hits'] + counters['misses']
+                found, _ = self._lookup(name)
+                result[name] = dict(
+                    counters,
+                    hit_ratio=round(counters['hits'] / lookups, 4) if lookups else None,
+                    cached=found,
+                    age=round(now - self._loaded_at[name], 1) if found and name in self._loaded_at else None,
+                    ttl=None if name in self._streamed else self._ttls.get(name, self._default_ttl),
+                    streamed=name in self._streamed,
+                )
+            return result
@@ -0,0 +1,45 @@
+import logging
+import time
+
+from django.conf import settings
+
+from .metrics import record_startup
+from .pricing import pricing_engine
+from .storage import get_storage
+
+logger = logging.getLogger(__name__)
+
+
+def warm_up():
+    """Initialize storage and preload the vehicle index, pricing table and toll plazas.
+
+    Called by the server entry points (wsgi.py, asgi.py, websocket_scanner)
+    when FIREBASE_WARMUP is set, so the first scans a worker serves do not
+    pay for connecting and downloading. Step timings go to the
+    toll_startup_seconds metric and the readiness endpoint. Failures are
+    logged: the caches then fill on first use, as without warm-up.
+    """
+    if not getattr(settings, 'FIREBASE_WARMUP', True):
+        return False
+    started = time.perf_counter()
+    try:
+        backend = get_storage()
+
+        step = time.perf_counter()
+        loaded = backend.warm_up(getattr(settings, 'FIREBASE_WARMUP_TIMEOUT', 30))
+        record_startup('warmup_storage', time.perf_counter() - step)
+
+        step = time.perf_counter()
+        pricing_engine.table()
+        record_startup('warmup_pricing', time.perf_counter() - step)
+    except Exception as e:
+        logger.error(f"Warm-up failed: {e}")
+        return False
+
+    elapsed = time.perf_counter() - started
+    record_startup('warmup', elapsed)
+    if loaded:
+        logger.info(f"Warm-up finished in {elapsed:.2f}s")
+    else:
+        logger.warning(f"Warm-up incomplete after {elapsed:.2f}s; caches will load on first use")
+    return loaded
@@ -0,0 +1,98 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+from .record_keys import safe_key, timestamp_key
+
+# Aggregates are counters grouped as <group>/<key>/<field>: amounts are kept in
+# integer cents so repeated increments do not drift
+STATS_GROUPS = ('totals', 'byPlaza', 'byVehicleType', 'byHour', 'byDay')
+
+
+def to_cents(amount):
+    try:
+        return int((Decimal(str(amount)) * 100).quantize(Decimal('1'), rounding=ROUND_HALF_UP))
+    except Exception:
+        return 0
+
+
+def stat_increments(collection, data):
+    """Counter increments a committed record contributes.
+
+    Returns {(group, key): {field: amount}}. A toll counts toward its plaza,
+    vehicle type, hour and day (UTC); a recharge toward the totals and its day.
+    """
+    if not isinstance(data, dict):
+        return {}
+    cents = to_cents(data.get('amount', 0))
+    stamp = timestamp_key(data.get('timestamp'))
+    hour, day = stamp[:10], stamp[:8]
+    if collection == 'transactions':
+        toll = {'count': 1, 'revenueCents': cents}
+        return {
+            ('totals', 'tolls'): dict(toll),
+            ('byPlaza', safe_key(data.get('tollPlazaId') or 'unknown')): dict(toll),
+            ('byVehicleType', safe_key(data.get('vehicleType') or 'unknown')): dict(toll),
+            ('byHour', hour): dict(toll),
+            ('byDay', day): dict(toll),
+        }
+    if collection == 'payments':
+        recharge = {'recharges': 1, 'rechargeAmountCents': cents}
+        return {
+            ('totals', 'recharges'): dict(recharge),
+            ('byDay', day): dict(recharge),
+        }
+    return {}
+
+
+def merge_increments(total, increments):
+    """Add one record's increments into a running {(group, key): {field: amount}}"""
+    for counter, fields in increments.items():
+        current = total.setdefault(counter, {})
+        for field, amount in fields.items():
+            current[field] = current.get(field, 0) + amount
+    return total
+
+
+def _amounts(fields):
+    """Counter fields as served: cents become currency amounts"""
+    result = {}
+    for field, value in (fields or {}).items():
+        if field.endswith('Cents'):
+            result[field[:-len('Cents')]] = round(value / 100, 2)
+        else:
+            result[field] = value
+    return result
+
+
+def format_stats(aggregates, vehicle_counts=None):
+    """Shape stored aggregates for the dashboard endpoint"""
+    aggregates = aggregates or {}
+    totals = aggregates.get('totals') or {}
+    tolls = _amounts(totals.get('tolls'))
+    recharges = _amounts(totals.get('recharges'))
+    stats = {
+        'totals': {
+            'tolls': tolls.get('count', 0),
+            'revenue': tolls.get('revenue', 0),
+            'recharges': recharges.get('recharges', 0),
+            'rechargeAmount': recharges.get('rechargeAmount', 0),
+        },
+        'byPlaza': {key: _amounts(fields) for key, fields in (aggregates.get('byPlaza') or {}).items()},
+        'byVehicleType': {key: _amounts(fields) for key, fields in (aggregates.get('byVehicleType') or {}).items()},
+        'byHour': [
+            dict(_amounts(fields), hour=f"{key[:4]}-{key[4:6]}-{key[6:8]}T{key[8:10]}:00Z")
+            for key, fields in sorted((aggregates.get('byHour') or {}).items())
+        ],
+        'byDay': [
+            dict(_amounts(fields), day=f"{key[:4]}-{key[4:6]}-{key[6:8]}")
+            for key, fields in sorted((aggregates.get('byDay') or {}).items())
+        ],
+    }
+    if vehicle_counts is not None:
+        by_status = vehicle_counts.get('byStatus', {})
+        stats['vehicles'] = {
+            'total': vehicle_counts.get('total', 0),
+            'active': by_status.get('active', 0),
+            'suspended': by_status.get('suspended', 0),
+            'lowBalance': vehicle_counts.get('lowBalance', 0),
+        }
+    return stats
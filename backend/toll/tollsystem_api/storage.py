@@ -0,0 +1,378 @@
+import asyncio
+import functools
+import inspect
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from .metrics import STORAGE_CALL_ERRORS, STORAGE_CALL_SECONDS, record_startup, sampled
+
+DEFAULT_STORAGE_BACKEND = 'tollsystem_api.firebase_service.FirebaseService'
+
+
+class InsufficientBalance(Exception):
+    """Raised when a debit would take a vehicle balance below the minimum"""
+
+    def __init__(self, balance, amount):
+        super().__init__(f"Insufficient balance: {balance} < {amount}")
+        self.balance = balance
+        self.amount = amount
+
+
+class StorageBackend:
+    """Data operations used by the API views.
+
+    Records are exchanged as plain dicts shaped like the Firebase tree
+    (camelCase keys, string ids), whatever the backend stores underneath.
+    Read methods return None and write methods return None/False when the
+    store is unavailable, rather than raising.
+    """
+
+    # Owners
+
+    def get_owners(self):
+        """Return {owner_id: owner} for every owner"""
+        raise NotImplementedError
+
+    def get_owner(self, owner_id):
+        raise NotImplementedError
+
+    def get_owners_page(self, limit, after=None):
+        """Return (owners, next_key) with owners as [(owner_id, owner)] in key order;
+        a `limit` of None returns them all"""
+        raise NotImplementedError
+
+    def add_owner(self, data):
+        """Create an owner and return its id"""
+        raise NotImplementedError
+
+    # Vehicles
+
+    def get_vehicles(self):
+        """Return {vehicle_id: vehicle} for every vehicle"""
+        raise NotImplementedError
+
+    def get_vehicle(self, vehicle_id):
+        raise NotImplementedError
+
+    def find_vehicle_by_rfid(self, rfid):
+        """Return (vehicle_id, vehicle) for an RFID tag, or (None, None)"""
+        raise NotImplementedError
+
+    def match_plate(self, plate, limit=5):
+        """Return [(vehicle_id, vehicle, confidence)] for a licence plate read, best first"""
+        raise NotImplementedError
+
+    def check_watchlist(self, rfid=None, plate=None):
+        """Return (vehicle_id, vehicle, matched_on) if the tag or plate belongs to a
+        suspended vehicle, matched_on being 'rfid' or 'plate'; else (None, None, None)"""
+        raise NotImplementedError
+
+    def get_watchlist(self):
+        """Return {vehicle_id: vehicle} for every suspended vehicle"""
+        raise NotImplementedError
+
+    def get_vehicle_by_rfid(self, rfid):
+        vehicle_id, vehicle = self.find_vehicle_by_rfid(rfid)
+        return vehicle
+
+    def get_owner_vehicles(self, owner_id):
+        """Return {vehicle_id: vehicle} for an owner"""
+        raise NotImplementedError
+
+    def get_vehicles_page(self, limit, after=None, predicate=None):
+        """Return (vehicles, next_key) with vehicles as [(vehicle_id, vehicle)] in id order;
+        a `limit` of None returns them all"""
+        raise NotImplementedError
+
+    def update_vehicle(self, vehicle_id, fields):
+        """Merge `fields` into a vehicle; None values clear a field. Returns success"""
+        raise NotImplementedError
+
+    def update_vehicle_balance(self, vehicle_id, new_balance):
+        """Set a balance outright; backends with a ledger record the difference as an adjustment"""
+        return self.update_vehicle(vehicle_id, {'balance': new_balance})
+
+    # Balances and history
+
+    def debit_balance(self, vehicle_id, amount, record):
+        """Atomically debit a toll and record it in `transactions`.
+
+        Returns (previous_balance, new_balance, record_id), or None on storage
+        errors. Raises InsufficientBalance if the balance does not cover
+        `amount`.
+        """
+        raise NotImplementedError
+
+    def credit_balance(self, vehicle_id, amount, record):
+        """Atomically credit a recharge and record it in `payments`; see debit_balance"""
+        raise NotImplementedError
+
+    def debit_balances(self, debits):
+        """Apply a batch of toll debits and record them together.
+
+        `debits` maps vehicle_id -> [(amount, record)] in charge order. Each
+        vehicle's debits are applied in one atomic balance update, accepting
+        them in order while the balance covers them; the accepted records are
+        then written in one batch. Returns {vehicle_id: results} with one
+        result per debit, either (previous_balance, new_balance, record_id) or
+        an InsufficientBalance; a vehicle maps to None if its update failed.
+        Returns None if nothing could be recorded.
+        """
+        raise NotImplementedError
+
+    def get_scan_receipts(self, reader_id, scan_ids):
+        """Return {scan_id: record_id} for the scans of a reader already charged"""
+        raise NotImplementedError
+
+    def push_toll_record(self, data):
+        raise NotImplementedError
+
+    def push_payment_record(self, data):
+        raise NotImplementedError
+
+    def write_records(self, records, replayed=()):
+        """Write [(collection, record_id, data)] in one batch, overwriting existing ids.
+
+        `replayed` holds ids an earlier, possibly applied, attempt wrote; the
+        records are written again but must not be counted twice.
+        """
+        raise NotImplementedError
+
+    def get_owner_records(self, collection, owner_id, limit=None, after=None, since=None, until=None):
+        """Return (records, next_key) for an owner's `transactions` or `payments`, newest first"""
+        raise NotImplementedError
+
+    def iter_records(self, collection, since=None, until=None, plaza=None, chunk_size=1000, archived=True):
+        """Yield every `transactions` or `payments` record, with its 'id'.
+
+        Optionally only those timestamped within [since, until] and charged at
+        `plaza`, and without those moved to the archive tier. Records are read
+        `chunk_size` at a time, so memory does not grow with the export. Unlike
+        the other reads this raises on storage errors, as part of the export
+        may already have been sent.
+        """
+        raise NotImplementedError
+
+    def archive_records(self, collection, before, batch_size=100000):
+        """Move `transactions` or `payments` records timestamped before `before` to the
+        archive tier (see archive.py), which get_owner_records and iter_records read
+        along with the live store. Returns the number moved, or None on storage errors"""
+        raise NotImplementedError
+
+    # Balance ledger (see ledger.py)
+
+    def get_ledger_balance(self, vehicle_id, snapshot=None):
+        """Return {'cents', 'snapshot', 'tailEntries'}: a vehicle's balance recomputed
+        from its latest ledger snapshot, or `snapshot`, plus the entries after it"""
+        raise NotImplementedError
+
+    def iter_ledger(self, chunk_size=500):
+        """Yield (vehicle_id, keys, cents) for every vehicle with ledger entries, its
+        entry keys ascending and their signed amounts in cents, reading `chunk_size`
+        vehicles at a time. Raises on storage errors"""
+        raise NotImplementedError
+
+    def get_ledger_snapshots(self):
+        """Return {vehicle_id: snapshot} (see ledger.ledger_snapshot)"""
+        return {}
+
+    def write_ledger_snapshots(self, snapshots):
+        """Store {vehicle_id: snapshot}, replacing earlier ones. Returns success"""
+        raise NotImplementedError
+
+    def append_ledger_entries(self, entries):
+        """Append [(vehicle_id, entry)] to the ledger. Returns success"""
+        raise NotImplementedError
+
+    # Configuration
+
+    def get_pricing_rules(self):
+        """Return {rule_id: rule} shaped like the `pricingRules` tree"""
+        raise NotImplementedError
+
+    def get_toll_plazas(self):
+        """Return {plaza_id: plaza} shaped like the `tollPlazas` tree"""
+        raise NotImplementedError
+
+    def cache_stats(self):
+        """Hit/miss counters of the backend's read cache, if it has one"""
+        return {}
+
+    def change_stream_status(self):
+        """Status of the realtime change subscription, or None if the backend has none"""
+        return None
+
+    def warm_up(self, timeout=30):
+        """Preload what the scan path reads before serving; returns success"""
+        return True
+
+    # Dashboard
+
+    def get_stats(self, hours=24, days=30):
+        """Return the incrementally maintained aggregates (see stats.stat_increments).
+
+        Shaped {group: {key: {field: value}}}, with only the latest `hours`
+        hourly and `days` daily buckets.
+        """
+        raise NotImplementedError
+
+    def get_vehicle_counts(self):
+        """Return {'total', 'byStatus': {status: count}, 'lowBalance'}"""
+        raise NotImplementedError
+
+    def rebuild_stats(self):
+        """Recompute the aggregates from the full record history; returns records counted"""
+        raise NotImplementedError
+
+    # Scanners
+
+    def get_hardware_endpoints(self):
+        """Return {endpoint_id: endpoint} shaped like the `hardwareEndpoints` tree"""
+        raise NotImplementedError
+
+    def update_hardware_endpoints(self, updates):
+        """Merge {endpoint_id: fields} into `hardwareEndpoints` in one batch. Returns success"""
+        raise NotImplementedError
+
+    # Async variants used by the async views. By default they run the blocking
+    # method on the storage thread pool; backends override them where they can
+    # answer from memory or talk to the store without blocking.
+
+    async def aget_owner(self, owner_id):
+        return await run_sync(self.get_owner, owner_id)
+
+    async def aget_owner_vehicles(self, owner_id):
+        return await run_sync(self.get_owner_vehicles, owner_id)
+
+    async def aget_vehicle(self, vehicle_id):
+        return await run_sync(self.get_vehicle, vehicle_id)
+
+    async def afind_vehicle_by_rfid(self, rfid):
+        return await run_sync(self.find_vehicle_by_rfid, rfid)
+
+    async def amatch_plate(self, plate, limit=5):
+        return await run_sync(self.match_plate, plate, limit)
+
+    async def acheck_watchlist(self, rfid=None, plate=None):
+        return await run_sync(self.check_watchlist, rfid, plate)
+
+    async def adebit_balance(self, vehicle_id, amount, record):
+        return await run_sync(self.debit_balance, vehicle_id, amount, record)
+
+    async def acredit_balance(self, vehicle_id, amount, record):
+        return await run_sync(self.credit_balance, vehicle_id, amount, record)
+
+    async def aget_owner_records(self, collection, owner_id, limit=None, after=None, since=None, until=None):
+        return await run_sync(
+            self.get_owner_records, collection, owner_id, limit=limit, after=after, since=since, until=until
+        )
+
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+
+def run_sync(func, *args, **kwargs):
+    """Run a blocking storage call on the storage thread pool; returns an awaitable"""
+    global _executor, _executor_pid
+    # A forked worker needs its own pool: the parent's threads did not survive the fork
+    if _executor is None or _executor_pid != os.getpid():
+        with _executor_lock:
+            if _executor is None or _executor_pid != os.getpid():
+                _executor = ThreadPoolExecutor(
+                    max_workers=getattr(settings, 'ASYNC_STORAGE_THREADS', 32), thread_name_prefix='storage'
+                )
+                _executor_pid = os.getpid()
+    return asyncio.get_running_loop().run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+_storage = None
+_storage_pid = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    """Return the process-wide storage backend named by settings.STORAGE_BACKEND.
+
+    Built on first use, and again in a forked worker, so importing the app
+    (manage.py commands, migrations) never connects to the store.
+    """
+    global _storage, _storage_pid
+    if _storage is None or _storage_pid != os.getpid():
+        with _storage_lock:
+            if _storage is None or _storage_pid != os.getpid():
+                started = time.perf_counter()
+                backend = getattr(settings, 'STORAGE_BACKEND', DEFAULT_STORAGE_BACKEND)
+                _storage = import_string(backend)()
+                _storage_pid = os.getpid()
+                record_startup('storage_init', time.perf_counter() - started)
+    return _storage
+
+
+def set_storage(backend):
+    """Replace the process-wide storage backend (e.g. with an in-memory one for benchmarks)"""
+    global _storage, _storage_pid
+    with _storage_lock:
+        _storage = backend
+        _storage_pid = os.getpid()
+
+
+def _timed(name, method):
+    if inspect.iscoroutinefunction(method):
+        return _timed_async(name, method)
+
+    def call(*args, **kwargs):
+        if not sampled():
+            return method(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        except InsufficientBalance:
+            raise
+        except Exception:
+            STORAGE_CALL_ERRORS.inc(method=name)
+            raise
+        finally:
+            STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, method=name)
+
+    return call
+
+
+def _timed_async(name, method):
+    async def call(*args, **kwargs):
+        if not sampled():
+            return await method(*args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await method(*args, **kwargs)
+        except InsufficientBalance:
+            raise
+        except Exception:
+            STORAGE_CALL_ERRORS.inc(method=name)
+            raise
+        finally:
+            STORAGE_CALL_SECONDS.observe(time.perf_counter() - started, method=name)
+
+    return call
+
+
+class _StorageProxy:
+    """Module-level handle that resolves the configured backend on first use.
+
+    Public methods called through it are timed into the storage metrics.
+    """
+
+    def __getattr__(self, name):
+        attr = getattr(get_storage(), name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+        return _timed(name, attr)
+
+
+storage = _StorageProxy()
@@ -0,0 +1,776 @@
+import json
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import Client, SimpleTestCase, TestCase, override_settings
+
+from .archive import Archive
+from .change_stream import PROBE_ROOT, ChangeStream, LocalEventSource
+from .heartbeats import HeartbeatRegistry
+from .memory_db import MemoryFirebaseService
+from .models import Owner, Payment, PricingRule, TollRecord, Vehicle
+from .orm_storage import OrmStorage
+from .plates import PlateIndex, edit_distance, normalize_plate
+from .pricing import PricingEngine, PricingUnavailable, pricing_engine
+from .reconcile import reconcile_ledger
+from .record_keys import PUSH_CHARS, push_id_prefix
+from .scan_dedup import ScanDeduplicator, scan_deduplicator
+from .storage import InsufficientBalance, get_storage, set_storage
+from .toll_processing import process_scan_batch
+from .vehicle_index import VehicleIndex
+
+
+def wait_for(condition, timeout=5):
+    """Poll `condition` until it holds; the stream supervisor ticks once a second"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.05)
+    return condition()
+
+
+def memory_tree():
+    return {
+        'owners': {'o1': {'name': 'John', 'email': 'john@example.com'}},
+        'vehicles': {
+            'v1': {'rfid': 'R1', 'licensePlate': 'ABC-1234', 'type': 'Small Car', 'ownerId': 'o1',
+                   'ownerName': 'John', 'balance': 100.0, 'status': 'active'},
+            'v2': {'rfid': 'R2', 'licensePlate': 'XYZ 987', 'type': 'Truck', 'ownerId': 'o1',
+                   'ownerName': 'John', 'balance': 15.0, 'status': 'active'},
+        },
+        'pricingRules': {
+            'r1': {'vehicleType': 'Small Car', 'basePrice': 5, 'isActive': True},
+            'r2': {'vehicleType': 'Truck', 'basePrice': 10, 'isActive': True},
+        },
+    }
+
+
+def post(client, url, data, **extra):
+    return client.post(url, json.dumps(data), content_type='application/json', **extra)
+
+
+class BackendTestMixin:
+    """Installs a storage backend for the test and restores the previous one after;
+    records are written directly and nothing is streamed"""
+
+    def make_backend(self):
+        raise NotImplementedError
+
+    def setUp(self):
+        super().setUp()
+        override = override_settings(WRITE_BEHIND_ENABLED=False, CHANGE_STREAM_ENABLED=False)
+        override.enable()
+        self.addCleanup(override.disable)
+        self._previous = get_storage()
+        self.backend = self.make_backend()
+        set_storage(self.backend)
+        pricing_engine.invalidate()
+        scan_deduplicator.clear()
+        self.client = Client(SERVER_NAME='localhost')
+
+    def tearDown(self):
+        set_storage(self._previous)
+        pricing_engine.invalidate()
+        scan_deduplicator.clear()
+        super().tearDown()
+
+
+class MemoryBackendMixin(BackendTestMixin):
+
+    def make_backend(self):
+        self.tree = memory_tree()
+        # The service is a per-process singleton; each test gets a fresh one
+        MemoryFirebaseService._instance = None
+        backend = MemoryFirebaseService(self.tree)
+        backend.vehicle_index.ensure_loaded()
+        return backend
+
+    def balance(self, vehicle_id):
+        return self.backend.db.reference(f'vehicles/{vehicle_id}/balance').get()
+
+
+class OrmBackendMixin(BackendTestMixin):
+
+    def make_backend(self):
+        owner = Owner.objects.create(name='John', email='john@example.com')
+        self.car = Vehicle.objects.create(owner=owner, plate_number='ABC-1234', rfid_tag='R1',
+                                          vehicle_type='Small Car', balance=100)
+        self.truck = Vehicle.objects.create(owner=owner, plate_number='XYZ 987', rfid_tag='R2',
+                                            vehicle_type='Truck', balance=15)
+        PricingRule.objects.create(vehicle_type='Small Car', base_price=5)
+        PricingRule.objects.create(vehicle_type='Truck', base_price=10)
+        return OrmStorage()
+
+    def balance(self, vehicle_id):
+        return float(Vehicle.objects.get(pk=vehicle_id).balance)
+
+
+class ChangeStreamTests(SimpleTestCase):
+
+    def setUp(self):
+        self.events = []
+        self.lost = []
+        self.source = LocalEventSource({'vehicles': {'v1': {'balance': 10}}, 'owners': {}})
+        self.stream = None
+
+    def tearDown(self):
+        if self.stream is not None:
+            self.stream.stop()
+
+    def start(self, **kwargs):
+        record = lambda path, data, event_type: self.events.append((event_type, path, data))
+        kwargs.setdefault('probe_interval', 0)
+        self.stream = ChangeStream(
+            self.source, {'vehicles': [record], 'owners': []}, on_lost=self.lost.append, **kwargs
+        )
+        self.stream.start()
+        self.assertTrue(self.stream.wait_ready(5))
+
+    def test_initial_snapshot_then_deltas(self):
+        self.start()
+        self.assertEqual(self.events[0], ('put', '/', {'v1': {'balance': 10}}))
+        self.source.put('vehicles/v1/balance', 7)
+        self.source.patch('vehicles', {'v2': {'balance': 1}})
+        self.source.put('owners/o1', {'name': 'n'})
+        self.assertEqual(self.events[1:], [('put', '/v1/balance', 7), ('patch', '/', {'v2': {'balance': 1}})])
+        status = self.stream.status()
+        self.assertTrue(status['ready'])
+        self.assertEqual(status['subscriptions']['vehicles']['events'], 3)
+        self.assertEqual(status['subscriptions']['owners']['events'], 2)
+
+    def test_write_above_path_replaces_it(self):
+        self.start()
+        self.source.put('/', {'vehicles': {'v3': {'balance': 3}}})
+        self.assertEqual(self.events[-1], ('put', '/', {'v3': {'balance': 3}}))
+
+    def test_not_ready_until_every_snapshot(self):
+        stream = ChangeStream(self.source, {'vehicles': []}, probe_interval=0)
+        self.assertFalse(stream.status()['ready'])
+        self.assertFalse(stream.wait_ready(0.05))
+
+    def test_lost_listener_is_reported_and_resubscribed(self):
+        self.start()
+        subscription = self.stream._subscriptions['vehicles']
+        subscription.registration.close()
+        self.assertTrue(wait_for(lambda: self.lost == ['vehicles']))
+        self.assertTrue(wait_for(lambda: subscription.ready and self.stream.ready.is_set()))
+        # The fresh snapshot is delivered again on resubscribe
+        self.assertEqual([event for event in self.events if event[1] == '/'][-1][0], 'put')
+        self.source.put('vehicles/v1/balance', 1)
+        self.assertEqual(self.events[-1], ('put', '/v1/balance', 1))
+
+    def test_probe_measures_lag_and_is_removed_on_stop(self):
+        self.source.put(PROBE_ROOT, {'stale': time.time() - 3600, 'fresh': time.time()})
+        self.start(probe_interval=0.2)
+        self.assertTrue(wait_for(lambda: self.stream.status()['lag_seconds'] is not None))
+        self.assertLess(self.stream.status()['lag_seconds'], 1)
+        probes = self.source.read(PROBE_ROOT)
+        self.assertNotIn('stale', probes)
+        self.assertIn('fresh', probes)
+        self.stream.stop()
+        self.assertEqual(sorted(self.source.read(PROBE_ROOT)), ['fresh'])
+        self.assertFalse(self.stream.status()['ready'])
+        self.assertEqual(self.lost, ['vehicles', 'owners'])
+
+
+class HeartbeatRegistryTests(SimpleTestCase):
+    """Two registries over one store stand for two worker processes"""
+
+    def setUp(self):
+        self.endpoints = {'reader9': {'tollPlazaId': 'plaza1', 'status': 'offline', 'isOnline': False}}
+        self.writes = []
+        self.workers = [
+            HeartbeatRegistry(self.flush, loader=lambda: self.endpoints, offline_after=30)
+            for _ in range(2)
+        ]
+
+    def flush(self, updates):
+        self.writes.append(updates)
+        for scanner_id, fields in updates.items():
+            self.endpoints.setdefault(scanner_id, {}).update(fields)
+        return True
+
+    def scanner(self, worker, scanner_id):
+        return next(s for s in worker.fleet_status()['scanners'] if s['scannerId'] == scanner_id)
+
+    def test_heartbeat_to_one_worker_is_seen_by_the_other(self):
+        first, second = self.workers
+        first.record_heartbeat('reader1', 'online', 'plaza2')
+        self.assertEqual(first.flush_once(), 1)
+        status = self.scanner(second, 'reader1')
+        self.assertTrue(status['isOnline'])
+        self.assertEqual((status['status'], status['tollPlazaId']), ('online', 'plaza2'))
+        self.assertFalse(self.scanner(second, 'reader9')['isOnline'])
+        self.assertEqual(second.fleet_status()['online'], 1)
+
+    def test_no_worker_writes_a_scanner_offline(self):
+        first, second = self.workers
+        first.record_heartbeat('reader1')
+        second.record_heartbeat('reader2')
+        first.flush_once()
+        second.flush_once()
+        # reader1 last reached the first worker long ago
+        first._scanners['reader1'].last_seen -= 120
+        self.endpoints['reader1']['lastHeartbeat'] = '2020-01-01T00:00:00Z'
+        self.assertEqual(first.flush_once(), 0)
+        self.assertEqual(second.flush_once(), 0)
+        self.assertTrue(all(fields['isOnline'] for update in self.writes for fields in update.values()))
+        for worker in self.workers:
+            self.assertEqual(self.scanner(worker, 'reader1')['status'], 'offline')
+            self.assertTrue(self.scanner(worker, 'reader2')['isOnline'])
+
+    def test_scan_counts_as_heartbeat(self):
+        first, second = self.workers
+        first.record_scan('reader9')
+        first.flush_once()
+        self.assertTrue(self.scanner(second, 'reader9')['isOnline'])
+        self.assertEqual(self.scanner(first, 'reader9')['scansPerMinute'], 1.0)
+
+    def test_local_view_when_store_unavailable(self):
+        worker = HeartbeatRegistry(self.flush, loader=lambda: None)
+        worker.record_heartbeat('reader1', 'degraded')
+        self.assertEqual(self.scanner(worker, 'reader1')['status'], 'degraded')
+
+
+class PricingEngineTests(SimpleTestCase):
+
+    def setUp(self):
+        self.rules = None
+        self.loads = 0
+        self.engine = PricingEngine(self.load, ttl=300, retry_interval=0.2)
+
+    def load(self):
+        self.loads += 1
+        return self.rules
+
+    def test_failed_first_load_is_not_cached(self):
+        with self.assertRaises(PricingUnavailable):
+            self.engine.get_price('Truck')
+        # Within the retry interval the read is not repeated
+        with self.assertRaises(PricingUnavailable):
+            self.engine.get_price('Truck')
+        self.assertEqual(self.loads, 1)
+        self.rules = {'r': {'vehicleType': 'Truck', 'basePrice': 10, 'isActive': True}}
+        time.sleep(0.25)
+        self.assertEqual(self.engine.get_price('Truck'), 10.0)
+        self.assertEqual(self.loads, 2)
+
+    def test_invalidate_retries_at_once(self):
+        with self.assertRaises(PricingUnavailable):
+            self.engine.get_price('Truck')
+        self.rules = {'r': {'vehicleType': 'Truck', 'basePrice': 10, 'isActive': True}}
+        self.engine.invalidate()
+        self.assertEqual(self.engine.get_price('Truck'), 10.0)
+
+    def test_failed_reload_keeps_last_table(self):
+        self.rules = {'r': {'vehicleType': 'Motorbike', 'basePrice': 0, 'isActive': True}}
+        self.assertEqual(self.engine.get_price('Motorbike'), 0.0)
+        self.rules = None
+        self.engine.invalidate()
+        self.assertEqual(self.engine.get_price('Motorbike'), 0.0)
+        self.assertEqual(self.loads, 2)
+
+
+class MemoryPricingUnavailableTests(MemoryBackendMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        reference = self.backend.db.reference
+
+        def failing(path='/'):
+            if path == 'pricingRules':
+                raise ConnectionError('read timed out')
+            return reference(path)
+
+        self.backend.db.reference = failing
+        self.backend.cache.invalidate('pricingRules')
+        # A process that has never read the rules
+        engine = PricingEngine(self.backend.get_pricing_rules)
+        patcher = mock.patch('tollsystem_api.toll_processing.pricing_engine', engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_scan_fails_without_charging(self):
+        response = post(self.client, '/api/toll/rfid-scan/', {'rfid': 'R2', 'tollPlazaId': 'plaza1'})
+        self.assertEqual(response.status_code, 503)
+        results = process_scan_batch([{'scan_id': 'a', 'rfid': 'R2', 'tollPlazaId': 'plaza1'}], 'reader1')
+        self.assertEqual(results[0][0], 503)
+        self.assertEqual(self.balance('v2'), 15.0)
+
+
+class BalanceTestsMixin:
+    """Debits and credits shared by both backends"""
+
+    def test_debit_and_credit(self):
+        previous, new, record_id = self.backend.debit_balance(
+            self.vehicle_id, 5, {'vehicleId': self.vehicle_id, 'amount': 5, 'status': 'completed'}
+        )
+        self.assertEqual((previous, new), (100.0, 95.0))
+        self.assertTrue(record_id)
+        previous, new, record_id = self.backend.credit_balance(
+            self.vehicle_id, 20.5, {'vehicleId': self.vehicle_id, 'amount': 20.5}
+        )
+        self.assertEqual((previous, new), (95.0, 115.5))
+        self.assertEqual(self.balance(self.vehicle_id), 115.5)
+
+    def test_debit_refuses_overdraft(self):
+        with self.assertRaises(InsufficientBalance):
+            self.backend.debit_balance(self.vehicle_id, 1000, {'vehicleId': self.vehicle_id, 'amount': 1000})
+        self.assertEqual(self.balance(self.vehicle_id), 100.0)
+
+    def test_debit_balances_applies_in_order_and_skips_overdrafts(self):
+        record = {'vehicleId': self.truck_id, 'amount': 10, 'status': 'completed'}
+        outcome = self.backend.debit_balances({
+            self.truck_id: [(10, record), (10, record), (5, record)],
+        })
+        results = outcome[self.truck_id]
+        self.assertEqual(results[0][:2], (15.0, 5.0))
+        self.assertIsInstance(results[1], InsufficientBalance)
+        self.assertEqual(results[2][:2], (5.0, 0.0))
+        self.assertEqual(self.balance(self.truck_id), 0.0)
+
+
+class MemoryBalanceTests(MemoryBackendMixin, BalanceTestsMixin, SimpleTestCase):
+    vehicle_id = 'v1'
+    truck_id = 'v2'
+
+
+class OrmBalanceTests(OrmBackendMixin, BalanceTestsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle_id = str(self.car.pk)
+        self.truck_id = str(self.truck.pk)
+
+
+class OrmScanTests(OrmBackendMixin, TestCase):
+    """The scan and account flow with no Firebase at all"""
+
+    def test_scan_recharge_and_history(self):
+        response = post(self.client, '/api/toll/rfid-scan/', {'rfid': 'R1', 'tollPlazaId': 'plaza1'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['new_balance'], 95.0)
+
+        response = post(self.client, '/api/toll/rfid-scan/', {'rfid': 'R2', 'tollPlazaId': 'plaza1'})
+        self.assertEqual(response.json()['new_balance'], 5.0)
+        response = post(self.client, '/api/toll/rfid-scan/', {'rfid': 'R2', 'tollPlazaId': 'plaza2'})
+        self.assertEqual(response.status_code, 402)
+
+        response = post(self.client, f'/api/vehicle/{self.truck.pk}/recharge/', {'amount': 20})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.balance(self.truck.pk), 25.0)
+
+        response = post(self.client, f'/api/vehicle/{self.truck.pk}/suspend/', {})
+        self.assertEqual(response.status_code, 200)
+        response = post(self.client, '/api/toll/rfid-scan/', {'rfid': 'R2', 'tollPlazaId': 'plaza3'})
+        self.assertEqual(response.status_code, 403)
+
+        owner = self.car.owner_id
+        first = self.client.get(f'/api/owner/{owner}/tolls/', {'limit': 1})
+        self.assertEqual(first.status_code, 200)
+        second = self.client.get(f'/api/owner/{owner}/tolls/', {'limit': 1, 'cursor': first['X-Next-Cursor']})
+        self.assertEqual(len(first.json()) + len(second.json()), 2)
+        self.assertEqual(TollRecord.objects.count(), 2)
+
+    def test_unknown_tag(self):
+        response = post(self.client, '/api/toll/rfid-scan/', {'rfid': 'NOPE', 'tollPlazaId': 'plaza1'})
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(TollRecord.objects.count(), 0)
+
+
+class BulkScanTestsMixin:
+    """Reader-buffered batches: replays and double-reads are never charged twice"""
+
+    def scans(self):
+        return [
+            {'scan_id': 'a', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:00Z', 'tollPlazaId': 'plaza1'},
+            {'scan_id': 'b', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:03Z', 'tollPlazaId': 'plaza1'},
+            {'scan_id': 'c', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:30Z', 'tollPlazaId': 'plaza1'},
+            {'scan_id': 'd', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:01Z', 'tollPlazaId': 'plaza2'},
+            {'scan_id': 'a', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:00Z', 'tollPlazaId': 'plaza1'},
+        ]
+
+    def test_window_and_replay(self):
+        results = process_scan_batch(self.scans(), 'reader1')
+        codes = [code for code, _ in results]
+        duplicates = [bool(payload.get('duplicate')) for _, payload in results]
+        self.assertEqual(codes, [200] * 5)
+        self.assertEqual(duplicates, [False, True, False, False, True])
+        self.assertEqual(self.balance(self.vehicle_id), 85.0)
+
+        replay = process_scan_batch(self.scans(), 'reader1')
+        self.assertTrue(all(payload.get('duplicate') for _, payload in replay))
+        self.assertEqual(self.balance(self.vehicle_id), 85.0)
+
+    def test_repeated_id_of_a_double_read(self):
+        scans = [
+            {'scan_id': 'w', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:00Z', 'tollPlazaId': 'plaza1'},
+            {'scan_id': 'x', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:02Z', 'tollPlazaId': 'plaza1'},
+            {'scan_id': 'x', 'rfid': 'R1', 'timestamp': '2024-05-01T07:00:02Z', 'tollPlazaId': 'plaza1'},
+        ]
+        for attempt in range(2):
+            results = process_scan_batch(scans, 'reader1')
+            self.assertEqual([code for code, _ in results], [200] * 3)
+            transaction_ids = {payload['transaction_id'] for _, payload in results}
+            self.assertEqual(len(transaction_ids), 1)
+            self.assertTrue(all(payload.get('duplicate') for _, payload in results[1:]))
+        self.assertEqual(self.balance(self.vehicle_id), 95.0)
+
+    def test_online_scan_then_batch_replay(self):
+        response = post(self.client, '/api/toll/rfid-scan/',
+                        {'rfid': 'R1', 'tollPlazaId': 'plaza1', 'scanner_id': 'reader7', 'scan_id': 'x1'})
+        self.assertEqual(response.status_code, 200)
+        scan_deduplicator.clear()
+        results = process_scan_batch([{'scan_id': 'x1', 'rfid': 'R1', 'tollPlazaId': 'plaza1'}], 'reader7')
+        self.assertTrue(results[0][1].get('duplicate'))
+        self.assertEqual(results[0][1].get('transaction_id'), response.json()['transaction_id'])
+        self.assertEqual(self.balance(self.vehicle_id), 95.0)
+
+    def test_invalid_scans(self):
+        results = process_scan_batch([{'rfid': 'R1'}, {'scan_id': 'z'}, 'junk'], 'reader1')
+        self.assertEqual([code for code, _ in results], [400, 400, 400])
+        self.assertEqual(self.balance(self.vehicle_id), 100.0)
+
+
+class MemoryBulkScanTests(MemoryBackendMixin, BulkScanTestsMixin, SimpleTestCase):
+    vehicle_id = 'v1'
+
+
+class OrmBulkScanTests(OrmBackendMixin, BulkScanTestsMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.vehicle_id = self.car.pk
+
+
+class FakeTimer:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class ScanDeduplicatorTests(SimpleTestCase):
+
+    def setUp(self):
+        self.timer = FakeTimer()
+        self.dedup = ScanDeduplicator(window=10, key_ttl=600, timer=self.timer)
+        self.scan = {'scanner_id': 'r1', 'tollPlazaId': 'p1'}
+
+    def test_double_read_within_window(self):
+        first = self.dedup.claim('R1', self.scan)
+        self.assertFalse(first.duplicate)
+        first.complete(200, {'new_balance': 95})
+        second = self.dedup.claim('R1', self.scan)
+        self.assertTrue(second.duplicate)
+        self.assertEqual(second.result(), (200, {'new_balance': 95, 'duplicate': True}))
+
+    def test_window_expires(self):
+        self.dedup.claim('R1', self.scan).complete(200, {})
+        self.timer.now = 11
+        self.assertFalse(self.dedup.claim('R1', self.scan).duplicate)
+
+    def test_other_reader_or_plaza_is_not_a_duplicate(self):
+        self.dedup.claim('R1', self.scan).complete(200, {})
+        self.assertFalse(self.dedup.claim('R1', {'scanner_id': 'r2', 'tollPlazaId': 'p1'}).duplicate)
+        self.assertFalse(self.dedup.claim('R1', {'scanner_id': 'r1', 'tollPlazaId': 'p2'}).duplicate)
+
+    def test_idempotency_key_outlives_window(self):
+        self.dedup.claim('R1', self.scan, 'k1').complete(200, {'transaction_id': 't1'})
+        self.timer.now = 100
+        retry = self.dedup.claim('R1', self.scan, 'k1')
+        self.assertTrue(retry.duplicate)
+        self.assertEqual(retry.result()[1]['transaction_id'], 't1')
+        self.timer.now = 701
+        self.assertFalse(self.dedup.claim('R1', self.scan, 'k1').duplicate)
+
+    def test_server_errors_are_forgotten(self):
+        self.dedup.claim('R1', self.scan).complete(503, {})
+        self.assertFalse(self.dedup.claim('R1', self.scan).duplicate)
+
+
+class MemoryDedupViewTests(MemoryBackendMixin, SimpleTestCase):
+
+    def test_repeat_scan_is_not_charged(self):
+        body = {'rfid': 'R1', 'tollPlazaId': 'p1', 'scanner_id': 'a'}
+        first = post(self.client, '/api/toll/rfid-scan/', body)
+        second = post(self.client, '/api/toll/rfid-scan/', body)
+        self.assertEqual((first.status_code, second.status_code), (200, 200))
+        self.assertTrue(second.json().get('duplicate'))
+        self.assertEqual(self.balance('v1'), 95.0)
+        self.assertEqual(len(self.backend.db.reference('transactions').get()), 1)
+
+
+class PlateTests(SimpleTestCase):
+
+    def test_edit_distance(self):
+        self.assertEqual(edit_distance('ABCD', 'ABDC'), 1)
+        self.assertEqual(edit_distance('ABC', 'AXC'), 1)
+        self.assertEqual(edit_distance('kitten', 'sitting'), 3)
+
+    def test_normalize(self):
+        self.assertEqual(normalize_plate(' abc-1234 '), normalize_plate('ABC 1234'))
+
+    def test_index_add_remove(self):
+        index = PlateIndex(2)
+        index.add('v1', 'ABC-1234')
+        self.assertEqual([match[0] for match in index.match('ABC1234')], ['v1'])
+        self.assertEqual([match[0] for match in index.match('ABC124')], ['v1'])
+        index.remove('v1', 'ABC-1234')
+        self.assertEqual(index.match('ABC1234'), [])
+
+
+class VehicleIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.vehicles = {
+            f'v{n}': {'rfid': f'R{n}', 'licensePlate': f'ABC-{n:04d}', 'ownerId': 'o1',
+                      'balance': 50.0, 'status': 'active'}
+            for n in range(50)
+        }
+        self.index = VehicleIndex(lambda: self.vehicles, max_age=None)
+        self.assertTrue(self.index.ensure_loaded())
+
+    def test_changes_rekey_only_what_changed(self):
+        self.index.update('v1', {'balance': 5.0, 'status': 'suspended'})
+        self.assertEqual(self.index.get_by_rfid('R1')[1]['balance'], 5.0)
+        self.assertEqual(self.index.check_watchlist('R1')[0], 'v1')
+        self.index.update('v1', {'rfid': 'NEW', 'licensePlate': 'ABC-OOO1', 'ownerId': 'o2', 'status': 'active'})
+        self.assertEqual(self.index.get_by_rfid('R1'), (None, None))
+        self.assertEqual(self.index.get_by_rfid('NEW')[0], 'v1')
+        self.assertEqual(self.index.get_by_plate('ABC-0001'), (None, None))
+        self.assertEqual(self.index.get_by_plate('ABCOOO1')[0], 'v1')
+        self.assertEqual(self.index.check_watchlist('NEW'), (None, None, None))
+        self.assertEqual(list(self.index.get_by_owner('o2')), ['v1'])
+        self.assertEqual(self.index.counts(), {'total': 50, 'byStatus': {'active': 50}, 'lowBalance': 1})
+
+    def test_lookups_never_miss_during_updates_and_rebuilds(self):
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        self.addCleanup(sys.setswitchinterval, interval)
+        stop = threading.Event()
+        misses = []
+
+        def read():
+            while not stop.is_set():
+                for n in range(0, 50, 7):
+                    if self.index.get_by_rfid(f'R{n}')[0] is None or self.index.get(f'v{n}') is None:
+                        misses.append(n)
+                    if not self.index.match_plate(f'ABC-{n:04d}'):
+                        misses.append(n)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for step in range(2000):
+                vehicle_id = f'v{step % 50}'
+                self.index.update(vehicle_id, {'balance': float(step % 100)})
+                self.index.upsert(vehicle_id, dict(self.vehicles[vehicle_id], status='suspended' if step % 2 else 'active'))
+                if step % 200 == 0:
+                    self.index.apply_change('/', self.vehicles)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(misses, [])
+
+
+class MemoryPlateMatchTests(MemoryBackendMixin, SimpleTestCase):
+
+    def test_exact_and_confusable_matches(self):
+        exact = self.backend.match_plate('abc1234')
+        self.assertEqual((exact[0][0], exact[0][2]), ('v1', 1.0))
+        confusable = self.backend.match_plate('A8C-I234')
+        self.assertEqual(confusable[0][0], 'v1')
+        self.assertGreaterEqual(confusable[0][2], 0.9)
+        self.assertEqual(self.backend.match_plate('QQQ'), [])
+
+    def test_index_follows_plate_changes(self):
+        self.backend.vehicle_index.update('v1', {'licensePlate': 'NEW-1'})
+        self.assertEqual(self.backend.match_plate('ABC-1234'), [])
+        self.assertEqual(self.backend.match_plate('NEW1')[0][0], 'v1')
+
+    def test_scan_by_plate(self):
+        response = post(self.client, '/api/toll/rfid-scan/',
+                        {'rfid': 'BAD', 'licensePlate': 'XYZ-987', 'tollPlazaId': 'p', 'scanner_id': 'cam'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['matched_by'], 'plate')
+        self.assertEqual(self.balance('v2'), 5.0)
+
+    def test_weak_plate_match_is_not_charged(self):
+        response = post(self.client, '/api/toll/rfid-scan/',
+                        {'licensePlate': 'ABC12', 'tollPlazaId': 'p', 'scanner_id': 'cam'})
+        self.assertNotEqual(response.status_code, 200)
+        self.assertEqual(self.balance('v1'), 100.0)
+
+    def test_lookup_view(self):
+        response = self.client.get('/api/vehicle/plate-lookup/', {'plate': 'abc1234'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['matches'][0]['id'], 'v1')
+
+
+class OrmPlateMatchTests(OrmBackendMixin, TestCase):
+
+    def test_exact_match_only(self):
+        matches = self.backend.match_plate('abc-1234')
+        self.assertEqual([(vehicle_id, confidence) for vehicle_id, _, confidence in matches],
+                         [(str(self.car.pk), 1.0)])
+        self.assertEqual(self.backend.match_plate('ABC-124'), [])
+
+
+class OrmLedgerTests(OrmBackendMixin, TestCase):
+    """Every balance change on the ORM backend has a matching ledger entry"""
+
+    def problems(self):
+        return {mismatch['vehicleId']: mismatch for mismatch in reconcile_ledger(self.backend).mismatches}
+
+    def test_seeded_balances_need_openings(self):
+        problems = self.problems()
+        self.assertEqual(set(problems), {str(self.car.pk), str(self.truck.pk)})
+        call_command('reconcile_ledger', '--open-missing', verbosity=0)
+        self.assertEqual(self.problems(), {})
+
+    def test_activity_and_adjustments_reconcile(self):
+        call_command('reconcile_ledger', '--open-missing', verbosity=0)
+        post(self.client, f'/api/vehicle/{self.car.pk}/recharge/', {'amount': 20.3})
+        post(self.client, '/api/toll/rfid-scan/', {'rfid': 'R1', 'tollPlazaId': 'plaza1'})
+        self.assertTrue(self.backend.update_vehicle_balance(str(self.truck.pk), 42))
+        self.assertEqual(self.problems(), {})
+        ledger = self.backend.get_ledger_balance(str(self.truck.pk))
+        self.assertEqual(ledger['cents'], 4200)
+
+    def test_ledger_entries_stay_out_of_payment_history(self):
+        call_command('reconcile_ledger', '--open-missing', verbosity=0)
+        self.backend.update_vehicle_balance(str(self.car.pk), 50)
+        self.assertEqual(Payment.objects.filter(payment_method__in=('opening', 'adjustment')).count(), 3)
+        records, _ = self.backend.get_owner_records('payments', str(self.car.owner_id))
+        self.assertEqual(records, [])
+        self.assertEqual(list(self.backend.iter_records('payments')), [])
+
+    def test_stats_rebuild_ignores_ledger_entries(self):
+        call_command('reconcile_ledger', '--open-missing', verbosity=0)
+        post(self.client, f'/api/vehicle/{self.car.pk}/recharge/', {'amount': 10})
+        self.assertEqual(self.backend.rebuild_stats(), 1)
+
+
+class MemoryLedgerTests(MemoryBackendMixin, SimpleTestCase):
+
+    def test_reconcile_after_openings(self):
+        self.assertEqual(len(reconcile_ledger(self.backend).mismatches), 2)
+        call_command('reconcile_ledger', '--open-missing', verbosity=0)
+        self.backend.debit_balance('v1', 5, {'vehicleId': 'v1', 'ownerId': 'o1', 'amount': 5,
+                                             'timestamp': datetime.utcnow().isoformat() + 'Z'})
+        result = reconcile_ledger(self.backend)
+        self.assertEqual(result.mismatches, [])
+        self.assertEqual(result.summary()['vehicles'], 2)
+
+
+def archive_records(count, owners, start, days, rng):
+    """[(push_id, record)] spread over `days` from `start`"""
+    records = []
+    for n in range(count):
+        when = start + timedelta(seconds=rng.randint(0, days * 86400))
+        key = push_id_prefix(when) + ''.join(rng.choice(PUSH_CHARS) for _ in range(12))
+        owner = rng.choice(owners)
+        records.append((key, {
+            'vehicleId': f'v{owner}', 'ownerId': owner, 'amount': rng.choice([3.3, 5, 12.75]),
+            'balanceAfter': 50.0, 'tollPlazaId': f'plaza{n % 3}', 'readerId': 'r1',
+            'timestamp': when.isoformat() + 'Z', 'status': 'completed',
+        }))
+    return records
+
+
+class ArchiveTests(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        self.rng = random.Random(1)
+        self.start = datetime(2024, 1, 1)
+        self.records = archive_records(300, ['o1', 'o2'], self.start, 5, self.rng)
+        self.archive = Archive(self.root)
+        self.archive.write('transactions', self.records)
+
+    def test_round_trip(self):
+        self.assertEqual(len(self.archive.days('transactions')), len({r['timestamp'][:10] for _, r in self.records}))
+        written = {record_id: data for record_id, data in self.records}
+        read = {record.pop('id'): record for record in self.archive.iter_records('transactions')}
+        self.assertEqual(set(read), set(written))
+        for record_id, record in read.items():
+            self.assertEqual(float(record['amount']), written[record_id]['amount'])
+            self.assertEqual(record['ownerId'], written[record_id]['ownerId'])
+            self.assertEqual(record['tollPlazaId'], written[record_id]['tollPlazaId'])
+
+    def test_rewrite_replaces_by_id(self):
+        record_id, data = self.records[0]
+        self.archive.write('transactions', [(record_id, dict(data, amount=99.0))])
+        read = {record['id']: record for record in self.archive.iter_records('transactions')}
+        self.assertEqual(len(read), len(self.records))
+        self.assertEqual(float(read[record_id]['amount']), 99.0)
+
+    def test_owner_paging(self):
+        expected = sorted(
+            ((data['timestamp'], record_id) for record_id, data in self.records if data['ownerId'] == 'o1'),
+            reverse=True,
+        )
+        everything, next_key = self.archive.owner_records('transactions', 'o1')
+        self.assertIsNone(next_key)
+        paged, after = [], None
+        while True:
+            page, after = self.archive.owner_records('transactions', 'o1', limit=7, after=after)
+            self.assertLessEqual(len(page), 7)
+            paged.extend(page)
+            if not after:
+                break
+        self.assertEqual([record['id'] for record in everything], [record_id for _, record_id in expected])
+        self.assertEqual([record['id'] for record in paged], [record_id for _, record_id in expected])
+
+
+class MemoryArchiveTests(MemoryBackendMixin, SimpleTestCase):
+    """Records moved to the archive tier read back through the storage backend"""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root, ignore_errors=True)
+        override = override_settings(ARCHIVE_DIR=self.root)
+        override.enable()
+        self.addCleanup(override.disable)
+        super().setUp()
+
+    def owner_pages(self, limit):
+        records, after = [], None
+        while True:
+            page, after = self.backend.get_owner_records('transactions', 'o1', limit=limit, after=after)
+            records.extend(page)
+            if not after:
+                return [record['id'] for record in records]
+
+    def test_archive_and_page_across_tiers(self):
+        start = datetime.utcnow() - timedelta(days=20)
+        records = archive_records(200, ['o1', 'o2'], start, 20, random.Random(2))
+        self.backend.write_records([('transactions', key, data) for key, data in records])
+        before_full = self.owner_pages(1000)
+        before_paged = self.owner_pages(7)
+        self.assertEqual(before_full, before_paged)
+
+        moved = self.backend.archive_records('transactions', datetime.now(timezone.utc) - timedelta(days=10))
+        live = self.backend.db.reference('transactions').get() or {}
+        self.assertGreater(moved, 0)
+        self.assertEqual(moved + len(live), len(records))
+
+        self.assertEqual(self.owner_pages(1000), before_full)
+        self.assertEqual(self.owner_pages(7), before_paged)
+        exported = {record['id'] for record in self.backend.iter_records('transactions')}
+        self.assertEqual(exported, {key for key, _ in records})
+        self.assertEqual(self.backend.rebuild_stats(), len(records))
@@ -0,0 +1,497 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import status
+
+from .heartbeats import heartbeat_registry
+from .metrics import (
+    NULL_TIMER, TOLL_SCAN_SECONDS, TOLL_SCAN_STAGE_SECONDS, TOLL_SCANS, StageTimer, record_startup, sampled,
+    scan_outcome, startup_timings,
+)
+from .plates import normalize_plate
+from .pricing import pricing_engine, DEFAULT_VEHICLE_TYPE, PricingUnavailable
+from .record_keys import parse_timestamp
+from .scan_dedup import scan_deduplicator
+from .storage import storage, InsufficientBalance
+from .watchlist import report_hit
+
+logger = logging.getLogger(__name__)
+
+
+def is_valid_scanner_token(token):
+    """Scanners may omit the token (manual frontend use) but may not send a wrong one"""
+    return not token or token == settings.SCANNER_TOKEN
+
+
+def _find_vehicle(rfid):
+    """Return (vehicle_id, vehicle, error) where error is (http_status, payload) or None"""
+    # Find vehicle by RFID (in-memory index, no network round trip)
+    vehicle_id, vehicle = storage.find_vehicle_by_rfid(rfid)
+    return _check_vehicle(rfid, vehicle_id, vehicle)
+
+
+def _check_vehicle(rfid, vehicle_id, vehicle):
+    if not vehicle:
+        logger.warning(f"Vehicle not found for RFID: {rfid}")
+        return None, None, (status.HTTP_404_NOT_FOUND, {
+            'error': 'Vehicle not found',
+            'success': False,
+            'rfid': rfid
+        })
+
+    # Check vehicle status
+    if vehicle.get('status') != 'active':
+        logger.warning(f"Vehicle {vehicle_id} is not active: {vehicle.get('status')}")
+        return vehicle_id, vehicle, (status.HTTP_403_FORBIDDEN, {
+            'error': f"Vehicle is {vehicle.get('status')}",
+            'success': False,
+            'license_plate': vehicle.get('licensePlate')
+        })
+
+    return vehicle_id, vehicle, None
+
+
+def _lookup_vehicle(rfid, data):
+    """Return (vehicle_id, vehicle, plate_confidence) by RFID tag, falling back to the plate read"""
+    vehicle_id, vehicle = storage.find_vehicle_by_rfid(rfid) if rfid else (None, None)
+    plate = data.get('licensePlate')
+    if vehicle or not plate:
+        return vehicle_id, vehicle, None
+    return _plate_match(rfid, plate, storage.match_plate(plate))
+
+
+async def _alookup_vehicle(rfid, data):
+    vehicle_id, vehicle = await storage.afind_vehicle_by_rfid(rfid) if rfid else (None, None)
+    plate = data.get('licensePlate')
+    if vehicle or not plate:
+        return vehicle_id, vehicle, None
+    return _plate_match(rfid, plate, await storage.amatch_plate(plate))
+
+
+def _check_watchlist(rfid, data):
+    """Raise an alert if the scan's tag or plate read belongs to a suspended vehicle"""
+    vehicle_id, vehicle, matched_on = storage.check_watchlist(rfid, data.get('licensePlate'))
+    if vehicle_id is not None:
+        report_hit(vehicle_id, vehicle, matched_on, data)
+
+
+async def _acheck_watchlist(rfid, data):
+    vehicle_id, vehicle, matched_on = await storage.acheck_watchlist(rfid, data.get('licensePlate'))
+    if vehicle_id is not None:
+        report_hit(vehicle_id, vehicle, matched_on, data)
+
+
+def _plate_match(rfid, plate, matches):
+    """The best plate match, if it is confident enough to charge without a tag"""
+    min_confidence = getattr(settings, 'PLATE_MATCH_MIN_CONFIDENCE', 0.9)
+    if not matches or matches[0][2] < min_confidence:
+        logger.warning(f"No confident plate match for {plate} (RFID: {rfid}): "
+                       f"{[(vehicle_id, confidence) for vehicle_id, _, confidence in matches or []]}")
+        return None, None, None
+    vehicle_id, vehicle, confidence = matches[0]
+    logger.info(f"RFID {rfid or 'missing'}, matched plate read {plate} to {vehicle_id} ({confidence})")
+    return vehicle_id, vehicle, confidence
+
+
+def _transaction_record(vehicle_id, vehicle, data, vehicle_type, toll_amount, timestamp):
+    """Complete transaction record matching seed data structure.
+
+    balanceAfter is filled in by the atomic debit.
+    """
+    return {
+        'vehicleId': vehicle_id,
+        'ownerId': vehicle.get('ownerId'),
+        'rfid': data.get('rfid'),
+        'vehicleType': vehicle_type,
+        'amount': toll_amount,
+        'tollPlazaId': data.get('tollPlazaId', 'unknown'),
+        'checkpoint': data.get('checkpoint', 'Unknown'),
+        'readerId': data.get('scanner_id', 'Unknown'),
+        'licensePlate': vehicle.get('licensePlate'),
+        'timestamp': timestamp,
+        'status': 'completed'
+    }
+
+
+def _charged_payload(record, previous_balance, new_balance, transaction_id):
+    payload = {
+        'success': True,
+        'transaction_id': transaction_id,
+        'vehicle_type': record['vehicleType'],
+        'toll_amount': record['amount'],
+        'license_plate': record['licensePlate'],
+        'new_balance': new_balance,
+        'previous_balance': previous_balance,
+        'checkpoint': record['checkpoint'],
+        'timestamp': record['timestamp']
+    }
+    if record.get('matchedBy'):
+        payload['matched_by'] = record['matchedBy']
+        payload['plate_confidence'] = record['plateConfidence']
+    return payload
+
+
+def _insufficient_payload(record, balance):
+    return {
+        'error': 'Insufficient balance',
+        'success': False,
+        'current_balance': balance,
+        'required_amount': record['amount'],
+        'license_plate': record['licensePlate']
+    }
+
+
+def process_toll_scan(data, idempotency_key=None):
+    """Charge the toll for one RFID scan.
+
+    Shared by the HTTP scan endpoint and the websocket scanner gateway.
+    Returns (http_status, payload); raises ValueError for malformed input.
+    The vehicle is found by `rfid`, or by an ANPR `licensePlate` read when
+    the tag is missing or unknown and the plate match is confident enough
+    (PLATE_MATCH_MIN_CONFIDENCE).
+    A repeat of a recent scan (same tag at the same reader, or the same
+    `idempotency_key` / `scan_id`) is not charged again: it gets the first
+    scan's result with `duplicate` set (see scan_dedup).
+    Every scan is counted by plaza and outcome; sampled scans also record
+    the time spent in each stage.
+    """
+    started = time.perf_counter()
+    timer = StageTimer(TOLL_SCAN_STAGE_SECONDS) if sampled() else NULL_TIMER
+    try:
+        status_code, payload = _charge_scan(data, timer, idempotency_key)
+    except ValueError:
+        _count_scan(data, started, None)
+        raise
+    _count_scan(data, started, status_code, payload)
+    return status_code, payload
+
+
+async def aprocess_toll_scan(data, idempotency_key=None):
+    """process_toll_scan for async callers; storage calls do not block the event loop"""
+    started = time.perf_counter()
+    timer = StageTimer(TOLL_SCAN_STAGE_SECONDS) if sampled() else NULL_TIMER
+    try:
+        status_code, payload = await _acharge_scan(data, timer, idempotency_key)
+    except ValueError:
+        _count_scan(data, started, None)
+        raise
+    _count_scan(data, started, status_code, payload)
+    return status_code, payload
+
+
+def _count_scan(data, started, status_code, payload=None):
+    plaza = data.get('tollPlazaId') or 'unknown'
+    if status_code is None:
+        TOLL_SCANS.inc(plaza=plaza, outcome='invalid')
+        return
+    outcome = 'duplicate' if payload and payload.get('duplicate') else scan_outcome(status_code)
+    elapsed = time.perf_counter() - started
+    TOLL_SCANS.inc(plaza=plaza, outcome=outcome)
+    TOLL_SCAN_SECONDS.observe(elapsed, plaza=plaza, outcome=outcome)
+    if 'first_scan' not in startup_timings:
+        record_startup('first_scan', elapsed)
+
+
+def _scan_rfid(data):
+    """The scan's RFID tag, or a 400 response if it has neither a tag nor a plate read"""
+    rfid = data.get('rfid')
+    checkpoint = data.get('checkpoint', 'Unknown')
+
+    logger.info(f"RFID scan received: {rfid} at {checkpoint}")
+
+    if data.get('scanner_id'):
+        heartbeat_registry.record_scan(data['scanner_id'])
+
+    if not rfid and not normalize_plate(data.get('licensePlate')):
+        return None, (status.HTTP_400_BAD_REQUEST, {
+            'error': 'RFID tag is required',
+            'success': False
+        })
+    return rfid, None
+
+
+def _scan_key(rfid, data):
+    """What identifies the vehicle read by a scan, for deduplication"""
+    return rfid or f"plate:{normalize_plate(data.get('licensePlate'))}"
+
+
+def _scan_charge(vehicle_id, vehicle, data, plate_confidence=None):
+    """(toll_amount, transaction record) for a scan of an active vehicle"""
+    # AUTO-CALCULATE TOLL AMOUNT based on vehicle type
+    vehicle_type = vehicle.get('type', DEFAULT_VEHICLE_TYPE)
+
+    # Price from the compiled pricing table (no network read per scan)
+    toll_amount = pricing_engine.get_price(vehicle_type, data.get('tollPlazaId'))
+
+    logger.info(f"Vehicle type: {vehicle_type}, Toll amount: ${toll_amount}")
+
+    record = _transaction_record(
+        vehicle_id, vehicle, data, vehicle_type, toll_amount,
+        datetime.utcnow().isoformat() + 'Z'
+    )
+    if plate_confidence is not None:
+        # Charged on an ANPR plate read because the tag was missing or unknown
+        record['matchedBy'] = 'plate'
+        record['plateRead'] = data.get('licensePlate')
+        record['plateConfidence'] = plate_confidence
+    if data.get('scan_id') not in (None, ''):
+        # Leaves a scan receipt, so a bulk replay of this scan is not charged again
+        record['scanId'] = str(data['scan_id'])
+    return toll_amount, record
+
+
+def _charge_scan(data, timer, idempotency_key):
+    rfid, error = _scan_rfid(data)
+    if error:
+        return error
+
+    claim = scan_deduplicator.claim(_scan_key(rfid, data), data, idempotency_key)
+    if claim.duplicate:
+        return claim.result()
+    try:
+        result = _charge_vehicle(rfid, data, timer)
+    except BaseException as e:
+        claim.fail(e)
+        raise
+    claim.complete(*result)
+    return result
+
+
+def _pricing_unavailable():
+    return status.HTTP_503_SERVICE_UNAVAILABLE, {
+        'error': 'Pricing rules unavailable',
+        'success': False
+    }
+
+
+def _charge_vehicle(rfid, data, timer):
+    _check_watchlist(rfid, data)
+    vehicle_id, vehicle, plate_confidence = _lookup_vehicle(rfid, data)
+    vehicle_id, vehicle, error = _check_vehicle(rfid, vehicle_id, vehicle)
+    timer.lap('lookup')
+    if error:
+        return error
+
+    try:
+        toll_amount, transaction_data = _scan_charge(vehicle_id, vehicle, data, plate_confidence)
+    except PricingUnavailable:
+        return _pricing_unavailable()
+    timer.lap('pricing')
+
+    # Check and debit the balance in one compare-and-set on vehicles/<id>/balance
+    try:
+        result = storage.debit_balance(vehicle_id, toll_amount, transaction_data)
+    except InsufficientBalance as e:
+        timer.lap('debit')
+        logger.warning(f"Insufficient balance: {e.balance} < {toll_amount}")
+        return status.HTTP_402_PAYMENT_REQUIRED, _insufficient_payload(transaction_data, e.balance)
+    timer.lap('debit')
+    return _debit_outcome(vehicle_id, vehicle, toll_amount, transaction_data, result)
+
+
+async def _acharge_scan(data, timer, idempotency_key):
+    rfid, error = _scan_rfid(data)
+    if error:
+        return error
+
+    claim = scan_deduplicator.claim(_scan_key(rfid, data), data, idempotency_key)
+    if claim.duplicate:
+        return await claim.aresult()
+    try:
+        result = await _acharge_vehicle(rfid, data, timer)
+    except BaseException as e:
+        claim.fail(e)
+        raise
+    claim.complete(*result)
+    return result
+
+
+async def _acharge_vehicle(rfid, data, timer):
+    # The vehicle lookup, watchlist check and a pricing refresh (if due) do not depend on each other
+    try:
+        (vehicle_id, vehicle, plate_confidence), _, _ = await asyncio.gather(
+            _alookup_vehicle(rfid, data), pricing_engine.atable(), _acheck_watchlist(rfid, data)
+        )
+    except PricingUnavailable:
+        return _pricing_unavailable()
+    vehicle_id, vehicle, error = _check_vehicle(rfid, vehicle_id, vehicle)
+    timer.lap('lookup')
+    if error:
+        return error
+
+    try:
+        toll_amount, transaction_data = _scan_charge(vehicle_id, vehicle, data, plate_confidence)
+    except PricingUnavailable:
+        return _pricing_unavailable()
+    timer.lap('pricing')
+
+    try:
+        result = await storage.adebit_balance(vehicle_id, toll_amount, transaction_data)
+    except InsufficientBalance as e:
+        timer.lap('debit')
+        logger.warning(f"Insufficient balance: {e.balance} < {toll_amount}")
+        return status.HTTP_402_PAYMENT_REQUIRED, _insufficient_payload(transaction_data, e.balance)
+    timer.lap('debit')
+    return _debit_outcome(vehicle_id, vehicle, toll_amount, transaction_data, result)
+
+
+def _debit_outcome(vehicle_id, vehicle, toll_amount, transaction_data, result):
+    if result:
+        current_balance, new_balance, transaction_id = result
+
+        logger.info(f"Toll processed: {transaction_id} - ${toll_amount} from {vehicle.get('licensePlate')}")
+
+        return status.HTTP_200_OK, _charged_payload(transaction_data, current_balance, new_balance, transaction_id)
+    else:
+        logger.error(f"Failed to update vehicle balance for {vehicle_id}")
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {
+            'error': 'Failed to process payment',
+            'success': False
+        }
+
+
+def process_scan_batch(scans, scanner_id=None):
+    """Charge a batch of reader-buffered scans.
+
+    Each scan carries the reader's `scan_id` (its idempotency key) and the
+    `timestamp` it was read at. Scans already charged, in an earlier replay
+    or earlier in the same batch, are reported as duplicates instead of
+    being charged again, as are reads of a tag at the same plaza and reader
+    within SCAN_DEDUP_WINDOW seconds of one charged, in this batch or a
+    replay of it. All tags are resolved against the vehicle index and priced
+    for their reader timestamp, then each vehicle's scans are debited in
+    timestamp order in one balance update and every transaction is written
+    in one batch.
+
+    Returns a list of (http_status, payload) aligned with `scans`.
+    """
+    results = [None] * len(scans)
+    now = datetime.utcnow().isoformat() + 'Z'
+
+    # Validate and group by reader so receipts are read once per reader
+    by_reader = {}
+    first_seen = {}
+    repeats = []
+    for index, scan in enumerate(scans):
+        if not isinstance(scan, dict):
+            results[index] = (status.HTTP_400_BAD_REQUEST, {'error': 'Scan must be an object', 'success': False})
+            continue
+        scan_id = scan.get('scan_id')
+        if scan_id in (None, ''):
+            results[index] = (status.HTTP_400_BAD_REQUEST, {'error': 'scan_id is required', 'success': False})
+            continue
+        if not scan.get('rfid'):
+            results[index] = (status.HTTP_400_BAD_REQUEST, {'error': 'RFID tag is required', 'success': False})
+            continue
+        reader_id = str(scan.get('scanner_id') or scanner_id or 'Unknown')
+        key = (reader_id, str(scan_id))
+        if key in first_seen:
+            repeats.append((index, first_seen[key]))
+            continue
+        first_seen[key] = index
+        by_reader.setdefault(reader_id, []).append(index)
+
+    candidates = []
+    for reader_id, indexes in by_reader.items():
+        receipts = storage.get_scan_receipts(reader_id, [str(scans[i]['scan_id']) for i in indexes])
+        if receipts is None:
+            # Without receipts a replayed scan could be charged twice
+            for index in indexes:
+                results[index] = (status.HTTP_500_INTERNAL_SERVER_ERROR, {
+                    'error': 'Failed to check for duplicate scans',
+                    'success': False
+                })
+            continue
+
+        for index in indexes:
+            scan = scans[index]
+            transaction_id = receipts.get(str(scan['scan_id']))
+            if transaction_id:
+                results[index] = (status.HTTP_200_OK, {
+                    'success': True,
+                    'duplicate': True,
+                    'transaction_id': transaction_id
+                })
+            read_at = parse_timestamp(scan.get('timestamp'))
+            tag = (str(scan['rfid']), str(scan.get('tollPlazaId') or 'unknown'), reader_id)
+            candidates.append((tag, read_at or parse_timestamp(now), index, read_at, reader_id))
+
+    # A tag read again at the same plaza and reader within the dedup window is
+    # a double-read of the scan charged first, as it would be online. Scans
+    # charged by an earlier replay stay in so their double-reads still match
+    window = timedelta(seconds=scan_deduplicator.window)
+    candidates.sort(key=lambda candidate: candidate[:3])
+    debits = {}
+    double_reads = []
+    last = None
+    for tag, passed_at, index, read_at, reader_id in candidates:
+        if window and last is not None and last[0] == tag and passed_at - last[1] < window:
+            double_reads.append((index, last[2]))
+            continue
+        last = (tag, passed_at, index)
+        if results[index] is not None:
+            continue
+
+        scan = scans[index]
+        data = dict(scan, scanner_id=reader_id)
+        _check_watchlist(scan['rfid'], data)
+        vehicle_id, vehicle, error = _find_vehicle(scan['rfid'])
+        if error:
+            results[index] = error
+            continue
+
+        timestamp = read_at.isoformat().replace('+00:00', 'Z') if read_at else now
+        vehicle_type = vehicle.get('type', DEFAULT_VEHICLE_TYPE)
+        try:
+            toll_amount = pricing_engine.get_price(
+                vehicle_type, scan.get('tollPlazaId'),
+                when=timezone.localtime(read_at) if read_at else None
+            )
+        except PricingUnavailable:
+            results[index] = _pricing_unavailable()
+            continue
+        record = _transaction_record(vehicle_id, vehicle, data, vehicle_type, toll_amount, timestamp)
+        record['scanId'] = str(scan['scan_id'])
+        record['receivedAt'] = now
+        debits.setdefault(vehicle_id, []).append((passed_at, index, record))
+
+    if debits:
+        charges = {}
+        order = {}
+        for vehicle_id, entries in debits.items():
+            # Debit in the order the vehicle actually passed the readers
+            entries.sort(key=lambda entry: (entry[0], entry[1]))
+            charges[vehicle_id] = [(record['amount'], record) for _, _, record in entries]
+            order[vehicle_id] = [index for _, index, _ in entries]
+
+        outcome = storage.debit_balances(charges)
+        for vehicle_id, indexes in order.items():
+            vehicle_results = outcome.get(vehicle_id) if outcome is not None else None
+            if vehicle_results is None:
+                for index in indexes:
+                    results[index] = (status.HTTP_500_INTERNAL_SERVER_ERROR, {
+                        'error': 'Failed to process payment',
+                        'success': False
+                    })
+                continue
+            for index, (_, record), result in zip(indexes, charges[vehicle_id], vehicle_results):
+                if isinstance(result, InsufficientBalance):
+                    results[index] = (status.HTTP_402_PAYMENT_REQUIRED, _insufficient_payload(record, result.balance))
+                else:
+                    results[index] = (status.HTTP_200_OK, _charged_payload(record, *result))
+
+    # Double-reads point at a scan with a result; repeated scan ids may point
+    # at a double-read, so they are resolved after them
+    for index, original in double_reads + repeats:
+        status_code, payload = results[original]
+        if status_code == status.HTTP_200_OK:
+            payload = {'success': True, 'duplicate': True, 'transaction_id': payload.get('transaction_id')}
+        results[index] = (status_code, payload)
+
+    charged = sum(1 for code, payload in results if code == status.HTTP_200_OK and not payload.get('duplicate'))
+    logger.info(f"Bulk scan batch: {len(scans)} scans, {charged} charged")
+    return results
@@ -1,5 +1,10 @@
+from django.conf import settings
 from django.urls import path
-from . import views
+from . import async_views, views
+
+# Under ASGI (ASYNC_VIEWS) the hot endpoints and the streaming export are served
+# by native async views
+hot_views = async_views if getattr(settings, 'ASYNC_VIEWS', False) else views
 
 urlpatterns = [
     # FIXED - Use the actual function names from your views.py
@@ -9,23 +14,38 @@ urlpatterns = [
     path('admin/vehicles/', views.admin_get_vehicles, name='admin_vehicles'),
     path('admin/owners/', views.admin_get_owners, name='admin_owners'), 
     path('admin/suspended-vehicles/', views.get_suspended_vehicles, name='suspended_vehicles'),
+    path('admin/watchlist/alerts/', views.watchlist_alerts_feed, name='watchlist_alerts'),
+    path('admin/export/<str:collection>/', hot_views.export_records, name='export_records'),
     path('admin/add-owner/', views.admin_add_owner, name='add_owner'),
     path('admin/vehicle/<str:vehicle_id>/status/', views.update_vehicle_status, name='update_vehicle_status'),
+    path('admin/vehicle/<str:vehicle_id>/ledger/', views.vehicle_ledger, name='vehicle_ledger'),
     
     # Owner endpoints
-    path('owner/<str:owner_id>/', views.get_owner_details, name='owner_details'),
-    path('owner/<str:owner_id>/vehicles/', views.get_owner_vehicles, name='owner_vehicles'),
-    path('owner/<str:owner_id>/tolls/', views.get_owner_tolls, name='owner_tolls'),
-    path('owner/<str:owner_id>/payments/', views.get_owner_payments, name='owner_payments'),
+    path('owner/<str:owner_id>/', hot_views.get_owner_details, name='owner_details'),
+    path('owner/<str:owner_id>/vehicles/', hot_views.get_owner_vehicles, name='owner_vehicles'),
+    path('owner/<str:owner_id>/tolls/', hot_views.get_owner_tolls, name='owner_tolls'),
+    path('owner/<str:owner_id>/payments/', hot_views.get_owner_payments, name='owner_payments'),
     
     # Vehicle management
-    path('vehicle/<str:vehicle_id>/recharge/', views.recharge_vehicle, name='recharge_vehicle'),
+    path('vehicle/plate-lookup/', views.lookup_plate, name='lookup_plate'),
+    path('vehicle/<str:vehicle_id>/recharge/', hot_views.recharge_vehicle, name='recharge_vehicle'),
     path('vehicle/<str:vehicle_id>/suspend/', views.suspend_vehicle, name='suspend_vehicle'),
     path('vehicle/<str:vehicle_id>/reactivate/', views.reactivate_vehicle, name='reactivate_vehicle'),
     
     # Toll processing - FIXED function name
-    path('toll/rfid-scan/', views.rfid_toll_scan, name='rfid_scan'),
+    path('toll/rfid-scan/', hot_views.rfid_toll_scan, name='rfid_scan'),
+    path('toll/rfid-scan/bulk/', views.rfid_toll_scan_bulk, name='rfid_scan_bulk'),
     
     # Scanner
     path('scanner/heartbeat/', views.scanner_heartbeat, name='scanner_heartbeat'),
+    path('scanner/fleet/', views.scanner_fleet_status, name='scanner_fleet_status'),
+    
+    # Dashboard
+    path('dashboard/stats/', views.dashboard_stats, name='dashboard_stats'),
+    path('admin/analytics/<str:report>/', views.analytics_report, name='analytics_report'),
+    
+    # Diagnostics
+    path('system/connection-pools/', views.connection_pool_stats, name='connection_pool_stats'),
+    path('system/cache/', views.cache_stats, name='cache_stats'),
+    path('system/readiness/', views.readiness, name='readiness'),
 ]
\ No newline at end of file
@@ -0,0 +1,344 @@
+import bisect
+import logging
+import threading
+import time
+
+from .plates import PlateIndex
+from .watchlist import Watchlist, is_watched
+
+logger = logging.getLogger(__name__)
+
+
+class _Tables:
+    """One generation of the index's lookup tables.
+
+    A rebuild fills a new generation and swaps it in whole; changes to single
+    vehicles are applied in place, adding new keys before removing stale
+    ones, so unlocked readers never see a vehicle missing.
+    """
+
+    def __init__(self, low_balance_threshold, plate_max_distance):
+        self.low_balance_threshold = low_balance_threshold
+        self.by_id = {}
+        self.by_rfid = {}
+        self.plates = PlateIndex(plate_max_distance)
+        self.watchlist = Watchlist()
+        self.by_owner = {}
+        self.sorted_ids = []
+        self.status_counts = {}
+        self.low_balance = 0
+
+    def add(self, vehicle_id, vehicle, keep_sorted=True):
+        if keep_sorted and vehicle_id not in self.by_id:
+            bisect.insort(self.sorted_ids, vehicle_id)
+        self.by_id[vehicle_id] = vehicle
+        rfid = vehicle.get('rfid')
+        if rfid:
+            self.by_rfid[rfid] = vehicle_id
+        self.plates.add(vehicle_id, vehicle.get('licensePlate'))
+        if is_watched(vehicle):
+            self.watchlist.watch(vehicle_id, vehicle)
+        owner_id = vehicle.get('ownerId')
+        if owner_id:
+            self.by_owner.setdefault(owner_id, set()).add(vehicle_id)
+        self.count(vehicle, 1)
+
+    def replace(self, vehicle_id, current, vehicle):
+        """Swap an indexed vehicle's record, re-keying only the fields that changed"""
+        self.by_id[vehicle_id] = vehicle
+        rfid, old_rfid = vehicle.get('rfid'), current.get('rfid')
+        if rfid != old_rfid:
+            if rfid:
+                self.by_rfid[rfid] = vehicle_id
+            if old_rfid and self.by_rfid.get(old_rfid) == vehicle_id:
+                del self.by_rfid[old_rfid]
+        self.plates.move(vehicle_id, current.get('licensePlate'), vehicle.get('licensePlate'))
+        if is_watched(vehicle):
+            self.watchlist.watch(vehicle_id, vehicle)
+        elif is_watched(current):
+            self.watchlist.unwatch(vehicle_id)
+        owner_id, old_owner_id = vehicle.get('ownerId'), current.get('ownerId')
+        if owner_id != old_owner_id:
+            if owner_id:
+                self.by_owner.setdefault(owner_id, set()).add(vehicle_id)
+            self._disown(old_owner_id, vehicle_id)
+        self.count(current, -1)
+        self.count(vehicle, 1)
+
+    def drop(self, vehicle_id):
+        vehicle = self.by_id.pop(vehicle_id, None)
+        if vehicle is None:
+            return
+        position = bisect.bisect_left(self.sorted_ids, vehicle_id)
+        if position < len(self.sorted_ids) and self.sorted_ids[position] == vehicle_id:
+            del self.sorted_ids[position]
+        rfid = vehicle.get('rfid')
+        if rfid and self.by_rfid.get(rfid) == vehicle_id:
+            del self.by_rfid[rfid]
+        self.plates.remove(vehicle_id, vehicle.get('licensePlate'))
+        self.watchlist.unwatch(vehicle_id)
+        self._disown(vehicle.get('ownerId'), vehicle_id)
+        self.count(vehicle, -1)
+
+    def _disown(self, owner_id, vehicle_id):
+        owned = self.by_owner.get(owner_id)
+        if owned is not None:
+            owned.discard(vehicle_id)
+            if not owned:
+                del self.by_owner[owner_id]
+
+    def count(self, vehicle, step):
+        status = vehicle.get('status') or 'unknown'
+        count = self.status_counts.get(status, 0) + step
+        if count:
+            self.status_counts[status] = count
+        else:
+            self.status_counts.pop(status, None)
+        if self._is_low_balance(vehicle):
+            self.low_balance += step
+
+    def _is_low_balance(self, vehicle):
+        try:
+            return float(vehicle.get('balance') or 0) < self.low_balance_threshold
+        except (TypeError, ValueError):
+            return False
+
+
+class VehicleIndex:
+    """Process-local lookup tables over the `vehicles` tree.
+
+    Vehicles are keyed by id and RFID tag, grouped by `ownerId`, and
+    matched by licence plate through a `PlateIndex` that tolerates OCR
+    misreads up to `plate_max_distance` edits. Suspended vehicles are also
+    kept on a `Watchlist` checked on every scan. The index is built once
+    from a full download (via `loader`) and is then kept current from writes
+    made by this service and from Firebase change events passed to
+    `apply_change`. Lookups are plain dict hits taken without the lock (see
+    `_Tables`). Counts by status and of vehicles below
+    `low_balance_threshold` are maintained as vehicles are added and dropped.
+
+    Only a change stream keeps the index current with other writers: from
+    its snapshot `put` at the root until `unpin` is called (the stream was
+    lost), the index never expires. Otherwise it is downloaded again once it
+    is `max_age` seconds old (None: never), so balances and statuses are not
+    served older than that.
+    """
+
+    def __init__(self, loader, low_balance_threshold=10, plate_max_distance=2, max_age=30):
+        self._loader = loader
+        self.low_balance_threshold = low_balance_threshold
+        self.plate_max_distance = plate_max_distance
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._loaded_at = 0
+        self._pinned = False
+        self._tables = _Tables(low_balance_threshold, plate_max_distance)
+
+    @property
+    def loaded(self):
+        return self._loaded
+
+    @property
+    def current(self):
+        """Whether lookups can be answered without downloading the vehicles again"""
+        if not self._loaded:
+            return False
+        return self._pinned or self.max_age is None or time.monotonic() - self._loaded_at < self.max_age
+
+    def unpin(self):
+        """Stop relying on change events (the stream was lost): expire after `max_age`"""
+        with self._lock:
+            if self._pinned:
+                self._pinned = False
+                # Changes may have been missed while the stream was failing
+                self._loaded_at = 0
+
+    def ensure_loaded(self):
+        if self.current:
+            return True
+        with self._lock:
+            if self.current:
+                return True
+            vehicles = self._loader()
+            if vehicles is None:
+                logger.error("Vehicle index could not be built: vehicles unavailable")
+                return False
+            self._rebuild(vehicles)
+            logger.info(f"Vehicle index built with {len(self._tables.by_id)} vehicles")
+            return True
+
+    def reload(self):
+        with self._lock:
+            self._loaded = False
+            return self.ensure_loaded()
+
+    def _rebuild(self, vehicles):
+        tables = _Tables(self.low_balance_threshold, self.plate_max_distance)
+        for vehicle_id, vehicle in (vehicles or {}).items():
+            if isinstance(vehicle, dict):
+                tables.add(vehicle_id, dict(vehicle), keep_sorted=False)
+        tables.sorted_ids = sorted(tables.by_id)
+        self._tables = tables
+        self._loaded = True
+        self._loaded_at = time.monotonic()
+
+    def get(self, vehicle_id):
+        """Return a copy of the vehicle with `vehicle_id`, or None"""
+        if not self.ensure_loaded():
+            return None
+        vehicle = self._tables.by_id.get(vehicle_id)
+        return dict(vehicle) if vehicle is not None else None
+
+    def get_by_rfid(self, rfid):
+        """Return `(vehicle_id, vehicle)` for an RFID tag, or `(None, None)`"""
+        if not rfid or not self.ensure_loaded():
+            return None, None
+        tables = self._tables
+        vehicle_id = tables.by_rfid.get(rfid)
+        vehicle = tables.by_id.get(vehicle_id) if vehicle_id is not None else None
+        if vehicle is None:
+            return None, None
+        return vehicle_id, dict(vehicle)
+
+    def get_by_plate(self, plate):
+        """Return `(vehicle_id, vehicle)` for a licence plate, or `(None, None)`"""
+        if not plate or not self.ensure_loaded():
+            return None, None
+        tables = self._tables
+        vehicle_id = tables.plates.get(plate)
+        vehicle = tables.by_id.get(vehicle_id) if vehicle_id is not None else None
+        if vehicle is None:
+            return None, None
+        return vehicle_id, dict(vehicle)
+
+    def match_plate(self, plate, limit=5):
+        """Return `[(vehicle_id, vehicle, confidence)]` for a plate read, best first"""
+        if not plate or not self.ensure_loaded():
+            return []
+        tables = self._tables
+        matches = []
+        for vehicle_id, confidence in tables.plates.match(plate, limit):
+            vehicle = tables.by_id.get(vehicle_id)
+            if vehicle is not None:
+                matches.append((vehicle_id, dict(vehicle), confidence))
+        return matches
+
+    def check_watchlist(self, rfid=None, plate=None):
+        """Return `(vehicle_id, vehicle, matched_on)` if a tag or plate is watchlisted"""
+        if not self.ensure_loaded():
+            return None, None, None
+        return self._tables.watchlist.check(rfid, plate)
+
+    def watchlist(self):
+        """Return `{vehicle_id: vehicle}` for every watchlisted vehicle"""
+        if not self.ensure_loaded():
+            return None
+        with self._lock:
+            return self._tables.watchlist.entries()
+
+    def get_by_owner(self, owner_id):
+        """Return `{vehicle_id: vehicle}` for every vehicle owned by `owner_id`"""
+        if not self.ensure_loaded():
+            return None
+        with self._lock:
+            tables = self._tables
+            return {
+                vehicle_id: dict(tables.by_id[vehicle_id])
+                for vehicle_id in sorted(tables.by_owner.get(owner_id, ()))
+            }
+
+    def page(self, limit, after=None, predicate=None):
+        """Return `([(vehicle_id, vehicle), ...], next_key)` in id order.
+
+        Starts after the id `after`; `predicate(vehicle)` filters the page.
+        """
+        if not self.ensure_loaded():
+            return None, None
+        with self._lock:
+            tables = self._tables
+            start = bisect.bisect_right(tables.sorted_ids, after) if after is not None else 0
+            items = []
+            next_key = None
+            for position in range(start, len(tables.sorted_ids)):
+                vehicle_id = tables.sorted_ids[position]
+                vehicle = tables.by_id[vehicle_id]
+                if predicate is not None and not predicate(vehicle):
+                    continue
+                if len(items) == limit:
+                    next_key = items[-1][0]
+                    break
+                items.append((vehicle_id, dict(vehicle)))
+            return items, next_key
+
+    def all(self):
+        """Return a `{vehicle_id: vehicle}` snapshot of the index"""
+        if not self.ensure_loaded():
+            return None
+        with self._lock:
+            return {vehicle_id: dict(vehicle) for vehicle_id, vehicle in self._tables.by_id.items()}
+
+    def counts(self):
+        """Return `{'total', 'byStatus', 'lowBalance'}` without scanning the index"""
+        if not self.ensure_loaded():
+            return None
+        with self._lock:
+            tables = self._tables
+            return {
+                'total': len(tables.by_id),
+                'byStatus': dict(tables.status_counts),
+                'lowBalance': tables.low_balance,
+            }
+
+    def upsert(self, vehicle_id, vehicle):
+        """Replace the whole record for `vehicle_id` (None removes it)"""
+        with self._lock:
+            if not self._loaded:
+                return
+            tables = self._tables
+            current = tables.by_id.get(vehicle_id)
+            if not isinstance(vehicle, dict):
+                tables.drop(vehicle_id)
+            elif current is None:
+                tables.add(vehicle_id, dict(vehicle))
+            else:
+                tables.replace(vehicle_id, current, dict(vehicle))
+
+    def update(self, vehicle_id, fields):
+        """Merge `fields` into an indexed vehicle; None values delete keys"""
+        with self._lock:
+            if not self._loaded:
+                return
+            tables = self._tables
+            current = tables.by_id.get(vehicle_id)
+            if current is None:
+                return
+            merged = dict(current)
+            for key, value in fields.items():
+                if value is None:
+                    merged.pop(key, None)
+                else:
+                    merged[key] = value
+            tables.replace(vehicle_id, current, merged)
+
+    def apply_change(self, path, data, event_type='put'):
+        """Apply a Firebase listener event relative to the `vehicles` node"""
+        parts = [part for part in (path or '/').split('/') if part]
+        with self._lock:
+            if event_type == 'patch' and isinstance(data, dict):
+                for key, value in data.items():
+                    self.apply_change('/'.join(parts + [key]), value)
+            elif not parts:
+                self._rebuild(data)
+                self._pinned = True
+            elif len(parts) == 1:
+                if self._loaded:
+                    self.upsert(parts[0], data)
+            elif len(parts) == 2:
+                self.update(parts[0], {parts[1]: data})
+            else:
+                # Deeper writes are rare; fall back to a full rebuild on next read
+                self._loaded = False
+
+    def __len__(self):
+        return len(self._tables.by_id)
@@ -1,10 +1,19 @@
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from .firebase_service import firebase_service
+from .storage import storage
+from .toll_processing import process_toll_scan, process_scan_batch, is_valid_scanner_token
+from .pagination import PageParams, paginated_response
+from .http_pool import pool_stats
+from .heartbeats import heartbeat_registry
+from .stats import format_stats, to_cents
+from .metrics import registry, startup_timings
+from .plates import normalize_plate
+from .watchlist import watchlist_alerts
+from .export import EXPORT_COLLECTIONS, ExportParams, export_chunks, export_response
 import json
 import logging
 from datetime import datetime
@@ -16,8 +25,8 @@ logger = logging.getLogger(__name__)
 def test_firebase(request):
     """Test Firebase connection"""
     try:
-        owners = firebase_service.get_owners()
-        vehicles = firebase_service.get_vehicles()
+        owners = storage.get_owners()
+        vehicles = storage.get_vehicles()
         
         return Response({
             'firebase_connected': True,
@@ -38,21 +47,15 @@ def test_firebase(request):
 def get_owner_details(request, owner_id):
     """Get owner details with their vehicles"""
     try:
-        owners = firebase_service.get_owners()
-        vehicles = firebase_service.get_vehicles()
+        owner = storage.get_owner(owner_id)
         
-        if not owners or owner_id not in owners:
+        if not owner:
             return Response({'error': 'Owner not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        owner = owners[owner_id]
         owner_vehicles = []
-        
-        if vehicles:
-            for vehicle_id, vehicle in vehicles.items():
-                if vehicle.get('ownerId') == owner_id:
-                    vehicle_data = vehicle.copy()
-                    vehicle_data['id'] = vehicle_id
-                    owner_vehicles.append(vehicle_data)
+        for vehicle_id, vehicle in (storage.get_owner_vehicles(owner_id) or {}).items():
+            vehicle['id'] = vehicle_id
+            owner_vehicles.append(vehicle)
         
         return Response({
             'id': owner_id,
@@ -68,15 +71,10 @@ def get_owner_details(request, owner_id):
 def get_owner_vehicles(request, owner_id):
     """Get all vehicles for an owner"""
     try:
-        vehicles = firebase_service.get_vehicles()
         owner_vehicles = []
-        
-        if vehicles:
-            for vehicle_id, vehicle in vehicles.items():
-                if vehicle.get('ownerId') == owner_id:
-                    vehicle_data = vehicle.copy()
-                    vehicle_data['id'] = vehicle_id
-                    owner_vehicles.append(vehicle_data)
+        for vehicle_id, vehicle in (storage.get_owner_vehicles(owner_id) or {}).items():
+            vehicle['id'] = vehicle_id
+            owner_vehicles.append(vehicle)
         
         return Response(owner_vehicles)
     except Exception as e:
@@ -87,22 +85,20 @@ def get_owner_vehicles(request, owner_id):
 def get_owner_payments(request, owner_id):
     """Get payment history for an owner"""
     try:
-        # Get all payments and filter client-side to avoid Firebase index requirement
-        ref = firebase_service.db.reference('payments')
-        all_payments = ref.get()
-        
-        payment_list = []
-        if all_payments:
-            for payment_id, payment in all_payments.items():
-                if payment.get('ownerId') == owner_id:
-                    payment_data = payment.copy()
-                    payment_data['id'] = payment_id
-                    payment_list.append(payment_data)
-        
-        # Sort by timestamp, newest first
-        payment_list.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-        
-        return Response(payment_list)
+        try:
+            page = PageParams.from_request(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Read one page of this owner's entries from the per-owner index, newest first
+        payment_list, next_key = storage.get_owner_records(
+            'payments', owner_id,
+            limit=page.limit, after=page.after, since=page.since, until=page.until
+        )
+        if payment_list is None:
+            return Response({'error': 'Failed to load payments'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return paginated_response(Response(payment_list), next_key)
     except Exception as e:
         logger.error(f"Error getting owner payments: {e}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -111,22 +107,20 @@ def get_owner_payments(request, owner_id):
 def get_owner_tolls(request, owner_id):
     """Get toll history for an owner"""
     try:
-        # Get all transactions and filter client-side
-        ref = firebase_service.db.reference('transactions')
-        all_transactions = ref.get()
-        
-        toll_list = []
-        if all_transactions:
-            for transaction_id, transaction in all_transactions.items():
-                if transaction.get('ownerId') == owner_id:
-                    transaction_data = transaction.copy()
-                    transaction_data['id'] = transaction_id
-                    toll_list.append(transaction_data)
-        
-        # Sort by timestamp, newest first
-        toll_list.sort(key=lambda x: x.get('timestamp', 0), reverse=True)
-        
-        return Response(toll_list)
+        try:
+            page = PageParams.from_request(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Read one page of this owner's entries from the per-owner index, newest first
+        toll_list, next_key = storage.get_owner_records(
+            'transactions', owner_id,
+            limit=page.limit, after=page.after, since=page.since, until=page.until
+        )
+        if toll_list is None:
+            return Response({'error': 'Failed to load tolls'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return paginated_response(Response(toll_list), next_key)
     except Exception as e:
         logger.error(f"Error getting owner tolls: {e}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -141,28 +135,22 @@ def recharge_vehicle(request, vehicle_id):
         if amount <= 0:
             return Response({'error': 'Amount must be positive'}, status=status.HTTP_400_BAD_REQUEST)
         
-        vehicles = firebase_service.get_vehicles()
-        if not vehicles or vehicle_id not in vehicles:
+        vehicle = storage.get_vehicle(vehicle_id)
+        if not vehicle:
             return Response({'error': 'Vehicle not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        vehicle = vehicles[vehicle_id]
-        current_balance = float(vehicle.get('balance', 0))
-        new_balance = current_balance + amount
-        
-        # Update vehicle balance
-        success = firebase_service.update_vehicle_balance(vehicle_id, new_balance)
-        
-        if success:
-            # Record payment
-            payment_data = {
-                'vehicleId': vehicle_id,
-                'ownerId': vehicle.get('ownerId'),
-                'amount': amount,
-                'balanceAfter': new_balance,
-                'timestamp': datetime.now().isoformat()
-            }
-            firebase_service.push_payment_record(payment_data)
-            
+        payment_data = {
+            'vehicleId': vehicle_id,
+            'ownerId': vehicle.get('ownerId'),
+            'amount': amount,
+            'timestamp': datetime.now().isoformat()
+        }
+        
+        # Atomic credit of the balance node, then the payment record
+        result = storage.credit_balance(vehicle_id, amount, payment_data)
+        
+        if result:
+            previous_balance, new_balance, payment_id = result
             return Response({
                 'success': True,
                 'new_balance': new_balance,
@@ -177,19 +165,32 @@ def recharge_vehicle(request, vehicle_id):
 
 @api_view(['GET'])
 def admin_get_vehicles(request):
-    """Get all vehicles for admin"""
+    """Get vehicles for admin, one page at a time, optionally registered in `month` (YYYY-MM)"""
     try:
+        try:
+            page = PageParams.from_request(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
         month = request.GET.get('month')
-        vehicles = firebase_service.get_vehicles()
+        predicate = None
+        if month:
+            try:
+                datetime.strptime(month, '%Y-%m')
+            except ValueError:
+                return Response({'error': 'month must be YYYY-MM'}, status=status.HTTP_400_BAD_REQUEST)
+            predicate = lambda vehicle: str(vehicle.get('createdAt', '')).startswith(month)
+        
+        vehicles, next_key = storage.get_vehicles_page(page.limit, after=page.after, predicate=predicate)
+        if vehicles is None:
+            return Response({'error': 'Failed to load vehicles'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         vehicle_list = []
-        if vehicles:
-            for vehicle_id, vehicle in vehicles.items():
-                vehicle_data = vehicle.copy()
-                vehicle_data['id'] = vehicle_id
-                vehicle_list.append(vehicle_data)
+        for vehicle_id, vehicle in vehicles:
+            vehicle['id'] = vehicle_id
+            vehicle_list.append(vehicle)
         
-        return Response(vehicle_list)
+        return paginated_response(Response(vehicle_list), next_key)
     except Exception as e:
         logger.error(f"Error getting vehicles: {e}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -204,28 +205,59 @@ def update_vehicle_status(request, vehicle_id):
         if new_status not in ['active', 'inactive', 'suspended']:
             return Response({'error': 'Invalid status'}, status=status.HTTP_400_BAD_REQUEST)
         
-        ref = firebase_service.db.reference(f'vehicles/{vehicle_id}')
-        ref.update({'status': new_status})
+        if not storage.update_vehicle(vehicle_id, {'status': new_status}):
+            return Response({'error': 'Failed to update status'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         return Response({'success': True, 'new_status': new_status})
     except Exception as e:
         logger.error(f"Error updating vehicle status: {e}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+def vehicle_ledger(request, vehicle_id):
+    """A vehicle's stored balance next to the one its ledger adds up to"""
+    try:
+        vehicle = storage.get_vehicle(vehicle_id)
+        if not vehicle:
+            return Response({'error': 'Vehicle not found'}, status=status.HTTP_404_NOT_FOUND)
+        
+        ledger = storage.get_ledger_balance(vehicle_id)
+        if ledger is None:
+            return Response({'error': 'Failed to read ledger'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        balance_cents = to_cents(vehicle.get('balance') or 0)
+        return Response({
+            'vehicleId': vehicle_id,
+            'balance': balance_cents / 100,
+            'ledgerBalance': ledger['cents'] / 100,
+            'consistent': balance_cents == ledger['cents'],
+            'snapshot': ledger['snapshot'],
+            'entriesSinceSnapshot': ledger['tailEntries']
+        })
+    except Exception as e:
+        logger.error(f"Error reading ledger of {vehicle_id}: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['GET'])
 def admin_get_owners(request):
-    """Get all owners for admin"""
+    """Get owners for admin, one page at a time"""
     try:
-        owners = firebase_service.get_owners()
-        owner_list = []
+        try:
+            page = PageParams.from_request(request)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        if owners:
-            for owner_id, owner in owners.items():
-                owner_data = owner.copy()
-                owner_data['id'] = owner_id
-                owner_list.append(owner_data)
+        owners, next_key = storage.get_owners_page(page.limit, after=page.after)
+        if owners is None:
+            return Response({'error': 'Failed to load owners'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        owner_list = []
+        for owner_id, owner in owners:
+            owner_data = owner.copy()
+            owner_data['id'] = owner_id
+            owner_list.append(owner_data)
         
-        return Response(owner_list)
+        return paginated_response(Response(owner_list), next_key)
     except Exception as e:
         logger.error(f"Error getting owners: {e}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -242,10 +274,11 @@ def admin_add_owner(request):
             'createdAt': datetime.now().isoformat()
         }
         
-        ref = firebase_service.db.reference('owners')
-        new_owner = ref.push(owner_data)
+        owner_id = storage.add_owner(owner_data)
+        if not owner_id:
+            return Response({'error': 'Failed to add owner'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        return Response({'success': True, 'owner_id': new_owner.key})
+        return Response({'success': True, 'owner_id': owner_id})
     except Exception as e:
         logger.error(f"Error adding owner: {e}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
@@ -258,7 +291,7 @@ def rfid_toll_scan(request):
         token = request.headers.get('X-Scanner-Token') or request.META.get('HTTP_X_SCANNER_TOKEN')
         
         # Allow requests without token (for manual frontend use) or with valid token (for ESP32)
-        if token and token != settings.SCANNER_TOKEN:
+        if not is_valid_scanner_token(token):
             logger.warning(f"Unauthorized scanner access attempt with token: {token}")
             return Response({
                 'error': 'Unauthorized - Invalid scanner token',
@@ -270,131 +303,78 @@ def rfid_toll_scan(request):
         else:
             data = request.POST.dict()
             
-        rfid = data.get('rfid')
-        checkpoint = data.get('checkpoint', 'Unknown')
-        scanner_id = data.get('scanner_id', 'Unknown')
-        
-        logger.info(f"RFID scan received: {rfid} at {checkpoint}")
+        status_code, payload = process_toll_scan(data, request.headers.get('Idempotency-Key'))
+        return Response(payload, status=status_code)
+            
+    except ValueError as e:
+        logger.error(f"Value error in toll processing: {e}")
+        return Response({
+            'error': f'Invalid data: {str(e)}',
+            'success': False
+        }, status=status.HTTP_400_BAD_REQUEST)
         
-        if not rfid:
+    except Exception as e:
+        logger.error(f"Unexpected error in toll processing: {e}")
+        return Response({
+            'error': 'Internal server error',
+            'success': False
+        }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@csrf_exempt
+@api_view(['POST'])
+def rfid_toll_scan_bulk(request):
+    """Replay scans buffered by a reader while its plaza was offline.
+    
+    Body: {"scanner_id": ..., "scans": [{"scan_id", "rfid", "timestamp",
+    "tollPlazaId", "checkpoint"}, ...]}. Responds with one result per scan,
+    in request order; replaying a batch again does not charge twice.
+    """
+    try:
+        token = request.headers.get('X-Scanner-Token') or request.META.get('HTTP_X_SCANNER_TOKEN')
+        if not is_valid_scanner_token(token):
+            logger.warning(f"Unauthorized scanner access attempt with token: {token}")
             return Response({
-                'error': 'RFID tag is required',
+                'error': 'Unauthorized - Invalid scanner token',
                 'success': False
-            }, status=status.HTTP_400_BAD_REQUEST)
-        
-        # Find vehicle by RFID
-        vehicles = firebase_service.get_vehicles()
-        vehicle = None
-        vehicle_id = None
-        
-        if vehicles:
-            for vid, v in vehicles.items():
-                if v.get('rfid') == rfid:
-                    vehicle = v
-                    vehicle_id = vid
-                    break
+            }, status=status.HTTP_401_UNAUTHORIZED)
         
-        if not vehicle:
-            logger.warning(f"Vehicle not found for RFID: {rfid}")
+        scans = request.data.get('scans') if isinstance(request.data, dict) else None
+        if not isinstance(scans, list):
             return Response({
-                'error': 'Vehicle not found',
-                'success': False,
-                'rfid': rfid
-            }, status=status.HTTP_404_NOT_FOUND)
-        
-        # Check vehicle status
-        if vehicle.get('status') != 'active':
-            logger.warning(f"Vehicle {vehicle_id} is not active: {vehicle.get('status')}")
-            return Response({
-                'error': f"Vehicle is {vehicle.get('status')}",
-                'success': False,
-                'license_plate': vehicle.get('licensePlate')
-            }, status=status.HTTP_403_FORBIDDEN)
-        
-        # AUTO-CALCULATE TOLL AMOUNT based on vehicle type
-        vehicle_type = vehicle.get('type', 'Small Car')
-        
-        # Get pricing rules from Firebase
-        pricing_rules_ref = firebase_service.db.reference('pricingRules')
-        pricing_rules = pricing_rules_ref.get()
-        
-        toll_amount = 5.00  # Default fallback
-        
-        if pricing_rules:
-            for rule_id, rule in pricing_rules.items():
-                if rule.get('vehicleType') == vehicle_type and rule.get('isActive'):
-                    toll_amount = float(rule.get('basePrice', 5.00))
-                    break
-        
-        logger.info(f"Vehicle type: {vehicle_type}, Toll amount: ${toll_amount}")
+                'error': 'scans must be a list',
+                'success': False
+            }, status=status.HTTP_400_BAD_REQUEST)
         
-        # Check balance
-        current_balance = float(vehicle.get('balance', 0))
-        if current_balance < toll_amount:
-            logger.warning(f"Insufficient balance: {current_balance} < {toll_amount}")
-            return Response({
-                'error': 'Insufficient balance',
-                'success': False,
-                'current_balance': current_balance,
-                'required_amount': toll_amount,
-                'license_plate': vehicle.get('licensePlate')
-            }, status=status.HTTP_402_PAYMENT_REQUIRED)
-        
-        # Process toll payment
-        new_balance = current_balance - toll_amount
-        
-        # Update vehicle balance in Firebase
-        success = firebase_service.update_vehicle_balance(vehicle_id, new_balance)
-        
-        if success:
-            # Create complete transaction record matching seed data structure
-            transaction_data = {
-                'vehicleId': vehicle_id,
-                'ownerId': vehicle.get('ownerId'),
-                'rfid': rfid,
-                'vehicleType': vehicle_type,
-                'amount': toll_amount,
-                'balanceAfter': new_balance,
-                'tollPlazaId': data.get('tollPlazaId', 'unknown'),
-                'checkpoint': checkpoint,
-                'readerId': scanner_id,
-                'licensePlate': vehicle.get('licensePlate'),
-                'timestamp': datetime.utcnow().isoformat() + 'Z',
-                'status': 'completed'
-            }
-            
-            # Save to global transactions
-            transaction_id = firebase_service.push_toll_record(transaction_data)
-            
-            logger.info(f"Toll processed: {transaction_id} - ${toll_amount} from {vehicle.get('licensePlate')}")
-            
+        max_batch = getattr(settings, 'BULK_SCAN_MAX_BATCH', 10000)
+        if len(scans) > max_batch:
             return Response({
-                'success': True,
-                'transaction_id': transaction_id,
-                'vehicle_type': vehicle_type,
-                'toll_amount': toll_amount,
-                'license_plate': vehicle.get('licensePlate'),
-                'new_balance': new_balance,
-                'previous_balance': current_balance,
-                'checkpoint': checkpoint,
-                'timestamp': transaction_data['timestamp']
-            }, status=status.HTTP_200_OK)
-        else:
-            logger.error(f"Failed to update vehicle balance for {vehicle_id}")
-            return Response({
-                'error': 'Failed to process payment',
+                'error': f'At most {max_batch} scans per batch',
                 'success': False
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-            
-    except ValueError as e:
-        logger.error(f"Value error in toll processing: {e}")
+            }, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        
+        results = process_scan_batch(scans, request.data.get('scanner_id'))
+        
+        summary = {'total': len(results), 'charged': 0, 'duplicates': 0, 'failed': 0}
+        response_results = []
+        for scan, (status_code, payload) in zip(scans, results):
+            if status_code != status.HTTP_200_OK:
+                summary['failed'] += 1
+            elif payload.get('duplicate'):
+                summary['duplicates'] += 1
+            else:
+                summary['charged'] += 1
+            result = {'scan_id': scan.get('scan_id') if isinstance(scan, dict) else None, 'status': status_code}
+            result.update(payload)
+            response_results.append(result)
+        
         return Response({
-            'error': f'Invalid data: {str(e)}',
-            'success': False
-        }, status=status.HTTP_400_BAD_REQUEST)
+            'success': True,
+            'summary': summary,
+            'results': response_results
+        }, status=status.HTTP_200_OK)
         
     except Exception as e:
-        logger.error(f"Unexpected error in toll processing: {e}")
+        logger.error(f"Unexpected error in bulk toll processing: {e}")
         return Response({
             'error': 'Internal server error',
             'success': False
@@ -410,6 +390,9 @@ def scanner_heartbeat(request):
         
         logger.info(f"Heartbeat received from scanner {scanner_id}: {scanner_status}")
         
+        # Recorded in memory; hardwareEndpoints is updated by the periodic flush
+        heartbeat_registry.record_heartbeat(scanner_id, scanner_status, data.get('tollPlazaId'))
+        
         return Response({
             'success': True,
             'message': 'Heartbeat received',
@@ -423,25 +406,77 @@ def scanner_heartbeat(request):
             'success': False
         }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+
+@api_view(['GET'])
+def scanner_fleet_status(request):
+    """Liveness of every known scanner from the heartbeats stored by all workers, with this worker's scan rates"""
+    try:
+        return Response(heartbeat_registry.fleet_status(), status=status.HTTP_200_OK)
+    except Exception as e:
+        logger.error(f"Error getting scanner fleet status: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def watchlist_alerts_feed(request):
+    """Watchlist hits raised by scans, newest last.
+    
+    Poll with ?after=<last id seen>; add &wait=<seconds> to hold the request
+    open until a new alert arrives (long polling, at most 30 seconds).
+    """
+    try:
+        try:
+            after = int(request.query_params.get('after', 0))
+            wait = min(max(float(request.query_params.get('wait', 0)), 0), 30)
+            limit = min(max(int(request.query_params.get('limit', 100)), 1), 1000)
+        except ValueError:
+            return Response({'error': 'after, wait and limit must be numbers'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        alerts, last_id = watchlist_alerts.wait(after, wait, limit)
+        return Response({
+            'alerts': alerts,
+            # A restarted process numbers alerts from 1 again; lastId lets pollers resync
+            'lastId': alerts[-1]['id'] if alerts else last_id
+        })
+    except Exception as e:
+        logger.error(f"Error getting watchlist alerts: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@require_http_methods(['GET'])
+def export_records(request, collection):
+    """Download every transaction or payment as NDJSON or CSV, for reconciliation.
+    
+    ?since=&until= (ISO-8601, inclusive) and ?plaza= narrow the export,
+    ?format=csv switches from NDJSON and ?gzip=1 compresses it. Rows are read
+    from storage in chunks and sent as they are encoded, so memory stays flat
+    however many there are; a storage error cuts the download short.
+    Plain Django view: DRF would claim ?format= for content negotiation.
+    """
+    if collection not in EXPORT_COLLECTIONS:
+        return JsonResponse({'error': f'Unknown collection {collection}'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        params = ExportParams.from_request(request, collection)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    
+    records = storage.iter_records(collection, since=params.since, until=params.until, plaza=params.plaza)
+    return export_response(export_chunks(records, params), params)
+
 @api_view(['POST'])
 def suspend_vehicle(request, vehicle_id):
     """Suspend a vehicle (mark as missing/stolen)"""
     try:
-        # Get vehicle data from Firebase
-        vehicles = firebase_service.get_vehicles()
+        vehicle_data = storage.get_vehicle(vehicle_id)
         
-        if not vehicles or vehicle_id not in vehicles:
+        if not vehicle_data:
             return Response({'error': 'Vehicle not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        vehicle_data = vehicles[vehicle_id]
-        
         # Update vehicle status to suspended
-        ref = firebase_service.db.reference(f'vehicles/{vehicle_id}')
-        ref.update({
+        if not storage.update_vehicle(vehicle_id, {
             'status': 'suspended',
             'suspendedAt': datetime.now().isoformat(),
             'reactivatedAt': None
-        })
+        }):
+            return Response({'error': 'Failed to suspend vehicle'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         return Response({
             'success': True,
@@ -459,24 +494,21 @@ def suspend_vehicle(request, vehicle_id):
 def reactivate_vehicle(request, vehicle_id):
     """Reactivate a suspended vehicle"""
     try:
-        # Get vehicle data from Firebase
-        vehicles = firebase_service.get_vehicles()
+        vehicle_data = storage.get_vehicle(vehicle_id)
         
-        if not vehicles or vehicle_id not in vehicles:
+        if not vehicle_data:
             return Response({'error': 'Vehicle not found'}, status=status.HTTP_404_NOT_FOUND)
         
-        vehicle_data = vehicles[vehicle_id]
-        
         if vehicle_data.get('status') != 'suspended':
             return Response({'error': 'Vehicle is not suspended'}, status=status.HTTP_400_BAD_REQUEST)
         
         # Update vehicle status to active
-        ref = firebase_service.db.reference(f'vehicles/{vehicle_id}')
-        ref.update({
+        if not storage.update_vehicle(vehicle_id, {
             'status': 'active',
             'reactivatedAt': datetime.now().isoformat(),
             'suspendedAt': None
-        })
+        }):
+            return Response({'error': 'Failed to reactivate vehicle'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
         return Response({
             'success': True,
@@ -490,37 +522,153 @@ def reactivate_vehicle(request, vehicle_id):
         logger.error(f"Error reactivating vehicle: {e}")
         return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+@api_view(['GET'])
+def lookup_plate(request):
+    """Match an ANPR/OCR licence plate read to vehicles, with match confidence"""
+    try:
+        plate = request.query_params.get('plate', '')
+        if not normalize_plate(plate):
+            return Response({'error': 'plate is required'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            limit = int(request.query_params.get('limit', 5))
+        except ValueError:
+            return Response({'error': 'limit must be an integer'}, status=status.HTTP_400_BAD_REQUEST)
+        limit = max(1, min(limit, 50))
+        
+        matches = []
+        for vehicle_id, vehicle_data, confidence in storage.match_plate(plate, limit):
+            vehicle_data['id'] = vehicle_id
+            vehicle_data['confidence'] = confidence
+            matches.append(vehicle_data)
+        
+        return Response({
+            'plate': plate,
+            'normalized': normalize_plate(plate),
+            'matches': matches
+        })
+        
+    except Exception as e:
+        logger.error(f"Error looking up plate: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
 @api_view(['GET'])
 def get_suspended_vehicles(request):
     """Get all suspended vehicles for admin missing vehicles report"""
     try:
-        # Get all vehicles from Firebase
-        vehicles = firebase_service.get_vehicles()
+        # Read straight from the watchlist rather than scanning every vehicle
+        vehicles = storage.get_watchlist()
         
         if not vehicles:
             return Response([])
         
         suspended_vehicles = []
         
-        # Filter for suspended vehicles
         for vehicle_id, vehicle_data in vehicles.items():
-            if vehicle_data.get('status') == 'suspended':
-                suspended_vehicles.append({
-                    'id': vehicle_id,
-                    'licensePlate': vehicle_data.get('licensePlate'),
-                    'rfid': vehicle_data.get('rfid'),
-                    'type': vehicle_data.get('type'),
-                    'ownerName': vehicle_data.get('ownerName'),
-                    'ownerId': vehicle_data.get('ownerId'),
-                    'suspendedAt': vehicle_data.get('suspendedAt'),
-                    'make': vehicle_data.get('make'),
-                    'model': vehicle_data.get('model'),
-                    'year': vehicle_data.get('year'),
-                    'balance': vehicle_data.get('balance', 0)
-                })
+            suspended_vehicles.append({
+                'id': vehicle_id,
+                'licensePlate': vehicle_data.get('licensePlate'),
+                'rfid': vehicle_data.get('rfid'),
+                'type': vehicle_data.get('type'),
+                'ownerName': vehicle_data.get('ownerName'),
+                'ownerId': vehicle_data.get('ownerId'),
+                'suspendedAt': vehicle_data.get('suspendedAt'),
+                'make': vehicle_data.get('make'),
+                'model': vehicle_data.get('model'),
+                'year': vehicle_data.get('year'),
+                'balance': vehicle_data.get('balance', 0)
+            })
         
         return Response(suspended_vehicles)
         
     except Exception as e:
         logger.error(f"Error getting suspended vehicles: {e}")
-        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
\ No newline at end of file
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def dashboard_stats(request):
+    """Dashboard totals served from incrementally maintained aggregates"""
+    try:
+        try:
+            hours = int(request.GET.get('hours', 24))
+            days = int(request.GET.get('days', 30))
+        except ValueError:
+            return Response({'error': 'hours and days must be integers'}, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= hours <= 24 * 31 or not 1 <= days <= 366:
+            return Response({'error': 'hours must be 1-744 and days 1-366'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        aggregates = storage.get_stats(hours=hours, days=days)
+        if aggregates is None:
+            return Response({'error': 'Stats unavailable'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        stats = format_stats(aggregates, storage.get_vehicle_counts())
+        stats['generatedAt'] = datetime.now().isoformat()
+        return Response(stats)
+        
+    except Exception as e:
+        logger.error(f"Error getting dashboard stats: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def analytics_report(request, report):
+    """Traffic and revenue reports over the whole transaction history.
+    
+    plaza-hours: tolls and revenue per plaza by hour of day; vehicle-types:
+    per vehicle type; heatmap: by weekday and hour; top-vehicles: the ?limit=
+    vehicles with most tolls, or ?by=revenue. ?since=&until= select whole UTC
+    days, the last 30 by default. Days are summed once and cached.
+    """
+    # Imported here: NumPy is only loaded once analytics are asked for
+    from .analytics import REPORTS, ReportParams, traffic_analytics
+    if report not in REPORTS:
+        return Response({'error': f'Unknown report {report}'}, status=status.HTTP_404_NOT_FOUND)
+    try:
+        params = ReportParams.from_request(request)
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(traffic_analytics.report(report, params))
+    except Exception as e:
+        logger.error(f"Error computing {report} report: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def connection_pool_stats(request):
+    """Live connection counts of the outbound HTTP pools"""
+    try:
+        return Response(pool_stats(), status=status.HTTP_200_OK)
+    except Exception as e:
+        logger.error(f"Error reading connection pool stats: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def cache_stats(request):
+    """Hit/miss counters of the storage read cache"""
+    try:
+        return Response(storage.cache_stats(), status=status.HTTP_200_OK)
+    except Exception as e:
+        logger.error(f"Error reading cache stats: {e}")
+        return Response({'error': str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+@api_view(['GET'])
+def readiness(request):
+    """503 until the realtime change stream has delivered its initial snapshots.
+    
+    Also reports how long this process took to start: storage init, warm-up
+    steps and its first scan.
+    """
+    try:
+        stream = storage.change_stream_status()
+        ready = stream is None or stream['ready']
+        return Response(
+            {'ready': ready, 'changeStream': stream, 'startup': dict(startup_timings)},
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    except Exception as e:
+        logger.error(f"Error reading readiness: {e}")
+        return Response({'ready': False, 'error': str(e)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+
+@require_http_methods(['GET'])
+def metrics(request):
+    """Request, storage and scan metrics in the Prometheus text format"""
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,146 @@
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+
+from django.conf import settings
+
+from .metrics import WATCHLIST_HITS
+from .plates import normalize_plate
+
+logger = logging.getLogger(__name__)
+
+# Vehicle statuses that put a vehicle on the watchlist
+WATCHED_STATUSES = ('suspended',)
+
+
+def is_watched(vehicle):
+    return vehicle.get('status') in WATCHED_STATUSES
+
+
+class Watchlist:
+    """Suspended (missing/stolen) vehicles, keyed for O(1) checks on every scan.
+
+    Holds the watched vehicles by id and, for membership checks, their RFID
+    tags and normalized licence plates. The owner (VehicleIndex) calls
+    `watch`/`unwatch` as vehicles enter and leave a watched status, so
+    suspensions, reactivations and change events keep it current.
+    """
+
+    def __init__(self):
+        self._vehicles = {}
+        self._rfids = {}
+        self._plates = {}
+
+    def clear(self):
+        self._vehicles = {}
+        self._rfids = {}
+        self._plates = {}
+
+    def watch(self, vehicle_id, vehicle):
+        # Keys are added before stale ones are removed, so checks never miss a re-watched vehicle
+        previous = self._vehicles.get(vehicle_id)
+        self._vehicles[vehicle_id] = vehicle
+        if vehicle.get('rfid'):
+            self._rfids[vehicle['rfid']] = vehicle_id
+        plate = normalize_plate(vehicle.get('licensePlate'))
+        if plate:
+            self._plates[plate] = vehicle_id
+        if previous is not None:
+            self._forget(vehicle_id, previous, keep=vehicle)
+
+    def unwatch(self, vehicle_id):
+        vehicle = self._vehicles.pop(vehicle_id, None)
+        if vehicle is not None:
+            self._forget(vehicle_id, vehicle)
+
+    def _forget(self, vehicle_id, vehicle, keep=None):
+        """Drop the keys of `vehicle` that its replacement `keep` does not use"""
+        keep = keep or {}
+        rfid = vehicle.get('rfid')
+        if rfid and rfid != keep.get('rfid') and self._rfids.get(rfid) == vehicle_id:
+            del self._rfids[rfid]
+        plate = normalize_plate(vehicle.get('licensePlate'))
+        if plate and plate != normalize_plate(keep.get('licensePlate')) and self._plates.get(plate) == vehicle_id:
+            del self._plates[plate]
+
+    def check(self, rfid=None, plate=None):
+        """Return (vehicle_id, vehicle, matched_on) for a watched tag or plate, or (None, None, None)"""
+        if rfid:
+            vehicle_id = self._rfids.get(rfid)
+            if vehicle_id is not None:
+                return vehicle_id, dict(self._vehicles[vehicle_id]), 'rfid'
+        plate = normalize_plate(plate)
+        if plate:
+            vehicle_id = self._plates.get(plate)
+            if vehicle_id is not None:
+                return vehicle_id, dict(self._vehicles[vehicle_id]), 'plate'
+        return None, None, None
+
+    def entries(self):
+        """Return `{vehicle_id: vehicle}` for every watched vehicle"""
+        return {vehicle_id: dict(vehicle) for vehicle_id, vehicle in self._vehicles.items()}
+
+    def __len__(self):
+        return len(self._vehicles)
+
+
+class AlertStream:
+    """Bounded in-memory stream of alerts, for admins to poll or long-poll.
+
+    Alerts get increasing integer ids; `since(after)` returns the alerts
+    newer than `after`, and `wait(after, timeout)` blocks until there is
+    one. Only the latest `maxlen` alerts are kept, and each process keeps
+    the alerts raised by the scans it handled.
+    """
+
+    def __init__(self, maxlen=1000):
+        self._alerts = deque(maxlen=maxlen)
+        self._last_id = 0
+        self._condition = threading.Condition()
+
+    def publish(self, alert):
+        with self._condition:
+            self._last_id += 1
+            alert = dict(alert, id=self._last_id)
+            self._alerts.append(alert)
+            self._condition.notify_all()
+        return alert
+
+    def since(self, after=0, limit=100):
+        """Return (alerts, last_id): up to `limit` alerts with id > `after`, oldest first"""
+        with self._condition:
+            alerts = [dict(alert) for alert in self._alerts if alert['id'] > after]
+            return alerts[:limit], self._last_id
+
+    def wait(self, after=0, timeout=0, limit=100):
+        """`since`, but first wait up to `timeout` seconds for an alert newer than `after`"""
+        with self._condition:
+            if timeout > 0:
+                self._condition.wait_for(lambda: self._last_id > after, timeout)
+        return self.since(after, limit)
+
+
+watchlist_alerts = AlertStream(maxlen=getattr(settings, 'WATCHLIST_ALERT_BUFFER', 1000))
+
+
+def report_hit(vehicle_id, vehicle, matched_on, data):
+    """Publish a watchlist hit for the scan `data` and return the alert"""
+    plaza = data.get('tollPlazaId') or 'unknown'
+    WATCHLIST_HITS.inc(plaza=plaza, matched_on=matched_on)
+    logger.warning(f"Watchlist hit: vehicle {vehicle_id} ({vehicle.get('licensePlate')}) "
+                   f"matched on {matched_on} at {plaza}")
+    return watchlist_alerts.publish({
+        'type': 'watchlist_hit',
+        'vehicleId': vehicle_id,
+        'licensePlate': vehicle.get('licensePlate'),
+        'ownerId': vehicle.get('ownerId'),
+        'status': vehicle.get('status'),
+        'matchedOn': matched_on,
+        'rfid': data.get('rfid'),
+        'plateRead': data.get('licensePlate'),
+        'tollPlazaId': plaza,
+        'checkpoint': data.get('checkpoint', 'Unknown'),
+        'readerId': data.get('scanner_id', 'Unknown'),
+        'timestamp': datetime.utcnow().isoformat() + 'Z',
+    })
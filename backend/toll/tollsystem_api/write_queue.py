@@ -0,0 +1,256 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from .metrics import WRITE_BEHIND_RECORDS
+from .record_keys import generate_push_id
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindQueue:
+    """Durable local journal of records waiting to be written to storage.
+
+    `enqueue` appends a record to a SQLite journal and returns its id as soon
+    as the row is committed. A background thread claims batches of pending
+    rows and hands them to `flush(records, replayed)`, which must write them
+    all in one go (e.g. a multi-path update). Each record keeps the push id it
+    was given at enqueue time, so a batch retried after a partial failure
+    overwrites the same paths instead of duplicating records. `replayed` holds
+    the ids of records an earlier claim may already have written (its flush
+    failed, lost its response or its process died before deleting the rows),
+    so that `flush` can leave out whatever is not safe to apply twice.
+
+    A claim is leased for `lease` seconds and renewed while its flush runs,
+    so another process only picks the rows up once their claimer is gone.
+
+    Once the oldest due row has failed `max_attempts` times, each further
+    failure halves the batch claimed with it, narrowing down the records the
+    store rejects. A record that still fails once it is claimed alone is moved
+    to the `dead` table, where it stays until `requeue_dead` puts it back.
+    """
+
+    def __init__(self, path, flush, batch_size=200, flush_interval=0.5,
+                 max_backoff=60, lease=30, max_attempts=8):
+        self.path = str(path)
+        self._flush = flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._local = threading.local()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._worker = None
+        self._worker_pid = None
+        self._start_lock = threading.Lock()
+        self._setup()
+        WRITE_BEHIND_RECORDS.set_function(self.pending_count, state='pending')
+        WRITE_BEHIND_RECORDS.set_function(self.dead_count, state='dead')
+        if self.pending_count():
+            self.start()
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _setup(self):
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS pending (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                collection TEXT NOT NULL,
+                record_id TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt REAL NOT NULL DEFAULT 0
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS dead (
+                seq INTEGER PRIMARY KEY,
+                collection TEXT NOT NULL,
+                record_id TEXT NOT NULL UNIQUE,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                error TEXT,
+                failed_at REAL NOT NULL
+            )
+        ''')
+
+    def enqueue(self, collection, data, record_id=None):
+        """Journal a record for `collection` and return its id"""
+        record_id = record_id or generate_push_id()
+        self._connection().execute(
+            'INSERT OR IGNORE INTO pending (collection, record_id, payload) VALUES (?, ?, ?)',
+            (collection, record_id, json.dumps(data, default=str)),
+        )
+        self.start()
+        self._wakeup.set()
+        return record_id
+
+    def pending_count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM pending').fetchone()[0]
+
+    def dead_count(self):
+        return self._connection().execute('SELECT COUNT(*) FROM dead').fetchone()[0]
+
+    def requeue_dead(self):
+        """Move every dead record back to the pending rows; returns how many"""
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            moved = conn.execute(
+                'INSERT OR IGNORE INTO pending (seq, collection, record_id, payload) '
+                'SELECT seq, collection, record_id, payload FROM dead'
+            ).rowcount
+            conn.execute('DELETE FROM dead')
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        if moved:
+            self.start()
+            self._wakeup.set()
+        return moved
+
+    def start(self):
+        """Start the flush worker in this process if it is not running"""
+        if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._worker is not None and self._worker.is_alive() and self._worker_pid == os.getpid():
+                return
+            self._stopping.clear()
+            self._worker = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._worker_pid = os.getpid()
+            self._worker.start()
+
+    def stop(self, drain=True, timeout=10):
+        """Stop the worker, optionally flushing what is pending first"""
+        if drain:
+            deadline = time.monotonic() + timeout
+            while self.pending_count() and time.monotonic() < deadline:
+                if not self.flush_once():
+                    time.sleep(0.1)
+        self._stopping.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout)
+
+    def _claim(self):
+        """Lease a batch of due rows so other processes sharing the journal skip them"""
+        conn = self._connection()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            head = conn.execute(
+                'SELECT attempts FROM pending WHERE next_attempt <= ? ORDER BY seq LIMIT 1', (now,)
+            ).fetchone()
+            rows = []
+            if head is not None:
+                rows = conn.execute(
+                    'SELECT seq, collection, record_id, payload, attempts, next_attempt FROM pending '
+                    'WHERE next_attempt <= ? ORDER BY seq LIMIT ?',
+                    (now, self._batch_limit(head[0])),
+                ).fetchall()
+            if rows:
+                conn.executemany(
+                    'UPDATE pending SET next_attempt = ? WHERE seq = ?',
+                    [(now + self.lease, row[0]) for row in rows],
+                )
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return rows
+
+    def _batch_limit(self, attempts):
+        """Rows to claim behind a head row that failed `attempts` times"""
+        if attempts < self.max_attempts:
+            return self.batch_size
+        return max(1, self.batch_size >> (attempts - self.max_attempts + 1))
+
+    def _renew(self, rows, done):
+        """Keep extending the lease of claimed rows until `done` is set"""
+        while not done.wait(self.lease / 3):
+            try:
+                self._connection().executemany(
+                    'UPDATE pending SET next_attempt = ? WHERE seq = ?',
+                    [(time.time() + self.lease, row[0]) for row in rows],
+                )
+            except Exception as e:
+                logger.warning(f"Could not renew the write-behind lease of {len(rows)} records: {e}")
+
+    def flush_once(self):
+        """Flush one batch; returns the number of records written"""
+        rows = self._claim()
+        if not rows:
+            return 0
+        records = [(row[1], row[2], json.loads(row[3])) for row in rows]
+        # Rows are only ever claimed with a lease, so one with a deadline was claimed before
+        replayed = {row[2] for row in rows if row[5] > 0}
+        conn = self._connection()
+        done = threading.Event()
+        renewer = threading.Thread(target=self._renew, args=(rows, done), name='write-behind-lease', daemon=True)
+        renewer.start()
+        error = None
+        try:
+            self._flush(records, replayed)
+        except Exception as e:
+            error = e
+        finally:
+            done.set()
+            renewer.join()
+        if error is not None:
+            attempts = max(row[4] for row in rows) + 1
+            if len(rows) == 1 and attempts > self.max_attempts and self._batch_limit(attempts - 1) == 1:
+                logger.error(f"Write-behind record {rows[0][2]} failed {attempts} times, moving it to dead: {error}")
+                self._bury(rows[0], attempts, error)
+                return 0
+            backoff = min(self.max_backoff, 2 ** attempts * 0.5)
+            logger.warning(f"Write-behind flush of {len(rows)} records failed (attempt {attempts}): {error}")
+            conn.executemany(
+                'UPDATE pending SET attempts = attempts + 1, next_attempt = ? WHERE seq = ?',
+                [(time.time() + backoff, row[0]) for row in rows],
+            )
+            return 0
+        conn.executemany('DELETE FROM pending WHERE seq = ?', [(row[0],) for row in rows])
+        return len(rows)
+
+    def _bury(self, row, attempts, error):
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute(
+                'INSERT OR REPLACE INTO dead (seq, collection, record_id, payload, attempts, error, failed_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                (row[0], row[1], row[2], row[3], attempts, str(error), time.time()),
+            )
+            conn.execute('DELETE FROM pending WHERE seq = ?', (row[0],))
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                written = self.flush_once()
+            except Exception as e:
+                logger.error(f"Write-behind worker error: {e}")
+                written = 0
+            if written < self.batch_size:
+                # Let a few more records accumulate so they share one update
+                self._wakeup.wait(self.flush_interval)
+                self._wakeup.clear()